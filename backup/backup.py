@@ -1,24 +1,57 @@
+"""
+Бэкапы базы.
+
+Стратегия BACKUP_STRATEGY:
+  dump - логический дамп (pg_dump) по расписанию BACKUP_SCHEDULE;
+  wal  - непрерывный архив WAL (wal.py) и по расписанию физическая
+         копия (pg_basebackup): восстановление на любой момент с точностью
+         до BACKUP_WAL_SWITCH_SECONDS, в хранилище уходят только изменения.
+         Пользователю DATABASE_URL нужна роль REPLICATION и строка
+         replication в pg_hba.conf.
+
+После каждой копии применяется политика хранения (retention.py).
+Расписание, окно низкой нагрузки, блокировка и метрики - scheduler.py.
+По расписанию BACKUP_VERIFY_SCHEDULE последний дамп восстанавливается в
+пустую базу и сверяется с рабочей на момент дампа (verify.py).
+
+Команды:
+  python backup.py                          планировщик с /metrics и /health
+  python backup.py backup [--kind base]     одна копия
+  python backup.py restore [--time T] (--pgdata DIR | --db-url URL)
+  python backup.py fetch-wal --manifest M NAME PATH   (restore_command)
+  python backup.py prune                    только политика хранения
+  python backup.py verify [--scratch-url URL]   проверка восстановления
+"""
+import argparse
 import os
+import sys
+import threading
 import time
-import subprocess
-import requests
-import datetime
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 
-DB_URL = os.getenv("DATABASE_URL")
-YD_TOKEN = os.getenv("YANDEX_TOKEN")
-BACKUP_DIR = "/backups"
+from manifest import Checksummed, Manifest, utcnow
+from pipeline import BaseBackupStream, DumpStream
+from restore import fetch_wal, restore
+from retention import apply_retention
+from scheduler import BackupLock, ManifestLock, Scheduler, VERIFY_LOCK_KEY, metrics, serve_metrics
+from storage import open_storage
+from verify import ExportedSnapshot, FINGERPRINTS, VERIFY_DB_URL, scratch_params, verify_latest
+from wal import WalArchiver, segment_for_lsn
 
-BACKUP_INTERVAL = 86400
+DB_URL = os.getenv("DATABASE_URL")
+STRATEGY = os.getenv("BACKUP_STRATEGY", "dump")
+# Проверка восстановления последнего дампа (verify.py); пусто - не проверять
+VERIFY_SCHEDULE = os.getenv("BACKUP_VERIFY_SCHEDULE", "0 5 * * 0")
 
 
-def get_db_params():
+def get_db_params(url=DB_URL):
     """Безопасный парсинг DATABASE_URL"""
     try:
-        parsed = urlparse(DB_URL)
+        parsed = urlparse(url)
         return {
             "host": parsed.hostname,
-            "port": str(parsed.port),
+            "port": str(parsed.port or 5432),
             "user": parsed.username,
             "password": parsed.password,
             "dbname": parsed.path.lstrip('/')
@@ -28,79 +61,181 @@ def get_db_params():
         return None
 
 
-def create_dump():
-    """Создает дамп базы данных"""
+def backup_filename(kind, extension):
+    prefix = 'backup' if kind == 'dump' else kind
+    return f"{prefix}_{utcnow().strftime('%Y-%m-%d_%H-%M-%S')}{extension}"
+
+
+def open_manifest(storage):
+    """Манифест, изменения которого согласуются с другими процессами через базу"""
+    params = get_db_params()
+    return Manifest.load(storage, locker=lambda: ManifestLock(params))
+
+
+def run_backup(storage, manifest, kind='dump'):
+    """
+    Одна копия под advisory-блокировкой: поток сразу уходит в хранилище,
+    затем запись в манифест и чистка старого. Если другой бэкап уже идет,
+    копия пропускается.
+    """
     params = get_db_params()
     if not params:
-        return None
+        return False
 
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+    try:
+        with BackupLock(params) as acquired:
+            if not acquired:
+                print("[Backup] Другой бэкап этой базы еще идет, пропускаю")
+                metrics.record('locked')
+                return False
+            return _locked_backup(storage, manifest, kind, params)
+    except Exception as e:
+        print(f"[Backup] Ошибка бэкапа: {e}")
+        metrics.record('failed')
+        return False
 
-    filename = f"backup_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')}.sql.gz"
-    filepath = os.path.join(BACKUP_DIR, filename)
 
-    env = os.environ.copy()
-    env["PGPASSWORD"] = params["password"]
+def _locked_backup(storage, manifest, kind, params):
+    if kind == 'dump' and FINGERPRINTS:
+        # Отпечатки таблиц и дамп - из одного снимка (см. verify.py)
+        with ExportedSnapshot(params) as snapshot:
+            tables = snapshot.fingerprints()
+            return _store_backup(storage, manifest, kind, DumpStream(params, snapshot=snapshot.name), tables)
+    stream = BaseBackupStream(params) if kind == 'base' else DumpStream(params)
+    return _store_backup(storage, manifest, kind, stream)
 
-    cmd = (
-        f"pg_dump -h {params['host']} -p {params['port']} -U {params['user']} {params['dbname']} "
-        f"| gzip > {filepath}"
-    )
 
-    print(f"[Backup] Создаю дамп {filename}...")
+def _store_backup(storage, manifest, kind, stream, tables=None):
+    filename = backup_filename(kind, stream.extension)
+    print(f"[Backup] Создаю и загружаю {filename} в {storage} (режим {stream.mode})...")
+    started = time.monotonic()
     try:
-        subprocess.run(cmd, shell=True, env=env, check=True)
-        print("[Backup] Дамп создан локально.")
-        return filepath, filename
-    except subprocess.CalledProcessError as e:
-        print(f"[Backup] Ошибка pg_dump: {e}")
-        return None, None
-
+        checksummed = Checksummed(iter(stream))
+        storage.put(filename, checksummed)
+        entry = {
+            'kind': kind,
+            'file': filename,
+            'size': checksummed.size,
+            'sha256': checksummed.sha256,
+            'finished': utcnow().isoformat(timespec='seconds'),
+        }
+        if kind == 'base':
+            lsn, timeline = stream.start_point
+            if lsn is None:
+                raise RuntimeError("pg_basebackup не сообщил начало копии")
+            entry['start_wal'] = segment_for_lsn(lsn, timeline)
+        if tables is not None:
+            entry['tables'] = tables
+        manifest.add_backup(storage, entry)
+    except Exception as e:
+        print(f"[Backup] Ошибка бэкапа: {e}")
+        metrics.record('failed')
+        return False
 
-def upload_to_yandex(filepath, filename):
-    """Загружает файл на Яндекс.Диск"""
-    print(f"[Backup] Загружаю на Яндекс.Диск...")
-    headers = {"Authorization": f"OAuth {YD_TOKEN}"}
+    metrics.record_success(kind, time.monotonic() - started, stream.raw_bytes, checksummed.size)
+    print(f"[Backup] Успешно загружено: {stream.summary()}")
+    try:
+        apply_retention(storage, manifest)
+    except Exception as e:
+        print(f"[Backup] Ошибка очистки старых копий: {e}")
+    return True
 
-    target_path = f"/bd_course_backup/{filename}"
 
+def run_verify(storage, manifest, scratch_url=None):
+    """Проверка восстановления последнего дампа (не одновременно с другой проверкой)"""
+    params = get_db_params()
     try:
-        upload_url_resp = requests.get(
-            "https://cloud-api.yandex.net/v1/disk/resources/upload",
-            params={"path": target_path, "overwrite": "true"},
-            headers=headers
-        )
+        scratch = scratch_params(params, get_db_params(scratch_url) if scratch_url else None)
+        with BackupLock(params, key=VERIFY_LOCK_KEY) as acquired:
+            if not acquired:
+                print("[Backup] Проверка восстановления уже идет, пропускаю")
+                return False
+            result = verify_latest(storage, manifest, scratch)
+    except Exception as e:
+        print(f"[Backup] Ошибка проверки восстановления: {e}")
+        metrics.record_verification(None)
+        return False
+    metrics.record_verification(result)
+    return result['ok']
 
-        if upload_url_resp.status_code != 200:
-            print(f"[Backup] Ошибка API Яндекса: {upload_url_resp.json()}")
-            return
 
-        href = upload_url_resp.json().get("href")
+def run_scheduler():
+    storage = open_storage()
+    manifest = open_manifest(storage)
+    metrics.seed(manifest)
+    serve_metrics()
 
-        with open(filepath, 'rb') as f:
-            upload_resp = requests.put(href, files={"file": f})
+    kind = 'dump'
+    if STRATEGY == 'wal':
+        kind = 'base'
+        WalArchiver(get_db_params(), storage, manifest).start()
 
-        if upload_resp.status_code == 201:
-            print(f"[Backup] Успешно загружено на Яндекс.Диск!")
-        else:
-            print(f"[Backup] Ошибка загрузки: {upload_resp.status_code}")
+    if VERIFY_SCHEDULE:
+        verifier = Scheduler(lambda: run_verify(storage, manifest, VERIFY_DB_URL), get_db_params(),
+                             name='verify', schedule=VERIFY_SCHEDULE)
+        threading.Thread(target=verifier.run_forever, name='restore-verify', daemon=True).start()
 
-    except Exception as e:
-        print(f"[Backup] Ошибка сети: {e}")
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            print("[Backup] Локальный файл удален.")
+    Scheduler(lambda: run_backup(storage, manifest, kind), get_db_params()).run_forever()
 
 
-def run_scheduler():
-    while True:
-        filepath, filename = create_dump()
-        if filepath:
-            upload_to_yandex(filepath, filename)
-        time.sleep(BACKUP_INTERVAL)
+def parse_time(value):
+    """Момент восстановления в ISO UTC; время без зоны считается UTC"""
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бэкапы базы UniDesk")
+    commands = parser.add_subparsers(dest='command')
+
+    backup_cmd = commands.add_parser('backup', help="одна копия")
+    backup_cmd.add_argument('--kind', choices=('dump', 'base'), default='dump')
+
+    restore_cmd = commands.add_parser('restore', help="восстановление на момент времени")
+    restore_cmd.add_argument('--time', help="момент (ISO, по умолчанию UTC); без него - последний")
+    target = restore_cmd.add_mutually_exclusive_group(required=True)
+    target.add_argument('--pgdata', help="пустой каталог для физической копии и WAL")
+    target.add_argument('--db-url', help="пустая база для логического дампа")
+
+    fetch_cmd = commands.add_parser('fetch-wal', help="restore_command для PostgreSQL")
+    fetch_cmd.add_argument('--manifest', required=True)
+    fetch_cmd.add_argument('name')
+    fetch_cmd.add_argument('destination')
+
+    commands.add_parser('prune', help="применить политику хранения")
+
+    verify_cmd = commands.add_parser('verify', help="восстановить последний дамп в пустую базу и сверить")
+    verify_cmd.add_argument('--scratch-url', default=VERIFY_DB_URL,
+                            help="база для проверки (пересоздается); по умолчанию <база>_verify")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        run_scheduler()
+        return 0
+
+    storage = open_storage()
+    if args.command == 'backup':
+        return 0 if run_backup(storage, open_manifest(storage), args.kind) else 1
+    if args.command == 'restore':
+        params = get_db_params(args.db_url) if args.db_url else None
+        restore(storage, parse_time(args.time), pgdata=args.pgdata, params=params)
+        return 0
+    if args.command == 'fetch-wal':
+        return 0 if fetch_wal(storage, args.manifest, args.name, args.destination) else 1
+    if args.command == 'prune':
+        with BackupLock(get_db_params()) as acquired:
+            if not acquired:
+                print("[Backup] Идет бэкап, очистка пропущена")
+                return 1
+            apply_retention(storage, open_manifest(storage))
+        return 0
+    if args.command == 'verify':
+        return 0 if run_verify(storage, open_manifest(storage), args.scratch_url) else 1
 
 
 if __name__ == "__main__":
-    run_scheduler()
+    sys.exit(main())
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Доступ по протоколу репликации из сети compose для BACKUP_STRATEGY=wal
+# (pg_basebackup и pg_receivewal контейнера backup). Выполняется только
+# при инициализации нового тома postgres_data.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
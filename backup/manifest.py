@@ -0,0 +1,130 @@
+"""
+Манифест бэкапов: какие копии и сегменты WAL лежат в хранилище.
+
+manifest.json хранится рядом с бэкапами и перезаписывается целиком после
+каждого изменения. Для каждого файла записаны размер и sha256 того, что
+лежит в хранилище (после сжатия): restore проверяет их при скачивании.
+Файл попадает в манифест только после успешной загрузки, а удаляется из
+хранилища только после того, как манифест без него сохранен.
+
+Манифест меняют несколько процессов (планировщик, архиватор WAL, ручные
+backup/prune/verify), поэтому каждое изменение - чтение-изменение-запись
+под межпроцессной блокировкой (Manifest.updating): сохраненный манифест
+перечитывается, изменение применяется к нему, и только затем он
+записывается. Копия в памяти процесса между изменениями может отставать.
+"""
+import hashlib
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+from storage import BackupNotFound
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class Checksummed:
+    """Пропускает куски насквозь, считая размер и sha256"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            self._digest.update(chunk)
+            yield chunk
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+
+def verified(chunks, entry):
+    """Куски файла из хранилища; в конце сверяет размер и sha256 с манифестом"""
+    stream = Checksummed(chunks)
+    yield from stream
+    if stream.size != entry['size'] or stream.sha256 != entry['sha256']:
+        raise ValueError(f"Контрольная сумма {entry['file']} не совпадает с манифестом")
+
+
+class Manifest:
+    """
+    backups: копии (kind 'dump' - логический дамп, 'base' - физическая копия
+    для восстановления по WAL), от старых к новым.
+    wal: сегменты WAL и файлы .history в архиве.
+    verifications: последние проверки восстановления (verify.py).
+    """
+
+    def __init__(self, data=None, locker=None):
+        self.lock = threading.Lock()
+        # Фабрика межпроцессной блокировки (контекстный менеджер) для updating
+        self.locker = locker
+        self._assign(data)
+
+    def _assign(self, data):
+        data = data or {}
+        self.backups = data.get('backups', [])
+        self.wal = data.get('wal', {})
+        self.verifications = data.get('verifications', [])
+
+    @staticmethod
+    def _fetch(storage):
+        try:
+            return json.loads(b''.join(storage.get(MANIFEST_NAME)))
+        except BackupNotFound:
+            return None
+
+    @classmethod
+    def load(cls, storage, locker=None):
+        return cls(cls._fetch(storage), locker)
+
+    def refresh(self, storage):
+        """Перечитывает сохраненный манифест (только для чтения)"""
+        with self.lock:
+            self._assign(self._fetch(storage))
+
+    @contextmanager
+    def updating(self, storage):
+        """
+        Изменение манифеста: под блокировкой перечитывает сохраненный,
+        отдает его блоку для изменения и сохраняет. Изменения других
+        процессов, сделанные с момента загрузки, не теряются.
+        """
+        with self.lock, (self.locker() if self.locker else nullcontext()):
+            self._assign(self._fetch(storage))
+            yield self
+            self.save(storage)
+
+    @classmethod
+    def load_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def to_json(self):
+        return json.dumps({'backups': self.backups, 'wal': self.wal, 'verifications': self.verifications},
+                          ensure_ascii=False, indent=1)
+
+    def save(self, storage):
+        storage.put(MANIFEST_NAME, iter([self.to_json().encode()]))
+
+    def add_backup(self, storage, entry):
+        with self.updating(storage):
+            self.backups.append(entry)
+            self.backups.sort(key=lambda b: b['finished'])
+
+    def add_wal(self, storage, name, entry):
+        with self.updating(storage):
+            self.wal[name] = entry
+
+    def latest_before(self, target_time, kinds=('base', 'dump')):
+        """Самая свежая копия, законченная не позже target_time (ISO-строки сравнимы в UTC)"""
+        candidates = [b for b in self.backups if b['kind'] in kinds and b['finished'] <= target_time]
+        return candidates[-1] if candidates else None
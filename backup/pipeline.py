@@ -0,0 +1,265 @@
+"""
+Потоковый конвейер бэкапа: pg_dump -> сжатие -> загрузка кусками.
+
+Режим stream (по умолчанию): pg_dump пишет архив custom без сжатия
+(-Fc -Z0) в stdout, он читается кусками по BACKUP_CHUNK_SIZE, сжимается
+на лету (zstd в BACKUP_JOBS потоков, если установлен zstandard, иначе
+gzip) и сразу отдается загрузчику. На диск ничего не пишется, в памяти -
+несколько кусков. Такой архив восстанавливается pg_restore -j.
+
+Режим directory: pg_dump -Fd -j BACKUP_JOBS выгружает таблицы параллельно
+(каждая таблица сжимается самим pg_dump), каталог потоком упаковывается
+в tar и загружается. Быстрее на больших базах, но требует места под
+сжатый дамп в BACKUP_WORK_DIR.
+
+BaseBackupStream так же передает физическую копию кластера (pg_basebackup)
+- основу восстановления на момент времени по архиву WAL (см. wal.py).
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_SIZE', str(8 * 1024 * 1024)))
+MODE = os.getenv('BACKUP_MODE', 'stream')
+COMPRESSION = os.getenv('BACKUP_COMPRESSION', 'zstd')
+COMPRESSION_LEVEL = int(os.getenv('BACKUP_COMPRESSION_LEVEL', '3'))
+JOBS = int(os.getenv('BACKUP_JOBS', str(os.cpu_count() or 1)))
+WORK_DIR = os.getenv('BACKUP_WORK_DIR', tempfile.gettempdir())
+PG_DUMP = os.getenv('BACKUP_PG_DUMP', 'pg_dump')
+PG_BASEBACKUP = os.getenv('BACKUP_PG_BASEBACKUP', 'pg_basebackup')
+PSQL = os.getenv('BACKUP_PSQL', 'psql')
+
+
+def pg_connection_args(params):
+    """Аргументы подключения для утилит PostgreSQL (пароль - через окружение)"""
+    return ['-h', params['host'], '-p', params['port'], '-U', params['user']]
+
+
+def pg_env(params):
+    env = os.environ.copy()
+    env['PGPASSWORD'] = params['password'] or ''
+    return env
+
+
+def psql(params, sql):
+    """Выполняет запрос и возвращает значение первой колонки первой строки"""
+    result = subprocess.run(
+        [PSQL, *pg_connection_args(params), '--no-password', '-d', params['dbname'], '-Atc', sql],
+        env=pg_env(params), check=True, capture_output=True, text=True
+    )
+    return result.stdout.strip()
+
+
+class PsqlSession:
+    """
+    Долгая сессия psql через канал: запросы выполняются в одном соединении
+    (транзакция, advisory-блокировка живут, пока сессия открыта).
+    """
+    END_MARKER = '__psql_session_end__'
+
+    def __init__(self, params):
+        self.process = subprocess.Popen(
+            [PSQL, *pg_connection_args(params), '--no-password', '-d', params['dbname'],
+             '-At', '-F', '|', '-v', 'ON_ERROR_STOP=1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=pg_env(params), text=True
+        )
+
+    def query(self, sql):
+        """Строки результата, каждая - список значений колонок"""
+        self.process.stdin.write(f"{sql.rstrip().rstrip(';')};\n\\echo {self.END_MARKER}\n")
+        self.process.stdin.flush()
+        rows = []
+        for line in self.process.stdout:
+            line = line.rstrip('\n')
+            if line == self.END_MARKER:
+                return rows
+            if line:
+                rows.append(line.split('|'))
+        raise RuntimeError("Сессия psql завершилась с ошибкой")
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_compressor(kind=COMPRESSION, level=COMPRESSION_LEVEL, threads=JOBS):
+    """Потоковый компрессор (compress/flush) и расширение файла"""
+    if kind == 'zstd':
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=level, threads=threads).compressobj(), '.zst'
+        print("[Backup] zstandard не установлен, сжимаю gzip")
+    # wbits=31 - формат gzip, совместимый с gunzip
+    return zlib.compressobj(min(level, 9), zlib.DEFLATED, 31), '.gz'
+
+
+def make_decompressor(filename):
+    """Потоковый распаковщик по расширению файла бэкапа (None - без сжатия)"""
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"Для распаковки {filename} нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if filename.endswith('.gz'):
+        return zlib.decompressobj(31)
+    return None
+
+
+def decompress(chunks, filename):
+    """Распаковывает поток кусков по расширению filename"""
+    decompressor = make_decompressor(filename)
+    for chunk in chunks:
+        chunk = decompressor.decompress(chunk) if decompressor else chunk
+        if chunk:
+            yield chunk
+    if decompressor is not None and hasattr(decompressor, 'flush'):
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def compress_file(path, compression=COMPRESSION):
+    """Куски сжатого содержимого локального файла и расширение (для сегментов WAL)"""
+    compressor, extension = make_compressor(compression, threads=1)
+
+    def chunks():
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        yield compressor.flush()
+
+    return chunks(), extension
+
+
+class DumpStream:
+    """
+    Итератор по кускам готового к загрузке бэкапа со статистикой.
+    Процесс pg_dump (или tar) завершается вместе с итерацией; ошибка
+    процесса поднимается в конце, чтобы неполный бэкап не считался успешным.
+    """
+    kind = 'dump'
+    base_extension = '.dump'
+    capture_stderr = False
+
+    def __init__(self, params, mode=MODE, compression=COMPRESSION, snapshot=None):
+        self.params = params
+        self.mode = mode
+        # Снимок, экспортированный другой транзакцией (pg_export_snapshot): дамп видит ровно его
+        self.snapshot_args = [f'--snapshot={snapshot}'] if snapshot else []
+        self.raw_bytes = 0
+        self.output_bytes = 0
+        self.started = None
+        self.finished = None
+        self.stderr = ''
+        self._workdir = None
+
+        if mode == 'directory':
+            self._compressor, self.extension = None, '.tar'
+        else:
+            self._compressor, self.extension = make_compressor(compression)
+            self.extension = self.base_extension + self.extension
+
+    def command(self):
+        if self.mode == 'directory':
+            return self._directory_command()
+        return [PG_DUMP, *pg_connection_args(self.params), '--no-password', '-Fc', '-Z0',
+                *self.snapshot_args, self.params['dbname']]
+
+    def _directory_command(self):
+        """Параллельная выгрузка в каталог, затем tar этого каталога в stdout"""
+        self._workdir = tempfile.mkdtemp(prefix='pg_dump_', dir=WORK_DIR)
+        target = os.path.join(self._workdir, 'dump')
+        subprocess.run(
+            [PG_DUMP, *pg_connection_args(self.params), '--no-password',
+             '-Fd', '-j', str(JOBS), *self.snapshot_args, '-f', target, self.params['dbname']],
+            env=pg_env(self.params), check=True
+        )
+        return ['tar', '-cf', '-', '-C', self._workdir, 'dump']
+
+    def __iter__(self):
+        self.started = time.monotonic()
+        try:
+            command = self.command()
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, env=pg_env(self.params),
+                                       stderr=subprocess.PIPE if self.capture_stderr else None)
+            try:
+                for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                    self.raw_bytes += len(chunk)
+                    if self._compressor is not None:
+                        chunk = self._compressor.compress(chunk)
+                    if chunk:
+                        self.output_bytes += len(chunk)
+                        yield chunk
+
+                if self._compressor is not None:
+                    tail = self._compressor.flush()
+                    self.output_bytes += len(tail)
+                    yield tail
+            finally:
+                if process.poll() is None:
+                    process.kill()  # загрузка прервалась - дамп больше не нужен
+                process.stdout.close()
+                if self.capture_stderr:
+                    self.stderr = process.stderr.read().decode(errors='replace')
+                    process.stderr.close()
+                returncode = process.wait()
+
+            if returncode != 0:
+                if self.stderr:
+                    print(self.stderr)
+                raise subprocess.CalledProcessError(returncode, command[0])
+        finally:
+            self.finished = time.monotonic()
+            if self._workdir:
+                shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        ratio = self.raw_bytes / self.output_bytes if self.output_bytes else 0
+        speed = self.raw_bytes / elapsed / 1024 ** 2 if elapsed > 0 else 0
+        return (f"{self.raw_bytes / 1024 ** 2:.1f} МБ -> {self.output_bytes / 1024 ** 2:.1f} МБ "
+                f"(x{ratio:.2f}) за {elapsed:.1f} с, {speed:.1f} МБ/с")
+
+
+class BaseBackupStream(DumpStream):
+    """
+    Физическая копия кластера (pg_basebackup в tar на stdout) для
+    восстановления на момент времени вместе с архивом WAL. WAL, нужный
+    для согласованности самой копии, включается в нее (-X fetch).
+    После итерации start_point - LSN и линия времени начала копии.
+    """
+    kind = 'base'
+    capture_stderr = True
+    base_extension = '.tar'
+
+    def __init__(self, params, compression=COMPRESSION):
+        super().__init__(params, mode='stream', compression=compression)
+
+    def command(self):
+        return [PG_BASEBACKUP, *pg_connection_args(self.params), '--no-password',
+                '-D', '-', '-Ft', '-X', 'fetch', '--checkpoint=fast', '--verbose']
+
+    @property
+    def start_point(self):
+        """(LSN, timeline) начала копии из вывода pg_basebackup --verbose"""
+        match = re.search(r'write-ahead log start point: ([0-9A-F]+/[0-9A-F]+) on timeline (\d+)', self.stderr)
+        if match is None:
+            return None, None
+        return match.group(1), int(match.group(2))
@@ -0,0 +1,166 @@
+"""
+Восстановление базы из бэкапов на момент времени.
+
+Физическое (--pgdata): в пустой каталог распаковывается последняя
+физическая копия, законченная до целевого момента, и настраивается
+восстановление: PostgreSQL, запущенный на этом каталоге, сам докачает
+нужные сегменты WAL (restore_command -> backup.py fetch-wal), дойдет до
+recovery_target_time и станет основным сервером.
+
+Логическое (--db-url): в существующую пустую базу заливается последний
+логический дамп до целевого момента (архивы pg_dump - в BACKUP_JOBS
+потоков через pg_restore -j).
+
+Все файлы сверяются с размером и sha256 из манифеста при скачивании.
+"""
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from manifest import Manifest, verified
+from pipeline import decompress, pg_connection_args, pg_env, JOBS, PSQL, WORK_DIR
+
+PG_RESTORE = os.getenv('BACKUP_PG_RESTORE', 'pg_restore')
+RESTORE_MANIFEST = 'restore_manifest.json'
+# Как восстанавливаемый сервер вызывает fetch-wal (другой хост - другой путь)
+FETCH_WAL_COMMAND = os.getenv(
+    'BACKUP_FETCH_WAL_COMMAND',
+    f"{sys.executable} {os.path.abspath(os.path.join(os.path.dirname(__file__), 'backup.py'))} fetch-wal"
+)
+
+
+class IterReader:
+    """Файлоподобная обертка над итератором кусков (для tarfile в потоковом режиме)"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def download(storage, entry):
+    """Распакованные куски файла из хранилища с проверкой контрольной суммы"""
+    return decompress(verified(storage.get(entry['file']), entry), entry['file'])
+
+
+def extract_tar(storage, entry, target):
+    with tarfile.open(fileobj=IterReader(download(storage, entry)), mode='r|') as tar:
+        tar.extractall(target, filter='tar')
+
+
+def restore_physical(storage, manifest, backup, pgdata, target_time=None):
+    if os.path.exists(pgdata) and os.listdir(pgdata):
+        raise RuntimeError(f"Каталог {pgdata} не пуст")
+    os.makedirs(pgdata, mode=0o700, exist_ok=True)
+    os.chmod(pgdata, 0o700)
+
+    extract_tar(storage, backup, pgdata)
+
+    # Снимок манифеста: по нему fetch-wal находит сегменты и их контрольные суммы
+    with open(os.path.join(pgdata, RESTORE_MANIFEST), 'w') as f:
+        f.write(manifest.to_json())
+
+    settings = [
+        f"restore_command = '{FETCH_WAL_COMMAND} --manifest {RESTORE_MANIFEST} %f \"%p\"'",
+        "recovery_target_action = 'promote'",
+        "archive_mode = 'off'",
+    ]
+    if target_time:
+        settings.append(f"recovery_target_time = '{target_time}'")
+    with open(os.path.join(pgdata, 'postgresql.auto.conf'), 'a') as f:
+        f.write('\n# Восстановление из бэкапа\n' + '\n'.join(settings) + '\n')
+    open(os.path.join(pgdata, 'recovery.signal'), 'w').close()
+
+
+def _pg_restore(params, source):
+    subprocess.run(
+        [PG_RESTORE, *pg_connection_args(params), '--no-password', '-j', str(JOBS),
+         '-d', params['dbname'], source],
+        env=pg_env(params), check=True
+    )
+
+
+def restore_logical(storage, backup, params):
+    """Архивы pg_dump восстанавливаются в BACKUP_JOBS потоков, простой SQL - через psql"""
+    if '.dump' in backup['file']:
+        # pg_restore -j читает архив с произвольного места: нужен файл, а не поток
+        with tempfile.TemporaryDirectory(prefix='pg_restore_', dir=WORK_DIR) as workdir:
+            archive = os.path.join(workdir, 'backup.dump')
+            with open(archive, 'wb') as f:
+                for chunk in download(storage, backup):
+                    f.write(chunk)
+            _pg_restore(params, archive)
+        return
+
+    if backup['file'].endswith('.tar'):
+        # Дамп в формате каталога
+        with tempfile.TemporaryDirectory(prefix='pg_restore_', dir=WORK_DIR) as workdir:
+            extract_tar(storage, backup, workdir)
+            _pg_restore(params, os.path.join(workdir, 'dump'))
+        return
+
+    process = subprocess.Popen(
+        [PSQL, *pg_connection_args(params), '--no-password', '-q', '-v', 'ON_ERROR_STOP=1',
+         '-d', params['dbname']],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, env=pg_env(params)
+    )
+    try:
+        for chunk in download(storage, backup):
+            process.stdin.write(chunk)
+    finally:
+        process.stdin.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, PSQL)
+
+
+def restore(storage, target_time, pgdata=None, params=None):
+    """
+    Восстанавливает на target_time (ISO в UTC; None - на последний момент).
+    Возвращает запись манифеста использованной копии.
+    """
+    manifest = Manifest.load(storage)
+    kinds = ('base',) if pgdata else ('dump',)
+    latest = '9999'
+    backup = manifest.latest_before(target_time or latest, kinds=kinds)
+    if backup is None:
+        raise RuntimeError(f"Нет копии вида {kinds[0]}, законченной до {target_time}")
+
+    print(f"[Backup] Восстанавливаю из {backup['file']} ({backup['finished']})")
+    if pgdata:
+        restore_physical(storage, manifest, backup, pgdata, target_time)
+        print(f"[Backup] Каталог {pgdata} готов: запустите на нем PostgreSQL, "
+              f"он докачает WAL{' до ' + target_time if target_time else ''} и станет основным")
+    else:
+        restore_logical(storage, backup, params)
+        print("[Backup] Дамп восстановлен")
+    return backup
+
+
+def fetch_wal(storage, manifest_path, name, destination):
+    """restore_command: кладет сегмент name в destination; False - такого сегмента в архиве нет"""
+    manifest = Manifest.load_file(manifest_path)
+    entry = manifest.wal.get(name)
+    if entry is None:
+        return False
+
+    partial = destination + '.fetching'
+    with open(partial, 'wb') as f:
+        for chunk in download(storage, entry):
+            f.write(chunk)
+    os.replace(partial, destination)
+    return True
+
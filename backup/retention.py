@@ -0,0 +1,76 @@
+"""
+Поколенческое хранение копий (дед-отец-сын).
+
+Из копий каждого вида (дампы и физические копии - независимо)
+оставляются самые свежие в каждом из последних BACKUP_KEEP_HOURLY часов,
+BACKUP_KEEP_DAILY дней и BACKUP_KEEP_WEEKLY недель (каждая копия может
+закрывать сразу несколько правил); самая свежая копия остается всегда. Сегменты WAL старше начала самой старой оставшейся физической
+копии для восстановления больше не нужны и удаляются вместе с копиями.
+"""
+import os
+from datetime import datetime
+
+KEEP_HOURLY = int(os.getenv('BACKUP_KEEP_HOURLY', '24'))
+KEEP_DAILY = int(os.getenv('BACKUP_KEEP_DAILY', '7'))
+KEEP_WEEKLY = int(os.getenv('BACKUP_KEEP_WEEKLY', '4'))
+
+GENERATIONS = (
+    (KEEP_HOURLY, lambda moment: (moment.date(), moment.hour)),
+    (KEEP_DAILY, lambda moment: moment.date()),
+    (KEEP_WEEKLY, lambda moment: moment.isocalendar()[:2]),
+)
+
+
+def select_kept(backups, generations=GENERATIONS):
+    """Файлы копий, которые остаются по правилам поколений (отдельно для каждого вида)"""
+    kinds = {b['kind'] for b in backups}
+    if len(kinds) > 1:
+        return set().union(*(select_kept([b for b in backups if b['kind'] == kind], generations)
+                             for kind in kinds))
+
+    newest_first = sorted(backups, key=lambda b: b['finished'], reverse=True)
+    kept = {newest_first[0]['file']} if newest_first else set()
+
+    for keep, period in generations:
+        seen = set()
+        for backup in newest_first:
+            if len(seen) >= keep:
+                break
+            bucket = period(datetime.fromisoformat(backup['finished']))
+            if bucket not in seen:
+                seen.add(bucket)
+                kept.add(backup['file'])
+    return kept
+
+
+def _segment_key(name):
+    """Позиция сегмента без линии времени: сегменты сравниваются по LSN"""
+    return name[8:]
+
+
+def apply_retention(storage, manifest):
+    """Удаляет лишние копии и ненужные им сегменты WAL; возвращает число удаленных файлов"""
+    with manifest.updating(storage):
+        kept = select_kept(manifest.backups)
+        dropped = [b for b in manifest.backups if b['file'] not in kept]
+        manifest.backups = [b for b in manifest.backups if b['file'] in kept]
+
+        base_starts = [_segment_key(b['start_wal']) for b in manifest.backups if b['kind'] == 'base']
+        dropped_wal = []
+        if base_starts:
+            oldest = min(base_starts)
+            dropped_wal = [name for name in manifest.wal
+                           if not name.endswith('.history') and _segment_key(name) < oldest]
+        dropped_files = [b['file'] for b in dropped] + [manifest.wal.pop(name)['file'] for name in dropped_wal]
+
+    # Манифест без этих файлов уже сохранен (updating): он никогда не ссылается на удаленное
+    if not dropped_files:
+        return 0
+
+    for name in dropped_files:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            print(f"[Backup] Не удалось удалить {name}: {e}")
+    print(f"[Backup] Удалено по политике хранения: {len(dropped)} копий, {len(dropped_wal)} сегментов WAL")
+    return len(dropped_files)
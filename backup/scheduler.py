@@ -0,0 +1,425 @@
+"""
+Планировщик бэкапов, блокировка и метрики.
+
+Запуски считаются по расписанию BACKUP_SCHEDULE в формате cron (минута,
+час, день месяца, месяц, день недели; время UTC) от запланированного
+момента, а не от конца прошлого бэкапа, поэтому время запуска не
+уползает. Если бэкап шел дольше интервала, пропущенные запуски не
+догоняются. К каждому запуску добавляется случайная задержка до
+BACKUP_JITTER_SECONDS, чтобы бэкапы нескольких баз не стартовали разом.
+
+BACKUP_WINDOW ("01:00-05:00", UTC, может переходить через полночь) -
+окно низкой нагрузки: запуск вне окна переносится на его начало. Пока в
+базе больше BACKUP_MAX_ACTIVE активных запросов, запуск откладывается,
+но не дольше конца окна (или BACKUP_MAX_DELAY_SECONDS без окна).
+
+Одновременно идет только один бэкап базы: его держит advisory-блокировка
+PostgreSQL на время копии, второй запуск (другой контейнер, ручной
+backup.py backup) пропускается.
+
+Метрики последнего бэкапа и возраст последней успешной копии отдаются по
+HTTP на BACKUP_METRICS_PORT: /metrics (Prometheus), /health (503, если
+успешной копии не было дольше BACKUP_MAX_AGE_SECONDS). Новое развертывание
+без копий до первой попытки бэкапа (но не дольше BACKUP_MAX_AGE_SECONDS с
+запуска) отвечает 200 со статусом pending.
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline import PsqlSession, psql
+
+SCHEDULE = os.getenv('BACKUP_SCHEDULE', '0 3 * * *')
+JITTER_SECONDS = float(os.getenv('BACKUP_JITTER_SECONDS', '300'))
+WINDOW = os.getenv('BACKUP_WINDOW')
+MAX_ACTIVE = int(os.getenv('BACKUP_MAX_ACTIVE', '0'))  # 0 - не смотреть на нагрузку
+BUSY_RETRY_SECONDS = float(os.getenv('BACKUP_BUSY_RETRY_SECONDS', '300'))
+MAX_DELAY_SECONDS = float(os.getenv('BACKUP_MAX_DELAY_SECONDS', '7200'))
+LOCK_KEY = int(os.getenv('BACKUP_LOCK_KEY', '7301'))
+VERIFY_LOCK_KEY = LOCK_KEY + 1
+MANIFEST_LOCK_KEY = LOCK_KEY + 2
+METRICS_PORT = int(os.getenv('BACKUP_METRICS_PORT', '9188'))
+MAX_AGE_SECONDS = float(os.getenv('BACKUP_MAX_AGE_SECONDS', str(26 * 3600)))
+# Если задан, /metrics доступен по заголовку Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+class CronSchedule:
+    """Выражение cron из пяти полей: *, числа, диапазоны a-b, шаги */n и a-b/n, списки через запятую"""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    SEARCH_LIMIT = timedelta(days=5 * 366)
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"В расписании '{expression}' должно быть 5 полей")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}  # 0 и 7 - воскресенье
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def __str__(self):
+        return self.expression
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for item in field.split(','):
+            span, _, step = item.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(part) for part in span.split('-', 1))
+            else:
+                start = int(span)
+                end = high if step else start
+            if not low <= start <= end <= high:
+                raise ValueError(f"Значение '{item}' вне диапазона {low}-{high}")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        # Как в cron: если заданы оба поля, достаточно совпадения одного
+        if not self.any_day and not self.any_weekday:
+            return in_month or in_week
+        return in_month and in_week
+
+    def next_after(self, moment):
+        """Первый момент расписания строго после moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + self.SEARCH_LIMIT
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Расписание '{self.expression}' никогда не срабатывает")
+
+
+class Window:
+    """Суточное окно "HH:MM-HH:MM" в UTC"""
+
+    def __init__(self, spec):
+        start, end = spec.split('-')
+        self.start = self._minutes(start)
+        self.end = self._minutes(end)
+
+    @staticmethod
+    def _minutes(value):
+        hours, minutes = value.strip().split(':')
+        return int(hours) * 60 + int(minutes)
+
+    def _offset(self, moment):
+        """Минут от начала окна (по модулю суток)"""
+        return (moment.hour * 60 + moment.minute - self.start) % (24 * 60)
+
+    def _length(self):
+        return (self.end - self.start) % (24 * 60) or 24 * 60
+
+    def contains(self, moment):
+        return self._offset(moment) < self._length()
+
+    def next_start(self, moment):
+        """Ближайшее начало окна не раньше moment"""
+        start = moment.replace(hour=self.start // 60, minute=self.start % 60, second=0, microsecond=0)
+        return start if start >= moment else start + timedelta(days=1)
+
+    def end_of(self, moment):
+        """Конец окна, в котором находится moment"""
+        start = moment.replace(second=0, microsecond=0) - timedelta(minutes=self._offset(moment))
+        return start + timedelta(minutes=self._length())
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class BackupLock:
+    """
+    Сессионная advisory-блокировка на время бэкапа. Ее держит отдельный
+    процесс psql: если бэкап упадет вместе с процессом, блокировка
+    освободится с закрытием сессии.
+    """
+
+    def __init__(self, params, key=LOCK_KEY):
+        self.params = params
+        self.key = key
+        self.session = None
+
+    def __enter__(self):
+        self.session = PsqlSession(self.params)
+        try:
+            acquired = self.session.query(f"SELECT pg_try_advisory_lock({self.key})") == [['t']]
+        except RuntimeError:
+            self.session.close()
+            raise RuntimeError("Не удалось подключиться к базе для блокировки бэкапа")
+        if not acquired:
+            self.session.close()
+        return acquired
+
+    def __exit__(self, *exc):
+        self.session.close()
+
+
+class ManifestLock(BackupLock):
+    """Ждущая блокировка на чтение-изменение-запись манифеста (держится секунды)"""
+
+    def __init__(self, params):
+        super().__init__(params, key=MANIFEST_LOCK_KEY)
+
+    def __enter__(self):
+        self.session = PsqlSession(self.params)
+        try:
+            self.session.query(f"SELECT pg_advisory_lock({self.key}) IS NULL")
+        except RuntimeError:
+            self.session.close()
+            raise RuntimeError("Не удалось подключиться к базе для блокировки манифеста")
+        return True
+
+
+def active_queries(params):
+    """Число выполняющихся сейчас клиентских запросов, кроме нашего"""
+    return int(psql(params, "SELECT count(*) FROM pg_stat_activity WHERE state = 'active' "
+                            "AND backend_type = 'client backend' AND pid <> pg_backend_pid()"))
+
+
+class BackupMetrics:
+    """Итоги бэкапов процесса для /metrics и /health"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'success': 0, 'failed': 0, 'locked': 0, 'postponed': 0, 'skipped': 0}
+        self.last = None
+        self.last_success = None
+        self.next_run = {}  # имя задачи планировщика -> момент запуска
+        self.verification = None
+        self.started = utcnow()
+
+    def record_success(self, kind, seconds, raw_bytes, stored_bytes):
+        with self._lock:
+            self.counts['success'] += 1
+            self.last = {'kind': kind, 'seconds': seconds, 'raw_bytes': raw_bytes, 'stored_bytes': stored_bytes}
+            self.last_success = utcnow()
+
+    def record(self, event):
+        """failed, locked, postponed или skipped"""
+        with self._lock:
+            self.counts[event] += 1
+
+    def record_verification(self, result):
+        """Итог проверки восстановления (None - проверка не дошла до сверки)"""
+        with self._lock:
+            self.verification = result or {'ok': False}
+
+    def seed(self, manifest):
+        """Последние копия и проверка из манифеста: возраст и RTO переживают перезапуск"""
+        if manifest.backups and self.last_success is None:
+            self.last_success = datetime.fromisoformat(manifest.backups[-1]['finished'])
+        if manifest.verifications and self.verification is None:
+            self.verification = manifest.verifications[-1]
+
+    def last_success_age(self):
+        if self.last_success is None:
+            return None
+        return (utcnow() - self.last_success).total_seconds()
+
+    def status(self):
+        """ok, stale или pending - копий еще нет, и первый бэкап пока не пробовали"""
+        age = self.last_success_age()
+        if age is not None:
+            return 'ok' if age <= MAX_AGE_SECONDS else 'stale'
+        with self._lock:
+            attempted = self.counts['success'] + self.counts['failed'] + self.counts['locked'] > 0
+        if not attempted and (utcnow() - self.started).total_seconds() <= MAX_AGE_SECONDS:
+            return 'pending'
+        return 'stale'
+
+    def health(self):
+        age = self.last_success_age()
+        return {
+            'status': self.status(),
+            'last_success': self.last_success.isoformat(timespec='seconds') if self.last_success else None,
+            'last_success_age_seconds': age,
+            'next_run': {name: moment.isoformat(timespec='seconds') for name, moment in self.next_run.items()},
+            'last': self.last,
+            'verification': self.verification,
+        }
+
+    def prometheus_text(self):
+        with self._lock:
+            counts = dict(self.counts)
+            last = self.last or {}
+            verification = self.verification
+        seconds = last.get('seconds') or 0
+        raw_bytes = last.get('raw_bytes') or 0
+        stored_bytes = last.get('stored_bytes') or 0
+        age = self.last_success_age()
+        lines = [
+            '# HELP myuni_backup_runs_total Запуски бэкапа по итогу (locked - уже шел другой бэкап)',
+            '# TYPE myuni_backup_runs_total counter',
+            *(f'myuni_backup_runs_total{{result="{result}"}} {counts[result]}'
+              for result in ('success', 'failed', 'locked')),
+            '# HELP myuni_backup_postponed_total Откладывания запуска из-за нагрузки на базу',
+            '# TYPE myuni_backup_postponed_total counter',
+            f'myuni_backup_postponed_total {counts["postponed"]}',
+            '# HELP myuni_backup_skipped_total Запуски, пропущенные из-за долгого предыдущего бэкапа',
+            '# TYPE myuni_backup_skipped_total counter',
+            f'myuni_backup_skipped_total {counts["skipped"]}',
+            '# HELP myuni_backup_last_duration_seconds Длительность последнего успешного бэкапа',
+            '# TYPE myuni_backup_last_duration_seconds gauge',
+            f'myuni_backup_last_duration_seconds {seconds:.3f}',
+            '# HELP myuni_backup_last_raw_bytes Размер последнего бэкапа до сжатия',
+            '# TYPE myuni_backup_last_raw_bytes gauge',
+            f'myuni_backup_last_raw_bytes {raw_bytes}',
+            '# HELP myuni_backup_last_stored_bytes Размер последнего бэкапа в хранилище',
+            '# TYPE myuni_backup_last_stored_bytes gauge',
+            f'myuni_backup_last_stored_bytes {stored_bytes}',
+            '# HELP myuni_backup_last_compression_ratio Степень сжатия последнего бэкапа',
+            '# TYPE myuni_backup_last_compression_ratio gauge',
+            f'myuni_backup_last_compression_ratio {raw_bytes / stored_bytes if stored_bytes else 0:.3f}',
+            '# HELP myuni_backup_last_throughput_bytes_per_second Скорость последнего бэкапа (до сжатия)',
+            '# TYPE myuni_backup_last_throughput_bytes_per_second gauge',
+            f'myuni_backup_last_throughput_bytes_per_second {raw_bytes / seconds if seconds else 0:.0f}',
+        ]
+        if age is not None:
+            lines += [
+                '# HELP myuni_backup_last_success_age_seconds Сколько секунд назад закончилась последняя успешная копия',
+                '# TYPE myuni_backup_last_success_age_seconds gauge',
+                f'myuni_backup_last_success_age_seconds {age:.0f}',
+            ]
+        if verification is not None:
+            lines += [
+                '# HELP myuni_backup_verify_ok Последняя проверка восстановления прошла (1) или нет (0)',
+                '# TYPE myuni_backup_verify_ok gauge',
+                f'myuni_backup_verify_ok {int(bool(verification.get("ok")))}',
+            ]
+        if verification and verification.get('restore_seconds') is not None:
+            lines += [
+                '# HELP myuni_backup_restore_seconds Время восстановления последнего дампа при проверке (RTO)',
+                '# TYPE myuni_backup_restore_seconds gauge',
+                f'myuni_backup_restore_seconds {verification["restore_seconds"]:.3f}',
+                '# HELP myuni_backup_restore_seconds_per_gb Время восстановления на гигабайт базы',
+                '# TYPE myuni_backup_restore_seconds_per_gb gauge',
+                f'myuni_backup_restore_seconds_per_gb {verification.get("seconds_per_gb") or 0:.3f}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = BackupMetrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body, content_type):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            health = metrics.health()
+            self._send(200 if health['status'] in ('ok', 'pending') else 503,
+                       json.dumps(health, ensure_ascii=False), 'application/json; charset=utf-8')
+        elif self.path == '/metrics':
+            if METRICS_TOKEN and self.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+                self._send(401, 'Unauthorized\n', 'text/plain; charset=utf-8')
+                return
+            self._send(200, metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            self._send(404, 'Not Found\n', 'text/plain; charset=utf-8')
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port=METRICS_PORT):
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='backup-metrics', daemon=True).start()
+    print(f"[Backup] Метрики: http://0.0.0.0:{port}/metrics, /health")
+    return server
+
+
+class Scheduler:
+
+    def __init__(self, job, params, name='backup', schedule=SCHEDULE, window=WINDOW, jitter=JITTER_SECONDS):
+        self.job = job
+        self.name = name
+        self.params = params
+        self.schedule = CronSchedule(schedule)
+        self.window = Window(window) if window else None
+        self.jitter = jitter
+
+    def next_run(self, after):
+        moment = self.schedule.next_after(after) + timedelta(seconds=random.uniform(0, self.jitter))
+        if self.window is not None and not self.window.contains(moment):
+            moment = self.window.next_start(moment)
+        return moment
+
+    def _wait_for_quiet(self):
+        """Ждет, пока нагрузка на базу не спадет, но не дольше конца окна"""
+        if not MAX_ACTIVE:
+            return
+        now = utcnow()
+        deadline = self.window.end_of(now) if self.window else now + timedelta(seconds=MAX_DELAY_SECONDS)
+        while True:
+            try:
+                active = active_queries(self.params)
+            except Exception as e:
+                print(f"[Backup] Не удалось проверить нагрузку: {e}")
+                return
+            if active <= MAX_ACTIVE:
+                return
+            if utcnow() + timedelta(seconds=BUSY_RETRY_SECONDS) >= deadline:
+                print(f"[Backup] База все еще занята ({active} активных запросов), дольше откладывать нельзя - запускаю")
+                return
+            print(f"[Backup] База занята ({active} активных запросов), откладываю на {BUSY_RETRY_SECONDS:.0f} с")
+            metrics.record('postponed')
+            time.sleep(BUSY_RETRY_SECONDS)
+
+    @staticmethod
+    def _sleep_until(moment):
+        # Короткими отрезками: перевод системных часов не собьет запуск надолго
+        while (remaining := (moment - utcnow()).total_seconds()) > 0:
+            time.sleep(min(remaining, 60))
+
+    def run_forever(self):
+        print(f"[Backup] Расписание {self.name}: '{self.schedule}'"
+              f"{', окно ' + WINDOW if self.window else ''}, разброс до {self.jitter:.0f} с")
+        scheduled = self.next_run(utcnow())
+        while True:
+            metrics.next_run[self.name] = scheduled
+            print(f"[Backup] Следующий запуск {self.name}: {scheduled.isoformat(timespec='seconds')}")
+            self._sleep_until(scheduled)
+            self._wait_for_quiet()
+            try:
+                self.job()
+            except Exception as e:
+                print(f"[Backup] Ошибка запуска: {e}")
+
+            following = self.next_run(scheduled)
+            now = utcnow()
+            if following <= now:
+                print(f"[Backup] {self.name} шел дольше интервала расписания, пропущенные запуски не догоняю")
+                metrics.record('skipped')
+                following = self.next_run(now)
+            scheduled = following
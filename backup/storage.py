@@ -0,0 +1,493 @@
+"""
+Хранилища бэкапов: куда загружаются копии, сегменты WAL и манифест.
+
+Хранилище выбирается BACKUP_SINK:
+  local  - каталог BACKUP_LOCAL_DIR (например, смонтированный диск);
+  s3     - бакет BACKUP_S3_BUCKET в MinIO/S3 (те же MINIO_* , что у приложения);
+  yandex - папка YANDEX_FOLDER на Яндекс.Диске;
+  http   - любой HTTP-приемник с PUT/GET/DELETE по BACKUP_UPLOAD_URL.
+По умолчанию - http, если задан BACKUP_UPLOAD_URL, иначе yandex.
+
+Все хранилища плоские (имя файла без каталогов) и умеют put/get/delete;
+put принимает итератор кусков, get возвращает итератор кусков.
+
+Загрузка многочастная: поток режется на части по BACKUP_PART_SIZE, части
+уходят в BACKUP_UPLOAD_WORKERS потоков, каждая с BACKUP_UPLOAD_RETRIES
+попытками и экспоненциальной задержкой - сбой сети стоит повторной
+передачи одной части, а не всего дампа. В памяти не больше
+BACKUP_UPLOAD_WORKERS + 1 частей. Каждая часть проверяется хранилищем
+(Content-MD5 в S3, md5 ресурса на Яндекс.Диске, sha256 файла локально),
+скорость каждой части попадает в отчет загрузки (UploadReport).
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from minio import Minio
+from minio.datatypes import Part
+from minio.error import S3Error
+
+SINK = os.getenv("BACKUP_SINK")
+YD_TOKEN = os.getenv("YANDEX_TOKEN")
+YD_API_URL = os.getenv("YANDEX_API_URL", "https://cloud-api.yandex.net/v1/disk")
+YD_FOLDER = os.getenv("YANDEX_FOLDER", "/bd_course_backup")
+UPLOAD_URL = os.getenv("BACKUP_UPLOAD_URL")
+LOCAL_DIR = os.getenv("BACKUP_LOCAL_DIR", "/backups")
+S3_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
+S3_ACCESS_KEY = os.getenv("MINIO_ROOT_USER", "minioadmin")
+S3_SECRET_KEY = os.getenv("MINIO_ROOT_PASSWORD", "minioadmin")
+S3_SECURE = os.getenv("MINIO_SECURE", "0").strip().lower() in ("1", "true", "yes", "on")
+S3_BUCKET = os.getenv("BACKUP_S3_BUCKET", "backups")
+# (подключение, ответ приемника после передачи части)
+UPLOAD_TIMEOUT = (30, int(os.getenv("BACKUP_UPLOAD_READ_TIMEOUT", "600")))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PART_SIZE = int(os.getenv("BACKUP_PART_SIZE", str(16 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.getenv("BACKUP_UPLOAD_WORKERS", "4"))
+UPLOAD_RETRIES = int(os.getenv("BACKUP_UPLOAD_RETRIES", "5"))
+RETRY_BACKOFF = float(os.getenv("BACKUP_UPLOAD_BACKOFF", "1"))
+# S3 не принимает части меньше 5 МБ (кроме последней)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class BackupNotFound(Exception):
+    pass
+
+
+class IntegrityError(Exception):
+    """Хранилище сохранило не то, что было отправлено"""
+
+
+class UploadReport:
+    """Итог загрузки файла: размер, sha256 и скорость каждой части"""
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+        self.parts = []  # (номер, байт, секунд, попыток)
+        self.started = time.monotonic()
+        self.finished = None
+        self._digest = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def retries(self):
+        return sum(attempts - 1 for _, _, _, attempts in self.parts)
+
+    def add_data(self, data):
+        self.size += len(data)
+        self._digest.update(data)
+
+    def add_part(self, number, size, seconds, attempts):
+        with self._lock:
+            self.parts.append((number, size, seconds, attempts))
+
+    def part_speeds(self):
+        """МБ/с каждой части в порядке номеров"""
+        return [size / seconds / 1024 ** 2 if seconds > 0 else 0.0
+                for _, size, seconds, _ in sorted(self.parts)]
+
+    def summary(self):
+        speeds = self.part_speeds() or [0.0]
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return (f"{self.name}: {self.size / 1024 ** 2:.1f} МБ, {len(self.parts)} частей за {elapsed:.1f} с; "
+                f"скорость частей мин/сред/макс {min(speeds):.1f}/{sum(speeds) / len(speeds):.1f}/"
+                f"{max(speeds):.1f} МБ/с, повторов {self.retries}")
+
+
+def with_retry(action, what, retries=UPLOAD_RETRIES, backoff=RETRY_BACKOFF):
+    """Выполняет action с повторами; возвращает (результат, число попыток)"""
+    for attempt in range(1, retries + 1):
+        try:
+            return action(), attempt
+        except Exception as e:
+            if attempt == retries:
+                raise
+            # Случайная добавка разводит повторы параллельных частей во времени
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"[Backup] {what}: {e}; повтор через {delay:.1f} с")
+            time.sleep(delay)
+
+
+def split_parts(chunks, part_size, report):
+    """Режет поток кусков на части ровно по part_size (последняя короче, хотя бы одна есть)"""
+    buffer = bytearray()
+    sent = False
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            part = bytes(buffer[:part_size])
+            del buffer[:part_size]
+            report.add_data(part)
+            sent = True
+            yield part
+    if buffer or not sent:
+        part = bytes(buffer)
+        report.add_data(part)
+        yield part
+
+
+def upload_parts(parts, upload_part, report, workers=UPLOAD_WORKERS):
+    """
+    Загружает части параллельно: upload_part(номер, данные) с повторами.
+    Возвращает результаты upload_part по порядку номеров (с 1). Если часть
+    не загрузилась за все попытки, оставшиеся отменяются и ошибка поднимается.
+    """
+    results = {}
+
+    def task(number, data):
+        started = time.monotonic()
+        result, attempts = with_retry(lambda: upload_part(number, data), f"часть {number} файла {report.name}")
+        report.add_part(number, len(data), time.monotonic() - started, attempts)
+        return number, result
+
+    def collect(done):
+        for future in done:
+            number, result = future.result()
+            results[number] = result
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup-upload')
+    try:
+        pending = set()
+        for number, data in enumerate(parts, 1):
+            if len(pending) > workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(task, number, data))
+        done, _ = wait(pending)
+        collect(done)
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
+    report.finished = time.monotonic()
+    return [results[number] for number in sorted(results)]
+
+
+def _iter_response(response):
+    try:
+        yield from response.iter_content(DOWNLOAD_CHUNK_SIZE)
+    finally:
+        response.close()
+
+
+def _log_report(report):
+    if len(report.parts) > 1 or report.retries:
+        print(f"[Backup] Загружено {report.summary()}")
+
+
+class LocalStorage:
+    """Каталог на диске: части пишутся параллельно по своим смещениям в <имя>.partial"""
+
+    def __init__(self, directory=LOCAL_DIR, part_size=PART_SIZE, workers=UPLOAD_WORKERS):
+        self.directory = directory
+        self.part_size = part_size
+        self.workers = workers
+        os.makedirs(directory, exist_ok=True)
+
+    def __str__(self):
+        return self.directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def put(self, name, chunks):
+        path = self._path(name)
+        partial = path + '.partial'
+        report = UploadReport(name)
+        fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640)
+        try:
+            def write_part(number, data):
+                offset = (number - 1) * self.part_size
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, offset)
+                    view, offset = view[written:], offset + written
+
+            upload_parts(split_parts(chunks, self.part_size, report), write_part, report, self.workers)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        # Перечитываем записанное: файл на диске должен совпасть с отправленным потоком
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        if digest.hexdigest() != report.sha256:
+            os.remove(partial)
+            raise IntegrityError(f"Файл {name} записан с ошибкой")
+        os.replace(partial, path)
+        _log_report(report)
+        return report
+
+    def get(self, name):
+        try:
+            f = open(self._path(name), 'rb')
+        except FileNotFoundError:
+            raise BackupNotFound(name)
+
+        def chunks():
+            with f:
+                yield from iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b'')
+        return chunks()
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage:
+    """
+    Бакет в MinIO/S3: multipart upload, части загружаются параллельно с
+    Content-MD5 (хранилище само отвергает поврежденную часть). Если часть
+    так и не загрузилась, загрузка отменяется, чтобы не копить брошенные части.
+
+    Поштучного multipart в публичном API minio нет, поэтому используются его
+    внутренние методы (_create_multipart_upload и др.): версия minio
+    закреплена в requirements.txt на проверенной ветке 7.2.
+    """
+
+    def __init__(self, bucket=S3_BUCKET, part_size=PART_SIZE, workers=UPLOAD_WORKERS):
+        self.client = Minio(S3_ENDPOINT, access_key=S3_ACCESS_KEY, secret_key=S3_SECRET_KEY, secure=S3_SECURE)
+        self.bucket = bucket
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.workers = workers
+        self._bucket_ready = False
+
+    def __str__(self):
+        return f"s3://{self.bucket}"
+
+    def _ensure_bucket(self):
+        if not self._bucket_ready:
+            if not self.client.bucket_exists(self.bucket):
+                self.client.make_bucket(self.bucket)
+            self._bucket_ready = True
+
+    def put(self, name, chunks):
+        self._ensure_bucket()
+        report = UploadReport(name)
+        upload_id, _ = with_retry(lambda: self.client._create_multipart_upload(self.bucket, name, {}),
+                                  f"начало загрузки {name}")
+
+        def send_part(number, data):
+            md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+            etag = self.client._upload_part(self.bucket, name, data, {'Content-MD5': md5}, upload_id, number)
+            return Part(number, etag)
+
+        try:
+            parts = upload_parts(split_parts(chunks, self.part_size, report), send_part, report, self.workers)
+            with_retry(lambda: self.client._complete_multipart_upload(self.bucket, name, upload_id, parts),
+                       f"завершение загрузки {name}")
+        except BaseException:
+            try:
+                self.client._abort_multipart_upload(self.bucket, name, upload_id)
+            except Exception as e:
+                print(f"[Backup] Не удалось отменить загрузку {name}: {e}")
+            raise
+
+        stored = self.client.stat_object(self.bucket, name).size
+        if stored != report.size:
+            raise IntegrityError(f"В хранилище {name} размером {stored} байт вместо {report.size}")
+        _log_report(report)
+        return report
+
+    def get(self, name):
+        try:
+            response = self.client.get_object(self.bucket, name)
+        except S3Error as e:
+            if e.code == 'NoSuchKey':
+                raise BackupNotFound(name)
+            raise
+
+        def chunks():
+            try:
+                yield from response.stream(DOWNLOAD_CHUNK_SIZE)
+            finally:
+                response.close()
+                response.release_conn()
+        return chunks()
+
+    def delete(self, name):
+        self.client.remove_object(self.bucket, name)
+
+
+class PartedStorage:
+    """
+    Многочастная загрузка поверх хранилища без multipart API: части -
+    отдельные файлы <имя>.partNNNNN, их размеры и md5 - в индексе
+    <имя>.parts (пишется последним). Файл из одной части хранится под
+    своим именем. Подклассы реализуют _put_object/_get_object/_delete_object
+    и, если хранилище умеет, _object_md5 для проверки каждой части.
+    """
+
+    def __init__(self, part_size=PART_SIZE, workers=UPLOAD_WORKERS):
+        self.part_size = part_size
+        self.workers = workers
+
+    def _object_md5(self, name):
+        return None
+
+    def _put_verified(self, name, data):
+        md5 = hashlib.md5(data).hexdigest()
+        self._put_object(name, data)
+        stored = self._object_md5(name)
+        if stored is not None and stored != md5:
+            raise IntegrityError(f"md5 {name} в хранилище не совпадает с отправленным")
+        return {'size': len(data), 'md5': md5}
+
+    def put(self, name, chunks):
+        report = UploadReport(name)
+        parts = split_parts(chunks, self.part_size, report)
+        first = next(parts)
+        second = next(parts, None)
+        if second is None:
+            started = time.monotonic()
+            _, attempts = with_retry(lambda: self._put_verified(name, first), f"загрузка {name}")
+            report.add_part(1, len(first), time.monotonic() - started, attempts)
+            report.finished = time.monotonic()
+            _log_report(report)
+            return report
+
+        def all_parts():
+            yield first
+            yield second
+            yield from parts
+
+        uploaded = upload_parts(all_parts(), lambda number, data: self._put_verified(f"{name}.part{number:05d}", data),
+                                report, self.workers)
+        index = json.dumps({'size': report.size, 'sha256': report.sha256, 'parts': uploaded}).encode()
+        with_retry(lambda: self._put_object(f"{name}.parts", index), f"индекс {name}")
+        _log_report(report)
+        return report
+
+    def _index(self, name):
+        try:
+            return json.loads(b''.join(self._get_object(f"{name}.parts")))
+        except BackupNotFound:
+            return None
+
+    def get(self, name):
+        try:
+            return self._get_object(name)
+        except BackupNotFound:
+            index = self._index(name)
+            if index is None:
+                raise
+
+        def chunks():
+            for number in range(1, len(index['parts']) + 1):
+                yield from self._get_object(f"{name}.part{number:05d}")
+        return chunks()
+
+    def delete(self, name):
+        index = self._index(name)
+        if index is not None:
+            for number in range(1, len(index['parts']) + 1):
+                self._delete_object(f"{name}.part{number:05d}")
+            self._delete_object(f"{name}.parts")
+        self._delete_object(name)
+
+
+class HttpStorage(PartedStorage):
+    """Любой HTTP-приемник с PUT/GET/DELETE по адресу <base_url>/<имя> (например, локальный для проверки)"""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def __str__(self):
+        return self.base_url
+
+    def _put_object(self, name, data):
+        response = requests.put(f"{self.base_url}/{name}", data=data, timeout=UPLOAD_TIMEOUT)
+        if response.status_code not in (200, 201, 204):
+            raise RuntimeError(f"Ошибка загрузки {name}: {response.status_code}")
+
+    def _get_object(self, name):
+        response = requests.get(f"{self.base_url}/{name}", stream=True, timeout=UPLOAD_TIMEOUT)
+        if response.status_code == 404:
+            response.close()
+            raise BackupNotFound(name)
+        response.raise_for_status()
+        return _iter_response(response)
+
+    def _delete_object(self, name):
+        response = requests.delete(f"{self.base_url}/{name}", timeout=UPLOAD_TIMEOUT)
+        if response.status_code not in (200, 202, 204, 404):
+            raise RuntimeError(f"Ошибка удаления {name}: {response.status_code}")
+
+
+class YandexStorage(PartedStorage):
+    """Папка YANDEX_FOLDER на Яндекс.Диске; md5 каждой части сверяется с метаданными ресурса"""
+
+    def __init__(self, token=YD_TOKEN, folder=YD_FOLDER, api_url=YD_API_URL, **kwargs):
+        super().__init__(**kwargs)
+        self.headers = {"Authorization": f"OAuth {token}"}
+        self.folder = folder
+        self.api_url = api_url
+
+    def __str__(self):
+        return f"Яндекс.Диск:{self.folder}"
+
+    def _resource(self, endpoint, name, **params):
+        response = requests.get(
+            f"{self.api_url}/resources{endpoint}",
+            params={"path": f"{self.folder}/{name}", **params},
+            headers=self.headers,
+            timeout=30
+        )
+        if response.status_code == 404:
+            raise BackupNotFound(name)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ошибка API Яндекса: {response.text}")
+        return response.json()
+
+    def _put_object(self, name, data):
+        href = self._resource("/upload", name, overwrite="true")["href"]
+        response = requests.put(href, data=data, timeout=UPLOAD_TIMEOUT)
+        if response.status_code not in (200, 201):
+            raise RuntimeError(f"Ошибка загрузки {name}: {response.status_code}")
+
+    def _object_md5(self, name):
+        return self._resource("", name, fields="md5")["md5"]
+
+    def _get_object(self, name):
+        response = requests.get(self._resource("/download", name)["href"], stream=True, timeout=UPLOAD_TIMEOUT)
+        response.raise_for_status()
+        return _iter_response(response)
+
+    def _delete_object(self, name):
+        response = requests.delete(
+            f"{self.api_url}/resources",
+            params={"path": f"{self.folder}/{name}", "permanently": "true"},
+            headers=self.headers,
+            timeout=30
+        )
+        if response.status_code not in (202, 204, 404):
+            raise RuntimeError(f"Ошибка удаления {name}: {response.status_code}")
+
+
+def open_storage(sink=SINK):
+    """Хранилище из окружения (BACKUP_SINK)"""
+    sink = sink or ('http' if UPLOAD_URL else 'yandex')
+    if sink == 'local':
+        return LocalStorage()
+    if sink == 's3':
+        return S3Storage()
+    if sink == 'http':
+        return HttpStorage(UPLOAD_URL)
+    if sink == 'yandex':
+        return YandexStorage()
+    raise ValueError(f"Неизвестное хранилище BACKUP_SINK={sink}")
@@ -0,0 +1,190 @@
+"""
+Проверка восстановления и замер его скорости (измеренный RTO).
+
+При логическом дампе backup.py экспортирует снимок транзакции, считает в
+нем отпечатки таблиц (число строк и контрольную сумму строк) и снимает
+дамп с того же снимка (pg_dump --snapshot): отпечатки в манифесте ровно
+соответствуют содержимому дампа, как бы база ни менялась во время копии.
+
+Проверка берет последний дамп, восстанавливает его в пустую базу
+BACKUP_VERIFY_DB_URL (по умолчанию <база>_verify на том же сервере;
+архивы pg_dump - через pg_restore -j BACKUP_JOBS), сравнивает отпечатки
+всех таблиц из models.py с записанными и замеряет полное время
+восстановления (скачивание, распаковка, загрузка) на гигабайт базы.
+Итог пишется в манифест (verifications) и в метрики планировщика.
+"""
+import ast
+import os
+import time
+
+from manifest import utcnow
+from pipeline import PsqlSession, psql
+from restore import restore_logical
+
+VERIFY_DB_URL = os.getenv('BACKUP_VERIFY_DB_URL')
+MODELS_FILE = os.getenv(
+    'BACKUP_MODELS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'my_university', 'models.py')
+)
+KEEP_SCRATCH = os.getenv('BACKUP_VERIFY_KEEP_DB', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+FINGERPRINTS = os.getenv('BACKUP_FINGERPRINTS', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+HISTORY_LIMIT = 20
+
+
+def model_tables(path=MODELS_FILE):
+    """
+    Имена таблиц из models.py без импорта приложения: __tablename__ классов
+    и Table('имя', ...). None, если файла нет (контейнер без исходников).
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        tree = ast.parse(f.read())
+
+    tables = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) \
+                and any(isinstance(t, ast.Name) and t.id == '__tablename__' for t in node.targets):
+            tables.add(node.value.value)
+        elif isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'Table' \
+                and node.args and isinstance(node.args[0], ast.Constant):
+            tables.add(node.args[0].value)
+    return sorted(tables)
+
+
+def _identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(name):
+    return "'" + name.replace("'", "''") + "'"
+
+
+def fingerprint_sql(tables):
+    """
+    Число строк и сумма первых 64 бит md5 текста каждой строки: сумма не
+    зависит от порядка строк, поэтому совпадает у исходной и восстановленной
+    таблицы при одинаковом содержимом.
+    """
+    return ' UNION ALL '.join(
+        f"SELECT {_literal(table)}, count(*), "
+        f"coalesce(sum(('x' || left(md5(t::text), 16))::bit(64)::bigint::numeric), 0) "
+        f"FROM {_identifier(table)} t"
+        for table in tables
+    )
+
+
+def table_fingerprints(session, tables=None):
+    """{таблица: [строк, контрольная сумма]} по таблицам схемы public (или заданным)"""
+    if tables is None:
+        tables = [row[0] for row in session.query(
+            "SELECT tablename FROM pg_tables WHERE schemaname = 'public' ORDER BY tablename")]
+    if not tables:
+        return {}
+    return {name: [int(rows), checksum] for name, rows, checksum in session.query(fingerprint_sql(tables))}
+
+
+class ExportedSnapshot:
+    """
+    Транзакция REPEATABLE READ, экспортирующая свой снимок для pg_dump
+    --snapshot. Снимок действует, пока транзакция открыта, поэтому
+    сессия держится до конца дампа.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.session = None
+        self.name = None
+
+    def __enter__(self):
+        self.session = PsqlSession(self.params)
+        self.session.query("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        self.name = self.session.query("SELECT pg_export_snapshot()")[0][0]
+        return self
+
+    def fingerprints(self):
+        return table_fingerprints(self.session)
+
+    def __exit__(self, *exc):
+        self.session.close()
+
+
+def scratch_params(params, url_params=None):
+    """Параметры пустой базы для проверки; никогда не совпадают с исходной"""
+    scratch = dict(url_params or params, dbname=(url_params or {}).get('dbname') or f"{params['dbname']}_verify")
+    if (scratch['host'], scratch['port'], scratch['dbname']) == (params['host'], params['port'], params['dbname']):
+        raise ValueError("База для проверки восстановления совпадает с рабочей")
+    return scratch
+
+
+def _recreate(params):
+    admin = dict(params, dbname='postgres')
+    psql(admin, f"DROP DATABASE IF EXISTS {_identifier(params['dbname'])}")
+    psql(admin, f"CREATE DATABASE {_identifier(params['dbname'])} TEMPLATE template0")
+
+
+def _drop(params):
+    psql(dict(params, dbname='postgres'), f"DROP DATABASE IF EXISTS {_identifier(params['dbname'])}")
+
+
+def compare(expected, actual, tables):
+    """Расхождения по таблицам: [(таблица, ожидалось, получено)]"""
+    return [(table, expected.get(table), actual.get(table))
+            for table in tables if expected.get(table) != actual.get(table)]
+
+
+def verify_latest(storage, manifest, scratch, models_file=MODELS_FILE):
+    """
+    Восстанавливает последний дамп в scratch и сверяет таблицы.
+    Возвращает запись проверки (она же добавляется в манифест).
+    """
+    manifest.refresh(storage)  # копия планировщика могла отстать от других процессов
+    backups = [b for b in manifest.backups if b['kind'] == 'dump']
+    if not backups:
+        raise RuntimeError("В хранилище нет логических дампов для проверки")
+    backup = backups[-1]
+    expected = backup.get('tables')
+
+    print(f"[Backup] Проверяю восстановление {backup['file']} в базу {scratch['dbname']}...")
+    _recreate(scratch)
+    try:
+        started = time.monotonic()
+        restore_logical(storage, backup, scratch)
+        seconds = time.monotonic() - started
+
+        tables = model_tables(models_file) or sorted(expected or [])
+        with PsqlSession(scratch) as session:
+            database_bytes = int(session.query("SELECT pg_database_size(current_database())")[0][0])
+            present = {row[0] for row in session.query(
+                "SELECT tablename FROM pg_tables WHERE schemaname = 'public'")}
+            actual = table_fingerprints(session, [t for t in tables if t in present])
+    finally:
+        if not KEEP_SCRATCH:
+            _drop(scratch)
+
+    mismatches = compare(expected, actual, tables) if expected is not None else []
+    gigabytes = database_bytes / 1024 ** 3
+    result = {
+        'file': backup['file'],
+        'verified': utcnow().isoformat(timespec='seconds'),
+        'ok': expected is not None and not mismatches,
+        'tables': len(tables),
+        'rows': sum(rows for rows, _ in actual.values()),
+        'mismatches': [table for table, _, _ in mismatches],
+        'restore_seconds': round(seconds, 3),
+        'backup_bytes': backup['size'],
+        'database_bytes': database_bytes,
+        'seconds_per_gb': round(seconds / gigabytes, 3) if gigabytes else None,
+    }
+
+    for table, want, got in mismatches:
+        print(f"[Backup]   {table}: в дампе {want}, восстановлено {got}")
+    if expected is None:
+        print("[Backup] У дампа нет отпечатков таблиц (снят до их появления), сверка пропущена")
+    print(f"[Backup] Проверка {'пройдена' if result['ok'] else 'НЕ пройдена'}: {len(tables)} таблиц, "
+          f"{result['rows']} строк; восстановление {seconds:.1f} с на {database_bytes / 1024 ** 2:.1f} МБ "
+          f"({result['seconds_per_gb'] or 0:.1f} с/ГБ)")
+
+    with manifest.updating(storage):
+        manifest.verifications = (manifest.verifications + [result])[-HISTORY_LIMIT:]
+    return result
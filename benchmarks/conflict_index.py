@@ -0,0 +1,113 @@
+"""
+Сравнение проверки конфликтов расписания: запросами к БД (как раньше в
+schedule_create/schedule_edit) и через ScheduleConflictIndex.
+
+    python -m benchmarks.conflict_index --lessons 10000 --candidates 2000
+    python -m benchmarks.conflict_index --db-url postgresql+psycopg2://.../scratch_db
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from my_university.models import Base, Schedule
+from my_university.conflicts import ScheduleConflictIndex
+from benchmarks.synthetic import populate_schedule
+
+
+def query_conflicts(session, group_id, teacher_id, classroom_id, day_of_week, time_slot_id):
+    """Старый путь: три отдельных запроса на каждого кандидата"""
+    conflicts = []
+
+    teacher_conflict = session.query(Schedule).filter(
+        Schedule.teacher_id == teacher_id,
+        Schedule.day_of_week == day_of_week,
+        Schedule.time_slot_id == time_slot_id,
+        Schedule.classroom_id != classroom_id,
+    ).first()
+    if teacher_conflict:
+        conflicts.append(('teacher', teacher_conflict.schedule_id))
+
+    room_conflict = session.query(Schedule).filter(
+        Schedule.classroom_id == classroom_id,
+        Schedule.day_of_week == day_of_week,
+        Schedule.time_slot_id == time_slot_id,
+        Schedule.teacher_id != teacher_id,
+    ).first()
+    if room_conflict:
+        conflicts.append(('classroom', room_conflict.schedule_id))
+
+    # Вместо IntegrityError при вставке - такой же по стоимости запрос
+    group_conflict = session.query(Schedule).filter(
+        Schedule.study_group_id == group_id,
+        Schedule.day_of_week == day_of_week,
+        Schedule.time_slot_id == time_slot_id,
+    ).first()
+    if group_conflict:
+        conflicts.append(('group', group_conflict.schedule_id))
+
+    return conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', default='sqlite://', help='scratch-база (по умолчанию SQLite в памяти)')
+    parser.add_argument('--lessons', type=int, default=10000)
+    parser.add_argument('--candidates', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    print(f"Генерация расписания из {args.lessons} занятий...")
+    data = populate_schedule(session, lessons=args.lessons, seed=args.seed)
+    print(f"  занятий: {data['lessons']}, групп: {len(data['groups'])}")
+
+    rng = random.Random(args.seed)
+    candidates = [
+        (rng.choice(data['groups']), rng.choice(data['teachers']), rng.choice(data['classrooms']),
+         rng.randint(1, 6), rng.choice(data['time_slots']))
+        for _ in range(args.candidates)
+    ]
+
+    start = time.perf_counter()
+    query_results = [query_conflicts(session, *c) for c in candidates]
+    query_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = ScheduleConflictIndex.load(session)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_results = [index.find_conflicts(*c) for c in candidates]
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for group_id, teacher_id, classroom_id, day, slot in candidates:
+        ScheduleConflictIndex.load(
+            session, day_of_week=day, time_slot_id=slot,
+            group_id=group_id, teacher_id=teacher_id, classroom_id=classroom_id
+        ).find_conflicts(group_id, teacher_id, classroom_id, day, slot)
+    per_cell_time = time.perf_counter() - start
+
+    found_by_query = sum(1 for r in query_results if r)
+    found_by_index = sum(1 for r in index_results if r)
+
+    print(f"Кандидатов: {len(candidates)}, с конфликтами: запросы {found_by_query}, индекс {found_by_index}")
+    print(f"  запросы (3 на кандидата):     {query_time * 1000:9.1f} мс, "
+          f"{query_time / len(candidates) * 1e6:8.1f} мкс/кандидат")
+    print(f"  индекс: загрузка ({len(index)} строк): {load_time * 1000:9.1f} мс")
+    print(f"  индекс: проверка:             {lookup_time * 1000:9.1f} мс, "
+          f"{lookup_time / len(candidates) * 1e6:8.1f} мкс/кандидат")
+    print(f"  индекс кандидата (1 запрос):  {per_cell_time * 1000:9.1f} мс, "
+          f"{per_cell_time / len(candidates) * 1e6:8.1f} мкс/кандидат")
+
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Индексы миграции 0003: планы и задержки запросов из routes.py до и после.
+
+Заполняет scratch-базу PostgreSQL синтетическим университетом, удаляет
+индексы миграции 0003, снимает EXPLAIN (ANALYZE) и медианное время каждого
+запроса, затем строит индексы той же миграцией и повторяет замеры.
+
+    python -m benchmarks.indexes --db-url postgresql+psycopg2://.../scratch_db \\
+        --lessons 50000 --users 100000 --materials 50000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, select, func, text
+from sqlalchemy.orm import sessionmaker
+
+from my_university.models import (
+    Base, Schedule,
+    Student, Teacher,
+    StudyGroup, EducationMaterial,
+    teacher_subject_association,
+)
+from my_university.conflicts import ScheduleConflictIndex
+from my_university.queries import schedule_query
+from my_university.migrations import upgrade
+from my_university.migrations.m0003_foreign_key_indexes import model_indexes, upgrade as create_indexes
+from benchmarks.synthetic import populate_schedule, populate_people, populate_materials, bulk_insert
+
+
+def workload(session, data, rng):
+    """(название, запрос) - те же условия, что строят маршруты"""
+    group_id = rng.choice(data['groups'])
+    teacher_id = rng.choice(data['teachers'])
+    classroom_id = rng.choice(data['classrooms'])
+    subject_id = rng.choice(data['subjects'])
+    day, slot = rng.randint(1, 6), rng.choice(data['time_slots'])
+
+    return [
+        ('schedule_create: конфликты кандидата',
+         ScheduleConflictIndex.build_query(session, day, slot, group_id, teacher_id, classroom_id)),
+        ('schedule_view: сетка преподавателя',
+         schedule_query(session, teacher_id=teacher_id)),
+        ('user_edit: группы преподавателя',
+         session.query(Schedule.study_group_id).filter(Schedule.teacher_id == teacher_id).distinct()),
+        ('users_list: студенты группы',
+         session.query(Student.user_id).filter(Student.group_id == group_id)),
+        ('users_list: преподаватели кафедры',
+         session.query(Teacher.user_id).filter(Teacher.department_id == data['department'])),
+        ('materials_list: материалы преподавателя',
+         session.query(EducationMaterial)
+         .filter(EducationMaterial.teacher_id == teacher_id)
+         .order_by(EducationMaterial.education_material_name, EducationMaterial.education_material_id)
+         .limit(51)),
+        ('materials_list: первая страница',
+         session.query(EducationMaterial)
+         .order_by(EducationMaterial.education_material_name, EducationMaterial.education_material_id)
+         .limit(51)),
+        ('subject_delete: занятия по предмету',
+         session.query(Schedule.schedule_id).filter(Schedule.subject_id == subject_id).limit(1)),
+        ('subject_delete: материалы по предмету',
+         session.query(EducationMaterial.education_material_id)
+         .filter(EducationMaterial.subject_id == subject_id).limit(1)),
+        ('subjects: преподаватели предмета',
+         session.query(teacher_subject_association.c.teacher_id)
+         .filter(teacher_subject_association.c.subject_id == subject_id)),
+        ('curriculum: группы плана',
+         session.query(StudyGroup.group_id).filter(StudyGroup.curriculum_id == data['curriculum'])),
+    ]
+
+
+def measure(session, statement, repeat):
+    compiled = statement.statement.compile(dialect=session.get_bind().dialect)
+    sql, params = str(compiled), compiled.params
+    connection = session.connection()
+
+    plan = [row[0] for row in connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.exec_driver_sql(sql, params).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), plan
+
+
+def scans(plan):
+    """Узлы чтения таблиц из плана: 'Seq Scan on schedule', 'Index Scan using ... on ...'"""
+    nodes = []
+    for line in plan:
+        line = line.strip().lstrip('->').strip()
+        if ' Scan ' in f' {line}' and (' on ' in line or ' using ' in line):
+            nodes.append(line.split('  (')[0])
+    return nodes
+
+
+def run(session, data, repeat, seed):
+    results = {}
+    for name, statement in workload(session, data, random.Random(seed)):
+        results[name] = measure(session, statement, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', required=True, help='scratch-база PostgreSQL')
+    parser.add_argument('--lessons', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--materials', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='печатать планы целиком')
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    Base.metadata.create_all(engine)
+    upgrade(engine)
+    session = sessionmaker(bind=engine)()
+
+    print("Генерация данных...")
+    start = time.perf_counter()
+    data = populate_schedule(session, lessons=args.lessons, seed=args.seed)
+    populate_people(session, users=args.users, seed=args.seed)
+    populate_materials(session, data['teachers'], data['subjects'], materials=args.materials, seed=args.seed)
+
+    rng = random.Random(args.seed)
+    bulk_insert(session, teacher_subject_association, [
+        {'teacher_id': teacher_id, 'subject_id': subject_id}
+        for teacher_id in data['teachers']
+        for subject_id in rng.sample(data['subjects'], 3)
+    ])
+    data['department'] = session.scalar(select(func.max(Teacher.department_id)))
+    data['curriculum'] = session.scalar(select(func.min(StudyGroup.curriculum_id)))
+    session.commit()
+    print(f"  {time.perf_counter() - start:.1f} с")
+
+    for index in model_indexes():
+        session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    session.execute(text("ANALYZE"))
+    session.commit()
+    before = run(session, data, args.repeat, args.seed)
+    session.commit()
+
+    start = time.perf_counter()
+    create_indexes(session.connection())
+    session.execute(text("ANALYZE"))
+    session.commit()
+    print(f"Построение индексов миграции 0003: {time.perf_counter() - start:.1f} с")
+    after = run(session, data, args.repeat, args.seed)
+    session.commit()
+
+    print(f"\n{'запрос':42} {'до, мс':>9} {'после, мс':>10} {'ускорение':>10}")
+    for name in before:
+        (t_before, plan_before), (t_after, plan_after) = before[name], after[name]
+        print(f"{name:42} {t_before * 1000:9.2f} {t_after * 1000:10.2f} {t_before / t_after:9.1f}x")
+        print(f"    до:    {'; '.join(scans(plan_before))}")
+        print(f"    после: {'; '.join(scans(plan_after))}")
+        if args.verbose:
+            for line in plan_after:
+                print(f"        {line}")
+
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
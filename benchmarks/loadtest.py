@@ -0,0 +1,252 @@
+"""
+Нагрузочный прогон основных страниц через Flask test client.
+
+Приложение привязывается к указанной базе (обычно заполненной
+benchmarks.generator), затем каждый сценарий выполняется --requests раз.
+Для каждого сценария считаются p50/p95/p99 задержки, число SQL-запросов
+на запрос и пиковая память Python (tracemalloc, отдельным проходом,
+чтобы трассировка не искажала задержки). Результат - JSON, который можно
+сохранить как базовую линию и сравнивать между версиями:
+
+    python -m benchmarks.loadtest --db-url postgresql+psycopg2://.../scratch_db --generate --output baseline.json
+    python -m benchmarks.loadtest --db-url ... --compare baseline.json
+
+Импорт приложения требует переменных POSTGRES_* (как и сам запуск приложения),
+но все запросы идут в --db-url.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import event, select, func
+
+from my_university import main as app_main
+from my_university.config import create_db_engine
+from my_university.instrumentation import instrument_engine
+from my_university.models import User, UserType, Schedule, StudyGroup, Teacher, Student, EducationMaterial
+from benchmarks.generator import generate, add_scale_arguments
+from benchmarks.synthetic import UNIVERSITY_SCALE, BENCH_PASSWORD
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(values, share):
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(1, round(share * len(ordered) + 0.5))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def pick_targets(session, rng, count=20):
+    """Случайные, но воспроизводимые (по seed) объекты для сценариев"""
+    group_ids = session.scalars(select(StudyGroup.group_id).order_by(StudyGroup.group_id)).all()
+    teacher_ids = session.scalars(select(Teacher.teacher_id).order_by(Teacher.teacher_id)).all()
+    student_names = session.scalars(select(Student.full_name).order_by(Student.student_id).limit(1000)).all()
+    admin_login = session.scalar(
+        select(User.hash_login).join(UserType).where(UserType.type_name == 'admin').order_by(User.user_id)
+    )
+    if not (group_ids and teacher_ids and admin_login):
+        raise RuntimeError("В базе нет групп, преподавателей или админа - запустите с --generate")
+
+    return {
+        'groups': rng.sample(group_ids, min(count, len(group_ids))),
+        'teachers': rng.sample(teacher_ids, min(count, len(teacher_ids))),
+        'surnames': [name.split()[0] for name in rng.sample(student_names, min(count, len(student_names)))],
+        'admin_login': admin_login,
+    }
+
+
+def scenarios(targets):
+    """(название, функция(client, i) -> response); i - номер повтора"""
+    def cycle(key, i):
+        return targets[key][i % len(targets[key])]
+
+    def login(client, i):
+        client.get('/logout')
+        response = client.post('/login', data={'login': targets['admin_login'], 'password': BENCH_PASSWORD})
+        return response
+
+    return [
+        ('login', login),
+        ('schedule_group', lambda c, i: c.get(f"/schedule?group_id={cycle('groups', i)}")),
+        ('schedule_teacher', lambda c, i: c.get(f"/schedule?teacher_id={cycle('teachers', i)}")),
+        ('users_first_page', lambda c, i: c.get('/users')),
+        ('users_search', lambda c, i: c.get(f"/users?search={cycle('surnames', i)}")),
+        ('users_group', lambda c, i: c.get(f"/users?group_id={cycle('groups', i)}")),
+        ('materials_first_page', lambda c, i: c.get('/materials')),
+        ('materials_search', lambda c, i: c.get('/materials?search=практикум')),
+        ('export_csv_group', lambda c, i: c.get(f"/schedule/export/csv?group_id={cycle('groups', i)}")),
+        ('export_json_teacher', lambda c, i: c.get(f"/schedule/export/json?teacher_id={cycle('teachers', i)}")),
+        ('export_csv_all', lambda c, i: c.get('/schedule/export/csv?all=1')),
+    ]
+
+
+def logged_in_client(app, targets):
+    client = app.test_client()
+    response = client.post('/login', data={'login': targets['admin_login'], 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"Не удалось войти как {targets['admin_login']}")
+    return client
+
+
+def consume(response):
+    """Дочитывает тело и закрывает ответ, как это делает WSGI-сервер"""
+    response.get_data()
+    response.close()
+
+
+def run_scenario(client, action, counter, requests, warmup):
+    for i in range(warmup):
+        consume(action(client, i))
+
+    latencies, queries, statuses = [], [], {}
+    for i in range(requests):
+        counter.count = 0
+        start = time.perf_counter()
+        response = action(client, warmup + i)
+        consume(response)
+        latencies.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'status_codes': statuses,
+    }
+
+
+def measure_memory(client, action, requests):
+    """Пиковая память Python за requests запросов сценария, КиБ"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for i in range(requests):
+            consume(action(client, i))
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('revision')}):")
+    print(f"{'сценарий':22} {'p50, мс':>18} {'p95, мс':>18} {'запросов':>14} {'память, КиБ':>22}")
+    for name, current in result['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            print(f"{name:22} (нет в базовой линии)")
+            continue
+
+        def cell(key, width):
+            before, after = old.get(key), current.get(key)
+            if not before:
+                return f"{after:>{width}}"
+            return f"{before:g}->{after:g} {(after - before) / before * 100:+.0f}%".rjust(width)
+
+        print(f"{name:22} {cell('p50_ms', 18)} {cell('p95_ms', 18)} "
+              f"{cell('queries_per_request', 14)} {cell('peak_memory_kib', 22)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', required=True)
+    parser.add_argument('--generate', action='store_true', help='заполнить пустую базу генератором')
+    parser.add_argument('--requests', type=int, default=50, help='повторов каждого сценария')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--memory-requests', type=int, default=5, help='повторов для замера памяти')
+    parser.add_argument('--only', nargs='*', help='запустить только эти сценарии')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию - stdout)')
+    parser.add_argument('--compare', help='JSON базовой линии для сравнения')
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(create_db_engine(args.db_url, statement_timeout_ms=0), seed=args.seed,
+                 **{name: getattr(args, name) for name in UNIVERSITY_SCALE})
+
+    # Пул и таймауты - из тех же DB_* переменных, что и у приложения
+    engine = create_db_engine(args.db_url)
+
+    app_main.Session.configure(bind=engine)
+    instrument_engine(engine)  # как в приложении: учет запросов входит в замер
+    if 'main' not in app_main.app.blueprints:
+        app_main.register_blueprints()
+    app = app_main.app
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    session = app_main.db_session()
+    targets = pick_targets(session, random.Random(args.seed))
+    sizes = {
+        'users': session.scalar(select(func.count()).select_from(User)),
+        'lessons': session.scalar(select(func.count()).select_from(Schedule)),
+        'materials': session.scalar(select(func.count()).select_from(EducationMaterial)),
+    }
+    app_main.db_session.remove()
+
+    counter = QueryCounter(engine)
+    result = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'dialect': engine.dialect.name,
+            'requests': args.requests,
+            'sizes': sizes,
+        },
+        'scenarios': {},
+    }
+
+    for name, action in scenarios(targets):
+        if args.only and name not in args.only:
+            continue
+        client = logged_in_client(app, targets)
+        stats = run_scenario(client, action, counter, args.requests, args.warmup)
+        stats['peak_memory_kib'] = measure_memory(client, action, args.memory_requests)
+        result['scenarios'][name] = stats
+        print(f"{name:22} p50 {stats['p50_ms']:8.2f} мс  p95 {stats['p95_ms']:8.2f} мс  "
+              f"p99 {stats['p99_ms']:8.2f} мс  запросов {stats['queries_per_request']:6.1f}  "
+              f"память {stats['peak_memory_kib']:9.1f} КиБ", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Сохранено: {args.output}", file=sys.stderr)
+    elif not args.compare:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    main()
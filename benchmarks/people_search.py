@@ -0,0 +1,89 @@
+"""
+Поиск людей по ФИО на большой выборке: планы запросов и задержки.
+
+Нужен PostgreSQL с pg_trgm (scratch-база, все таблицы будут созданы
+в ней заново только если их нет):
+
+    python -m benchmarks.people_search --db-url postgresql+psycopg2://.../scratch_db --users 100000
+
+Для каждого образца выводится EXPLAIN (ANALYZE) запроса users_list и
+время автодополнения. Критерий: ветка student (основная масса людей) идет
+по Bitmap Index Scan на ix_student_full_name_trgm. Для маленьких таблиц
+(admin, иногда teacher) планировщик вправе выбрать Seq Scan.
+"""
+import argparse
+import time
+
+from sqlalchemy import create_engine, select, func, text
+from sqlalchemy.orm import sessionmaker
+
+from my_university.models import Base, User
+from my_university.migrations import upgrade
+from my_university.people_search import matching_user_ids, search_people, trigram_enabled
+from benchmarks.synthetic import populate_people
+
+SAMPLES = [
+    'Кузнецов',         # частая фамилия: много совпадений
+    'Кирилл Павлович',  # подстрока из середины ФИО
+    '12345',            # номер - почти уникальное совпадение
+    'Кузнецав',         # опечатка: только нечеткое совпадение
+]
+
+
+def explain(session, statement):
+    compiled = statement.compile(dialect=session.get_bind().dialect)
+    rows = session.connection().exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}", compiled.params)
+    return [row[0] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-url', required=True, help='scratch-база PostgreSQL')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20, help='повторов для замера задержки')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    Base.metadata.create_all(engine)
+    upgrade(engine)
+    session = sessionmaker(bind=engine)()
+
+    existing = session.scalar(select(func.count()).select_from(User))
+    if existing < args.users:
+        print(f"Генерация {args.users - existing} пользователей...")
+        start = time.perf_counter()
+        counts = populate_people(session, users=args.users - existing, seed=args.seed)
+        print(f"  {counts}, {time.perf_counter() - start:.1f} с")
+        session.execute(text("ANALYZE"))
+        session.commit()
+
+    if not trigram_enabled(session):
+        print("ВНИМАНИЕ: pg_trgm не установлен - ожидайте Seq Scan.")
+
+    index_ok = True
+    for sample in SAMPLES:
+        statement = select(User.user_id) \
+            .where(User.user_id.in_(matching_user_ids(session, sample))) \
+            .order_by(User.user_id).limit(51)
+        plan = explain(session, statement)
+        uses_index = any('ix_student_full_name_trgm' in line for line in plan)
+        index_ok = index_ok and uses_index
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            found = search_people(session, sample)
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        print(f"\n=== '{sample}': автодополнение {elapsed * 1000:.1f} мс, найдено {len(found)}"
+              f"{' (' + found[0]['full_name'] + ')' if found else ''}")
+        print(f"    индекс по student: {'да' if uses_index else 'НЕТ'}")
+        for line in plan:
+            print(f"    {line}")
+
+    print(f"\nИтог: {'все образцы идут по индексу' if index_ok else 'есть образцы без индекса'}")
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+"""
+Генератор синтетических данных для бенчмарков.
+Рассчитан на пустую (scratch) базу со схемой из Base.metadata.create_all.
+"""
+import io
+import math
+import random
+import datetime
+
+from sqlalchemy import insert, select, func, text
+from werkzeug.security import generate_password_hash
+
+from my_university.models import (
+    User, UserType,
+    Student,
+    Teacher, StudyGroup,
+    Department, Curriculum,
+    EducationForm, Subject,
+    ClassroomType, Classroom,
+    LessonType, TimeSlot,
+    Schedule, EducationMaterial,
+    EducationMaterialType, Admin,
+    CurriculumDetail, AssessmentType,
+    teacher_subject_association,
+)
+from my_university.material_search import search_enabled, REFRESH_SQL
+
+DAYS = range(1, 7)
+
+TIME_SLOTS = [
+    ('1 пара', datetime.time(8, 15), datetime.time(9, 50)),
+    ('2 пара', datetime.time(10, 0), datetime.time(11, 35)),
+    ('3 пара', datetime.time(11, 45), datetime.time(13, 20)),
+    ('4 пара', datetime.time(14, 0), datetime.time(15, 35)),
+    ('5 пара', datetime.time(15, 45), datetime.time(17, 20)),
+    ('6 пара', datetime.time(17, 30), datetime.time(19, 5)),
+    ('7 пара', datetime.time(19, 15), datetime.time(20, 50)),
+]
+
+SURNAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+            'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров',
+            'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин',
+            'Захаров', 'Зайцев', 'Соловьев', 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьев']
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Артем', 'Илья',
+               'Кирилл', 'Михаил', 'Никита', 'Матвей', 'Роман', 'Егор', 'Арсений', 'Иван']
+PATRONYMICS = ['Александрович', 'Дмитриевич', 'Сергеевич', 'Андреевич', 'Алексеевич', 'Игоревич',
+               'Владимирович', 'Павлович', 'Олегович', 'Викторович']
+
+# Пароль 'bench' - один хэш на всех, чтобы не тратить время генерации на хэширование
+BENCH_PASSWORD = 'bench'
+PASSWORD_HASH = generate_password_hash(BENCH_PASSWORD)
+
+
+def next_id(session, column):
+    return (session.scalar(select(func.max(column))) or 0) + 1
+
+
+def sync_sequences(session, *models):
+    """После вставки с явными id сдвигает последовательности Postgres"""
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__table__
+        pk = table.primary_key.columns.values()[0]
+        session.execute(
+            select(func.setval(func.pg_get_serial_sequence(table.name, pk.name),
+                               select(func.coalesce(func.max(pk), 0) + 1).scalar_subquery(), False))
+        )
+
+
+def get_or_create(session, model, **values):
+    obj = session.query(model).filter_by(**values).first()
+    if obj is None:
+        obj = model(**values)
+        session.add(obj)
+        session.flush()
+    return obj
+
+
+def _copy_value(value):
+    """Значение для COPY ... FROM STDIN в текстовом формате"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_insert(session, table, rows, chunk_rows=50000):
+    """
+    Загрузка строк через COPY FROM STDIN (PostgreSQL, psycopg2) в транзакции сессии.
+    В разы быстрее INSERT-ов: нет разбора SQL и обмена на каждую пачку строк.
+    """
+    columns = list(rows[0])
+    sql = f'COPY "{table.name}" ({", ".join(columns)}) FROM STDIN'
+    cursor = session.connection().connection.cursor()
+    try:
+        for start in range(0, len(rows), chunk_rows):
+            buffer = io.StringIO()
+            for row in rows[start:start + chunk_rows]:
+                buffer.write('\t'.join(_copy_value(row[column]) for column in columns))
+                buffer.write('\n')
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+def bulk_insert(session, model, rows):
+    """Вставка списка словарей: COPY в PostgreSQL, executemany в остальных СУБД"""
+    if not rows:
+        return
+    table = getattr(model, '__table__', model)
+    if session.get_bind().dialect.name == 'postgresql':
+        session.flush()
+        copy_insert(session, table, rows)
+    else:
+        session.execute(insert(table), rows)
+
+
+def ensure_lookups(session):
+    """Справочники, которые обычно создает seed.py"""
+    user_types = {name: get_or_create(session, UserType, type_name=name).user_type_id
+                  for name in ('student', 'teacher', 'admin')}
+
+    time_slots = []
+    for name, start, end in TIME_SLOTS:
+        slot = session.query(TimeSlot).filter_by(time_slot_name=name).first()
+        if slot is None:
+            slot = TimeSlot(time_slot_name=name, time_start=start, time_end=end)
+            session.add(slot)
+            session.flush()
+        time_slots.append(slot.time_slot_id)
+
+    return {
+        'user_types': user_types,
+        'time_slots': time_slots,
+        'lesson_type': get_or_create(session, LessonType, lesson_type_name='Лекция').lesson_type_id,
+        'classroom_type': get_or_create(session, ClassroomType, classroom_name='Лекционная аудитория').classroom_id,
+        'education_form': get_or_create(session, EducationForm, education_form_name='Очная').education_form_id,
+    }
+
+
+def random_name(rng, number):
+    """ФИО вида 'Смирнов Кирилл Павлович 1234' - номер делает имена различимыми"""
+    return f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(PATRONYMICS)} {number}"
+
+
+def create_teachers(session, lookups, count, department_ids):
+    """Создает count преподавателей (вместе с пользователями), возвращает их id"""
+    first_user = next_id(session, User.user_id)
+    first_teacher = next_id(session, Teacher.teacher_id)
+
+    users = []
+    teachers = []
+    for i in range(count):
+        user_id = first_user + i
+        teacher_id = first_teacher + i
+        users.append({
+            'user_id': user_id,
+            'user_type_id': lookups['user_types']['teacher'],
+            'hash_login': f'bench_teacher_{teacher_id}',
+            'hash_password': PASSWORD_HASH,
+        })
+        teachers.append({
+            'teacher_id': teacher_id,
+            'user_id': user_id,
+            'department_id': department_ids[i % len(department_ids)],
+            'full_name': f'Преподаватель {teacher_id}',
+            'email': f'bench_teacher_{teacher_id}@unidesk.ru',
+        })
+
+    bulk_insert(session, User, users)
+    bulk_insert(session, Teacher, teachers)
+    return [t['teacher_id'] for t in teachers]
+
+
+def timetable_rows(rng, lookups, group_ids, teacher_ids, room_ids, subject_ids, lessons_per_group, limit=None):
+    """
+    Бесконфликтные занятия: в каждой ячейке (день, пара) j-я по счету группа
+    получает j-го преподавателя и j-ю аудиторию. Если преподавателей или
+    аудиторий меньше, чем групп в ячейке, лишние занятия не создаются.
+    """
+    cells = [(day, slot) for day in DAYS for slot in lookups['time_slots']]
+    per_group = min(lessons_per_group, len(cells))
+    capacity = min(len(teacher_ids), len(room_ids))
+    occupied = {cell: 0 for cell in cells}
+
+    rows = []
+    for group_id in group_ids:
+        for day, slot in rng.sample(cells, per_group):
+            if limit is not None and len(rows) >= limit:
+                return rows
+            j = occupied[(day, slot)]
+            if j >= capacity:
+                continue
+            occupied[(day, slot)] += 1
+            rows.append({
+                'study_group_id': group_id,
+                'teacher_id': teacher_ids[j],
+                'subject_id': rng.choice(subject_ids),
+                'lesson_type_id': lookups['lesson_type'],
+                'classroom_id': room_ids[j],
+                'time_slot_id': slot,
+                'day_of_week': day,
+            })
+    return rows
+
+
+def populate_schedule(session, lessons=10000, lessons_per_group=30, subjects=50, seed=0):
+    """
+    Заполняет базу бесконфликтным расписанием примерно из lessons занятий.
+    В каждой ячейке (день, пара) j-я по счету группа получает j-го
+    преподавателя и j-ю аудиторию, поэтому пересечений нет.
+    """
+    rng = random.Random(seed)
+    lookups = ensure_lookups(session)
+
+    group_count = math.ceil(lessons / lessons_per_group)
+    department = get_or_create(session, Department, department_name='Кафедра бенчмарков')
+    curriculum = Curriculum(
+        education_form_id=lookups['education_form'],
+        education_level='Бенчмарк',
+        approval_year=datetime.date(2024, 9, 1)
+    )
+    session.add(curriculum)
+    session.flush()
+
+    first_group = next_id(session, StudyGroup.group_id)
+    group_ids = list(range(first_group, first_group + group_count))
+    bulk_insert(session, StudyGroup, [
+        {'group_id': gid, 'curriculum_id': curriculum.curriculum_id,
+         'group_name': f'БЕНЧ-{gid}', 'group_course': 1 + gid % 4}
+        for gid in group_ids
+    ])
+
+    teacher_ids = create_teachers(session, lookups, group_count, [department.department_id])
+
+    first_room = next_id(session, Classroom.class_id)
+    room_ids = list(range(first_room, first_room + group_count))
+    bulk_insert(session, Classroom, [
+        {'class_id': rid, 'class_type_id': lookups['classroom_type'], 'class_name': f'Б-{rid}'}
+        for rid in room_ids
+    ])
+
+    first_subject = next_id(session, Subject.subject_id)
+    subject_ids = list(range(first_subject, first_subject + subjects))
+    bulk_insert(session, Subject, [
+        {'subject_id': sid, 'subject_name': f'Дисциплина {sid}'} for sid in subject_ids
+    ])
+
+    rows = timetable_rows(rng, lookups, group_ids, teacher_ids, room_ids, subject_ids, lessons_per_group, lessons)
+    bulk_insert(session, Schedule, rows)
+    sync_sequences(session, User, Teacher, StudyGroup, Classroom, Subject)
+    session.commit()
+
+    return {
+        'groups': group_ids,
+        'teachers': teacher_ids,
+        'classrooms': room_ids,
+        'subjects': subject_ids,
+        'time_slots': lookups['time_slots'],
+        'lessons': len(rows),
+    }
+
+
+def populate_people(session, users=100000, teacher_share=0.08, admin_share=0.002, departments=20, seed=0,
+                    batch=10000):
+    """
+    Заполняет базу users пользователями со случайными ФИО: в основном студенты,
+    teacher_share преподавателей и admin_share админов, преподаватели распределены
+    по departments кафедрам. Вставка пачками по batch.
+    """
+    rng = random.Random(seed)
+    lookups = ensure_lookups(session)
+
+    department_ids = [
+        get_or_create(session, Department, department_name=f'Кафедра бенчмарков {number}').department_id
+        for number in range(1, departments + 1)
+    ]
+    curriculum = Curriculum(
+        education_form_id=lookups['education_form'],
+        education_level='Бенчмарк',
+        approval_year=datetime.date(2024, 9, 1)
+    )
+    session.add(curriculum)
+    session.flush()
+
+    first_group = next_id(session, StudyGroup.group_id)
+    group_ids = list(range(first_group, first_group + max(1, users // 25)))
+    bulk_insert(session, StudyGroup, [
+        {'group_id': gid, 'curriculum_id': curriculum.curriculum_id,
+         'group_name': f'ЛЮДИ-{gid}', 'group_course': 1 + gid % 4}
+        for gid in group_ids
+    ])
+
+    first_user = next_id(session, User.user_id)
+    counts = {'student': 0, 'teacher': 0, 'admin': 0}
+
+    for start in range(0, users, batch):
+        user_rows, rows = [], {'student': [], 'teacher': [], 'admin': []}
+        for user_id in range(first_user + start, first_user + min(start + batch, users)):
+            roll = rng.random()
+            role = 'admin' if roll < admin_share else 'teacher' if roll < admin_share + teacher_share else 'student'
+            user_rows.append({
+                'user_id': user_id,
+                'user_type_id': lookups['user_types'][role],
+                'hash_login': f'bench_{role}_{user_id}',
+                'hash_password': PASSWORD_HASH,
+            })
+            row = {'user_id': user_id, 'full_name': random_name(rng, user_id)}
+            if role == 'student':
+                row['group_id'] = rng.choice(group_ids)
+            elif role == 'teacher':
+                row['department_id'] = rng.choice(department_ids)
+                row['email'] = f'bench_teacher_{user_id}@unidesk.ru'
+            rows[role].append(row)
+            counts[role] += 1
+
+        bulk_insert(session, User, user_rows)
+        bulk_insert(session, Student, rows['student'])
+        bulk_insert(session, Teacher, rows['teacher'])
+        bulk_insert(session, Admin, rows['admin'])
+
+    sync_sequences(session, User, Student, Teacher, Admin, StudyGroup)
+    session.commit()
+    return counts
+
+
+MATERIAL_TOPICS = ['Введение в', 'Практикум по', 'Лекции по', 'Задачи по', 'Конспект по', 'Лабораторные работы по']
+
+
+def populate_materials(session, teacher_ids, subject_ids, materials=20000, seed=0):
+    """Создает materials учебных материалов у случайных преподавателей и предметов"""
+    rng = random.Random(seed)
+    material_type = get_or_create(session, EducationMaterialType, education_material_type_name='Учебник')
+
+    rows = []
+    for i in range(materials):
+        subject_id = rng.choice(subject_ids)
+        rows.append({
+            'education_material_type_id': material_type.education_material_type_id,
+            'subject_id': subject_id,
+            'teacher_id': rng.choice(teacher_ids),
+            'education_material_name': f"{rng.choice(MATERIAL_TOPICS)} дисциплине {subject_id}, часть {i}",
+            'education_material_link': f'https://example.com/materials/{i}',
+        })
+
+    bulk_insert(session, EducationMaterial, rows)
+    if search_enabled(session):
+        session.execute(text(REFRESH_SQL))
+    session.commit()
+    return len(rows)
+
+
+# Размеры университета по умолчанию для populate_university / benchmarks.generator
+UNIVERSITY_SCALE = {
+    'departments': 20,
+    'curricula': 10,
+    'subjects': 300,
+    'groups': 400,
+    'students': 10000,
+    'teachers': 800,
+    'admins': 5,
+    'classrooms': 400,
+    'materials': 20000,
+    'lessons_per_group': 20,
+}
+
+
+def populate_university(session, seed=0, **scale):
+    """
+    Заполняет пустую базу целым университетом: кафедры, учебные планы с
+    дисциплинами, группы, студенты, преподаватели с предметами, аудитории,
+    материалы и бесконфликтное расписание. Размеры - UNIVERSITY_SCALE,
+    переопределяются именованными аргументами. В PostgreSQL все большие
+    таблицы грузятся через COPY (bulk_insert).
+    """
+    scale = {**UNIVERSITY_SCALE, **scale}
+    rng = random.Random(seed)
+    lookups = ensure_lookups(session)
+    assessment_type = get_or_create(session, AssessmentType, assessment_type_name='Экзамен')
+
+    def ids(column, count):
+        first = next_id(session, column)
+        return list(range(first, first + count))
+
+    department_ids = ids(Department.department_id, scale['departments'])
+    bulk_insert(session, Department, [
+        {'department_id': did, 'department_name': f'Кафедра {did}'} for did in department_ids
+    ])
+
+    subject_ids = ids(Subject.subject_id, scale['subjects'])
+    bulk_insert(session, Subject, [
+        {'subject_id': sid, 'subject_name': f'Дисциплина {sid}'} for sid in subject_ids
+    ])
+
+    curriculum_ids = ids(Curriculum.curriculum_id, scale['curricula'])
+    bulk_insert(session, Curriculum, [
+        {'curriculum_id': cid, 'education_form_id': lookups['education_form'],
+         'education_level': f'Бакалавриат {cid}', 'approval_year': datetime.date(2020 + cid % 5, 9, 1)}
+        for cid in curriculum_ids
+    ])
+    details = []
+    for cid in curriculum_ids:
+        for semester in range(1, 9):
+            for sid in rng.sample(subject_ids, min(6, len(subject_ids))):
+                details.append({'curriculum_id': cid, 'subject_id': sid, 'semester': semester,
+                                'hours_lecture': rng.choice((36, 54, 72)),
+                                'assessment_type_id': assessment_type.assessment_type_id})
+    bulk_insert(session, CurriculumDetail, details)
+
+    group_ids = ids(StudyGroup.group_id, scale['groups'])
+    bulk_insert(session, StudyGroup, [
+        {'group_id': gid, 'curriculum_id': rng.choice(curriculum_ids),
+         'group_name': f'ГР-{gid}', 'group_course': 1 + gid % 4}
+        for gid in group_ids
+    ])
+
+    room_ids = ids(Classroom.class_id, scale['classrooms'])
+    bulk_insert(session, Classroom, [
+        {'class_id': rid, 'class_type_id': lookups['classroom_type'], 'class_name': f'А-{rid}'}
+        for rid in room_ids
+    ])
+
+    # Пользователи: сначала преподаватели, затем студенты и админы - одна сквозная нумерация
+    user_ids = ids(User.user_id, scale['teachers'] + scale['students'] + scale['admins'])
+    teacher_ids = ids(Teacher.teacher_id, scale['teachers'])
+    roles = ['teacher'] * scale['teachers'] + ['student'] * scale['students'] + ['admin'] * scale['admins']
+
+    bulk_insert(session, User, [
+        {'user_id': uid, 'user_type_id': lookups['user_types'][role],
+         'hash_login': f'bench_{role}_{uid}', 'hash_password': PASSWORD_HASH}
+        for uid, role in zip(user_ids, roles)
+    ])
+    teacher_users = user_ids[:scale['teachers']]
+    student_users = user_ids[scale['teachers']:scale['teachers'] + scale['students']]
+    admin_users = user_ids[scale['teachers'] + scale['students']:]
+
+    bulk_insert(session, Teacher, [
+        {'teacher_id': tid, 'user_id': uid, 'department_id': rng.choice(department_ids),
+         'full_name': random_name(rng, uid), 'email': f'bench_teacher_{uid}@unidesk.ru'}
+        for tid, uid in zip(teacher_ids, teacher_users)
+    ])
+    bulk_insert(session, Student, [
+        {'user_id': uid, 'group_id': rng.choice(group_ids), 'full_name': random_name(rng, uid)}
+        for uid in student_users
+    ])
+    bulk_insert(session, Admin, [
+        {'user_id': uid, 'full_name': random_name(rng, uid)} for uid in admin_users
+    ])
+    bulk_insert(session, teacher_subject_association, [
+        {'teacher_id': tid, 'subject_id': sid}
+        for tid in teacher_ids
+        for sid in rng.sample(subject_ids, min(3, len(subject_ids)))
+    ])
+
+    lessons = timetable_rows(rng, lookups, group_ids, teacher_ids, room_ids, subject_ids, scale['lessons_per_group'])
+    bulk_insert(session, Schedule, lessons)
+
+    sync_sequences(session, Department, Subject, Curriculum, StudyGroup, Classroom, User, Teacher)
+    session.commit()
+
+    populate_materials(session, teacher_ids, subject_ids, materials=scale['materials'], seed=seed)
+
+    return {
+        'departments': department_ids,
+        'subjects': subject_ids,
+        'curricula': curriculum_ids,
+        'groups': group_ids,
+        'teachers': teacher_ids,
+        'classrooms': room_ids,
+        'time_slots': lookups['time_slots'],
+        'teacher_users': teacher_users,
+        'student_users': student_users,
+        'admin_users': admin_users,
+        'lessons': len(lessons),
+        'curriculum_details': len(details),
+    }
@@ -1,6 +1,11 @@
 import os
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, NullPool
 
 base_dir = Path(__file__).resolve().parent.parent
 env_path = base_dir / '.env'
@@ -28,5 +33,106 @@ def get_db_url():
         return None
 
 
+def get_replica_url():
+    """URL реплики для чтения (DB_REPLICA_URL) или None"""
+    return os.getenv("DB_REPLICA_URL") or None
+
+
 def get_secret_key():
     return os.getenv("SECRET_KEY", "fallback_secret_key_if_none_found")
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default=False):
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_pool_settings():
+    """Параметры пула соединений из окружения (DB_POOL_*, DB_MAX_OVERFLOW)"""
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+    }
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool, считающий время ожидания соединения при checkout.
+    В ожидание входит и открытие нового соединения сверх pool_size.
+    """
+    WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+        self.wait_timeouts = 0
+        self.wait_buckets = [0] * (len(self.WAIT_BUCKETS) + 1)  # последний - +Inf
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self._record_wait(time.perf_counter() - start, timed_out)
+
+    def _record_wait(self, waited, timed_out):
+        bucket = next((i for i, bound in enumerate(self.WAIT_BUCKETS) if waited <= bound), len(self.WAIT_BUCKETS))
+        with self.wait_lock:
+            self.wait_count += 1
+            self.wait_seconds += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.wait_timeouts += 1 if timed_out else 0
+            self.wait_buckets[bucket] += 1
+
+
+def create_db_engine(url=None, statement_timeout_ms=None, **kwargs):
+    """
+    Общая фабрика движка для приложения, сидов и миграций.
+
+    Для PostgreSQL берет параметры пула из окружения и ограничивает время
+    выражения DB_STATEMENT_TIMEOUT_MS (0 - без ограничения; миграции и сиды
+    передают statement_timeout_ms=0 явно). При DB_PGBOUNCER=1 соединения
+    не держатся в пуле (NullPool - пулом занимается PgBouncer в режиме
+    transaction), а таймаут ставится SET LOCAL в начале каждой транзакции:
+    параметры запуска соединения PgBouncer не пропускает.
+    """
+    url = make_url(url or get_db_url())
+    if statement_timeout_ms is None:
+        statement_timeout_ms = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    pgbouncer = _env_bool('DB_PGBOUNCER')
+
+    options = {}
+    if url.get_backend_name() == 'postgresql':
+        if pgbouncer:
+            options['poolclass'] = NullPool
+        else:
+            options.update(get_pool_settings(), poolclass=TimedQueuePool)
+            if statement_timeout_ms:
+                options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    options.update(kwargs)
+
+    engine = create_engine(url, **options)
+
+    if pgbouncer and statement_timeout_ms and url.get_backend_name() == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def _set_statement_timeout(connection):
+            connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(statement_timeout_ms)}')
+
+    return engine
@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+from sqlalchemy import or_
+
+from my_university.models import Schedule
+
+ScheduleConflict = namedtuple('ScheduleConflict', ['kind', 'schedule_id'])
+
+
+class ScheduleConflictIndex:
+    """
+    Занятость преподавателей, аудиторий и групп по ячейкам (день недели, пара).
+    Загружается из таблицы schedule одним запросом, проверка кандидата - O(1).
+
+    Правила совпадают с проверками в маршрутах:
+    - преподаватель не может вести пару в двух разных аудиториях одновременно
+      (потоковая лекция нескольким группам в одной аудитории допустима);
+    - аудиторию не могут занимать два разных преподавателя одновременно;
+    - у группы не может быть двух занятий в одно время (_group_time_uc).
+    """
+
+    def __init__(self):
+        self._lessons = {}   # schedule_id -> (group_id, teacher_id, classroom_id, day_of_week, time_slot_id)
+        self._teachers = {}  # (day_of_week, time_slot_id, teacher_id) -> {schedule_id: classroom_id}
+        self._rooms = {}     # (day_of_week, time_slot_id, classroom_id) -> {schedule_id: teacher_id}
+        self._groups = {}    # (day_of_week, time_slot_id, group_id) -> schedule_id
+
+    @staticmethod
+    def build_query(session, day_of_week=None, time_slot_id=None, group_id=None, teacher_id=None, classroom_id=None):
+        """
+        Запрос занятий для индекса. Для одного кандидата это три ветки OR,
+        каждая по своему составному индексу: _group_time_uc,
+        ix_schedule_teacher_day_slot и ix_schedule_classroom_day_slot.
+        """
+        query = session.query(
+            Schedule.schedule_id, Schedule.study_group_id, Schedule.teacher_id,
+            Schedule.classroom_id, Schedule.day_of_week, Schedule.time_slot_id
+        )
+        if day_of_week is not None:
+            query = query.filter(Schedule.day_of_week == day_of_week)
+        if time_slot_id is not None:
+            query = query.filter(Schedule.time_slot_id == time_slot_id)
+
+        owners = []
+        if group_id is not None:
+            owners.append(Schedule.study_group_id == group_id)
+        if teacher_id is not None:
+            owners.append(Schedule.teacher_id == teacher_id)
+        if classroom_id is not None:
+            owners.append(Schedule.classroom_id == classroom_id)
+        if owners:
+            query = query.filter(or_(*owners))
+        return query
+
+    @classmethod
+    def load(cls, session, day_of_week=None, time_slot_id=None, group_id=None, teacher_id=None, classroom_id=None):
+        """
+        Строит индекс по всему расписанию одним проходом по таблице.
+        Для проверки одного кандидата можно сузить выборку до ячейки
+        (day_of_week, time_slot_id) и занятий его группы, преподавателя или аудитории.
+        """
+        query = cls.build_query(session, day_of_week, time_slot_id, group_id, teacher_id, classroom_id)
+
+        index = cls()
+        for row in query:
+            index.add(*row)
+        return index
+
+    def __len__(self):
+        return len(self._lessons)
+
+    def add(self, schedule_id, group_id, teacher_id, classroom_id, day_of_week, time_slot_id):
+        """Отмечает занятие в индексе"""
+        self._lessons[schedule_id] = (group_id, teacher_id, classroom_id, day_of_week, time_slot_id)
+        self._teachers.setdefault((day_of_week, time_slot_id, teacher_id), {})[schedule_id] = classroom_id
+        self._rooms.setdefault((day_of_week, time_slot_id, classroom_id), {})[schedule_id] = teacher_id
+        self._groups[(day_of_week, time_slot_id, group_id)] = schedule_id
+
+    def remove(self, schedule_id):
+        """Убирает занятие из индекса (например, перед его редактированием)"""
+        lesson = self._lessons.pop(schedule_id, None)
+        if lesson is None:
+            return
+
+        group_id, teacher_id, classroom_id, day_of_week, time_slot_id = lesson
+
+        for table, key in ((self._teachers, (day_of_week, time_slot_id, teacher_id)),
+                           (self._rooms, (day_of_week, time_slot_id, classroom_id))):
+            cell = table.get(key)
+            if cell is not None:
+                cell.pop(schedule_id, None)
+                if not cell:
+                    del table[key]
+
+        group_key = (day_of_week, time_slot_id, group_id)
+        if self._groups.get(group_key) == schedule_id:
+            del self._groups[group_key]
+
+    def find_conflicts(self, group_id, teacher_id, classroom_id, day_of_week, time_slot_id, exclude_id=None):
+        """
+        Возвращает список всех конфликтов кандидата: ScheduleConflict(kind, schedule_id),
+        где kind - 'teacher', 'classroom' или 'group'. exclude_id - само редактируемое занятие.
+        """
+        conflicts = []
+
+        for schedule_id, other_classroom_id in self._teachers.get((day_of_week, time_slot_id, teacher_id), {}).items():
+            if schedule_id != exclude_id and other_classroom_id != classroom_id:
+                conflicts.append(ScheduleConflict('teacher', schedule_id))
+                break
+
+        for schedule_id, other_teacher_id in self._rooms.get((day_of_week, time_slot_id, classroom_id), {}).items():
+            if schedule_id != exclude_id and other_teacher_id != teacher_id:
+                conflicts.append(ScheduleConflict('classroom', schedule_id))
+                break
+
+        schedule_id = self._groups.get((day_of_week, time_slot_id, group_id))
+        if schedule_id is not None and schedule_id != exclude_id:
+            conflicts.append(ScheduleConflict('group', schedule_id))
+
+        return conflicts
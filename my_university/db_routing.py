@@ -0,0 +1,145 @@
+"""
+Маршрутизация чтения на реплику.
+
+RoutingSession отправляет на реплику только чтение и только когда это разрешено
+для текущего HTTP-запроса; запись (flush и INSERT/UPDATE/DELETE) всегда идет
+на основной сервер. Реплика используется, если одновременно:
+  - представление помечено @read_only и запрос - GET/HEAD;
+  - пользователь ничего не менял последние REPLICA_RYW_SECONDS секунд
+    (read-your-writes: время последней записи хранится в подписанной сессии Flask);
+  - отставание реплики не больше REPLICA_MAX_LAG_SECONDS (проверяется не чаще
+    раза в REPLICA_LAG_CHECK_SECONDS; недоступная реплика считается отставшей).
+Без DB_REPLICA_URL все идет на основной сервер. Локально вместо двух серверов
+PostgreSQL подойдут два SQLite-файла - у них отставание всегда 0.
+"""
+import os
+import threading
+import time
+
+from flask import g, request, session as flask_session, has_request_context
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', '5'))
+REPLICA_RYW_SECONDS = float(os.getenv('DB_REPLICA_RYW_SECONDS', '10'))
+
+# Отставание в секундах; 0, если реплика проиграла все полученное
+# (pg_last_xact_replay_timestamp без новых записей на основном устаревает сам)
+LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_lag_lock = threading.Lock()
+_lag = {'checked_at': None, 'seconds': None}  # seconds = None - реплика недоступна
+_routed = {'replica': 0, 'primary': 0, 'lag': 0, 'recent_write': 0}
+
+
+def read_only(view):
+    """Помечает представление: GET-запросы к нему можно обслуживать с реплики"""
+    view.replica_ok = True
+    return view
+
+
+def _request_wants_replica():
+    return has_request_context() and g.get('db_use_replica', False)
+
+
+class RoutingSession(Session):
+    def __init__(self, *args, replica=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        if self.replica is None or self._flushing or isinstance(clause, UpdateBase):
+            return primary
+        if self.info.get('use_replica', _request_wants_replica()):
+            return self.replica
+        return primary
+
+
+def replica_lag(replica):
+    """Отставание реплики в секундах (None - недоступна), с кэшированием"""
+    now = time.monotonic()
+    with _lag_lock:
+        if _lag['checked_at'] is not None and now - _lag['checked_at'] < REPLICA_LAG_CHECK_SECONDS:
+            return _lag['seconds']
+
+    try:
+        if replica.dialect.name == 'postgresql':
+            with replica.connect() as connection:
+                seconds = float(connection.execute(LAG_SQL).scalar())
+        else:
+            seconds = 0.0
+    except Exception as e:
+        print(f"Реплика недоступна: {e}")
+        seconds = None
+
+    with _lag_lock:
+        _lag.update(checked_at=now, seconds=seconds)
+    return seconds
+
+
+def _choose_replica(app, replica):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    view = app.view_functions.get(request.endpoint)
+    if not getattr(view, 'replica_ok', False):
+        return False
+
+    if time.time() - flask_session.get('db_write_at', 0) < REPLICA_RYW_SECONDS:
+        _routed['recent_write'] += 1
+        return False
+
+    lag = replica_lag(replica)
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+        _routed['lag'] += 1
+        return False
+
+    return True
+
+
+def install_routing(app, replica):
+    """Подключает выбор реплики к запросам приложения; без реплики ничего не делает"""
+    if replica is None:
+        return
+
+    @app.before_request
+    def _route_reads():
+        g.db_use_replica = _choose_replica(app, replica)
+        _routed['replica' if g.db_use_replica else 'primary'] += 1
+
+    @app.after_request
+    def _remember_write(response):
+        if request.method in WRITE_METHODS:
+            flask_session['db_write_at'] = time.time()
+        return response
+
+
+def routing_metrics():
+    lines = [
+        '# HELP myuni_db_routed_requests_total Запросы по выбранному серверу БД',
+        '# TYPE myuni_db_routed_requests_total counter',
+        f'myuni_db_routed_requests_total{{target="replica"}} {_routed["replica"]}',
+        f'myuni_db_routed_requests_total{{target="primary"}} {_routed["primary"]}',
+        '# HELP myuni_db_replica_fallback_total GET-запросы к @read_only, ушедшие на основной сервер',
+        '# TYPE myuni_db_replica_fallback_total counter',
+        f'myuni_db_replica_fallback_total{{reason="lag"}} {_routed["lag"]}',
+        f'myuni_db_replica_fallback_total{{reason="recent_write"}} {_routed["recent_write"]}',
+    ]
+    if _lag['seconds'] is not None:
+        lines += [
+            '# HELP myuni_db_replica_lag_seconds Отставание реплики при последней проверке',
+            '# TYPE myuni_db_replica_lag_seconds gauge',
+            f'myuni_db_replica_lag_seconds {_lag["seconds"]}',
+        ]
+    return lines
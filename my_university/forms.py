@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField
-from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField, URLField, DateField, SelectMultipleField, widgets
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import HiddenField, StringField, PasswordField, SubmitField, SelectField, IntegerField, URLField, DateField, SelectMultipleField, BooleanField, widgets
 from wtforms.validators import DataRequired, Length, EqualTo, Optional, URL
 
 
@@ -57,6 +57,17 @@ class ScheduleForm(FlaskForm):
     submit = SubmitField('Добавить в расписание')
 
 
+class ScheduleImportForm(FlaskForm):
+    """Форма массовой загрузки расписания из CSV/JSON"""
+    file = FileField('Файл расписания (CSV или JSON)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json'], 'Допустимы только файлы .csv и .json')
+    ])
+    skip_invalid = BooleanField('Пропускать строки с ошибками (иначе файл не загружается целиком)')
+
+    submit = SubmitField('Импортировать')
+
+
 class DepartmentForm(FlaskForm):
     """Форма для создания/редактирования кафедры"""
     department_name = StringField('Название кафедры', validators=[DataRequired(), Length(max=255)])
@@ -95,6 +106,8 @@ class MaterialUploadForm(FlaskForm):
     file = FileField('Файл', validators=[Optional()])
     link_url = URLField('Ссылка на ресурс',
                         validators=[Optional(), URL(message="Введите корректный URL (начинается с http/https)")])
+    # Токен файла, который браузер уже загрузил прямо в MinIO
+    upload_token = HiddenField()
 
     submit = SubmitField('Сохранить')
 
@@ -0,0 +1,243 @@
+"""
+Учет SQL-запросов по HTTP-запросам и эндпоинтам.
+
+Слушатели before/after_cursor_execute на движке считают выражения и время
+БД для текущего запроса (в flask.g), после закрытия ответа (в т.ч. потокового
+экспорта) итоги сливаются в агрегаты по эндпоинту. Дополнительно:
+  - N+1: одно и то же выражение выполнено в запросе >= SQL_N_PLUS_ONE_THRESHOLD
+    раз (отличаются только параметры) - предупреждение в лог и счетчик;
+  - медленные запросы дольше SQL_SLOW_QUERY_MS пишутся в лог вместе с
+    параметрами и маршрутом, последние хранятся для страницы /admin/perf.
+Агрегаты живут в памяти процесса и отдаются в текстовом формате Prometheus.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '5'))
+# Если задан, /metrics доступен по заголовку Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+RECENT_LIMIT = 50  # сколько последних медленных запросов и N+1 хранить
+
+logger = logging.getLogger('my_university.sql')
+
+_lock = threading.Lock()
+_endpoints = {}
+_slow_queries = deque(maxlen=RECENT_LIMIT)
+_n_plus_one = deque(maxlen=RECENT_LIMIT)
+_collectors = []  # функции, возвращающие дополнительные строки для /metrics
+# Метка запросов мимо маршрутов (404): путь в метке плодил бы серии без предела
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+def _short(value, limit=500):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _route():
+    if not has_request_context():
+        return None
+    return request.endpoint or UNMATCHED_ROUTE
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    stats = g.get('sql_stats') if has_request_context() else None
+    if stats is not None:
+        stats['statements'] += 1
+        stats['db_time'] += elapsed
+        stats['texts'][statement] += 1
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = _route()
+        if stats is not None:
+            stats['slow'] += 1
+        logger.warning("Медленный запрос %.1f мс [%s]: %s; параметры: %s",
+                       elapsed * 1000, route or '-', statement, _short(parameters))
+        with _lock:
+            _slow_queries.appendleft({
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'route': route,
+                'ms': round(elapsed * 1000, 1),
+                'statement': statement,
+                'parameters': _short(parameters),
+            })
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Подключает учет запросов к движку (повторный вызов ничего не делает)"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+
+def _finish(endpoint, stats):
+    request_time = time.perf_counter() - stats['start']
+    duplicates = {text: count for text, count in stats['texts'].items() if count >= N_PLUS_ONE_THRESHOLD}
+
+    for text, count in duplicates.items():
+        logger.warning("Возможный N+1 [%s]: выражение выполнено %d раз: %s", endpoint, count, text)
+
+    with _lock:
+        for text, count in duplicates.items():
+            _n_plus_one.appendleft({
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'route': endpoint,
+                'count': count,
+                'statement': text,
+            })
+
+        agg = _endpoints.setdefault(endpoint, {
+            'requests': 0, 'statements': 0, 'db_time': 0.0, 'request_time': 0.0,
+            'max_statements': 0, 'max_db_time': 0.0, 'n_plus_one': 0, 'slow': 0,
+        })
+        agg['requests'] += 1
+        agg['statements'] += stats['statements']
+        agg['db_time'] += stats['db_time']
+        agg['request_time'] += request_time
+        agg['max_statements'] = max(agg['max_statements'], stats['statements'])
+        agg['max_db_time'] = max(agg['max_db_time'], stats['db_time'])
+        agg['n_plus_one'] += 1 if duplicates else 0
+        agg['slow'] += stats['slow']
+
+
+def instrument_app(app):
+    @app.before_request
+    def _start_request_stats():
+        g.sql_stats = {'statements': 0, 'db_time': 0.0, 'slow': 0, 'texts': Counter(),
+                       'start': time.perf_counter()}
+
+    @app.after_request
+    def _finish_request_stats(response):
+        stats = g.get('sql_stats')
+        if stats is not None:
+            # Потоковые ответы выполняют запросы уже после after_request,
+            # поэтому итог подводится при закрытии ответа
+            endpoint = _route()
+            response.call_on_close(lambda: _finish(endpoint, stats))
+        return response
+
+
+def pool_metrics(engine):
+    """Строки Prometheus о пуле соединений движка (ожидание checkout - для TimedQueuePool)"""
+    pool = engine.pool  # после dispose() пул другой, поэтому берется при каждом сборе
+    lines = []
+    if hasattr(pool, 'checkedout'):
+        for name, help_text, value in (
+                ('myuni_db_pool_size', 'Размер пула', pool.size()),
+                ('myuni_db_pool_checked_out', 'Выданные соединения', pool.checkedout()),
+                ('myuni_db_pool_overflow', 'Соединения сверх pool_size', pool.overflow()),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+
+    if hasattr(pool, 'wait_buckets'):
+        with pool.wait_lock:
+            buckets = list(pool.wait_buckets)
+            count, total, longest, timeouts = pool.wait_count, pool.wait_seconds, pool.wait_max, pool.wait_timeouts
+
+        name = 'myuni_db_pool_checkout_wait_seconds'
+        lines += [f'# HELP {name} Ожидание соединения из пула', f'# TYPE {name} histogram']
+        cumulative = 0
+        for bound, hits in zip(list(pool.WAIT_BUCKETS) + ['+Inf'], buckets):
+            cumulative += hits
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{name}_sum {total}', f'{name}_count {count}',
+                  '# HELP myuni_db_pool_checkout_wait_max_seconds Самое долгое ожидание соединения',
+                  '# TYPE myuni_db_pool_checkout_wait_max_seconds gauge',
+                  f'myuni_db_pool_checkout_wait_max_seconds {longest}',
+                  '# HELP myuni_db_pool_checkout_timeouts_total Checkout, завершившиеся по pool_timeout',
+                  '# TYPE myuni_db_pool_checkout_timeouts_total counter',
+                  f'myuni_db_pool_checkout_timeouts_total {timeouts}']
+    return lines
+
+
+def instrument(app, engine):
+    instrument_engine(engine)
+    instrument_app(app)
+    add_collector(lambda: pool_metrics(engine))
+
+
+def add_collector(collector):
+    """Регистрирует функцию, возвращающую строки метрик Prometheus"""
+    _collectors.append(collector)
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
+        _slow_queries.clear()
+        _n_plus_one.clear()
+
+
+def snapshot():
+    """Агрегаты для страницы /admin/perf, эндпоинты - по суммарному времени БД"""
+    with _lock:
+        endpoints = []
+        for name, agg in _endpoints.items():
+            endpoints.append({
+                'endpoint': name,
+                'requests': agg['requests'],
+                'statements_avg': agg['statements'] / agg['requests'],
+                'statements_max': agg['max_statements'],
+                'db_ms_avg': agg['db_time'] / agg['requests'] * 1000,
+                'db_ms_max': agg['max_db_time'] * 1000,
+                'db_ms_total': agg['db_time'] * 1000,
+                'request_ms_avg': agg['request_time'] / agg['requests'] * 1000,
+                'n_plus_one': agg['n_plus_one'],
+                'slow': agg['slow'],
+            })
+        endpoints.sort(key=lambda e: e['db_ms_total'], reverse=True)
+        return {
+            'endpoints': endpoints,
+            'slow_queries': list(_slow_queries),
+            'n_plus_one': list(_n_plus_one),
+        }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    metrics = [
+        ('myuni_http_requests_total', 'counter', 'HTTP-запросы', 'requests'),
+        ('myuni_http_request_seconds_total', 'counter', 'Суммарное время обработки запросов', 'request_time'),
+        ('myuni_sql_statements_total', 'counter', 'Выполненные SQL-выражения', 'statements'),
+        ('myuni_sql_seconds_total', 'counter', 'Суммарное время SQL-выражений', 'db_time'),
+        ('myuni_sql_statements_max', 'gauge', 'Максимум SQL-выражений за один запрос', 'max_statements'),
+        ('myuni_sql_n_plus_one_requests_total', 'counter', 'Запросы с признаками N+1', 'n_plus_one'),
+        ('myuni_sql_slow_statements_total', 'counter', 'Медленные SQL-выражения', 'slow'),
+    ]
+    with _lock:
+        endpoints = sorted(_endpoints.items())
+
+    lines = []
+    for name, kind, help_text, key in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for endpoint, agg in endpoints:
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {agg[key]}')
+
+    for collector in _collectors:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
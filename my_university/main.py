@@ -1,18 +1,32 @@
 from flask import Flask
 from flask_login import LoginManager
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from my_university.config import get_db_url, get_secret_key
-from my_university.models import User
-
-engine = create_engine(get_db_url())
-Session = sessionmaker(bind=engine)
+from my_university.config import create_db_engine, get_replica_url, get_secret_key
+from my_university.instrumentation import instrument, instrument_engine, add_collector
+from my_university.db_routing import RoutingSession, install_routing, routing_metrics
+from my_university.principal import get_principal
+from my_university.material_uploads import upload_metrics
+from my_university.material_cache import cache_metrics, ENABLED as material_cache_enabled
+from my_university.s3_client import ensure_bucket_exists
+
+engine = create_db_engine()
+replica_engine = create_db_engine(get_replica_url()) if get_replica_url() else None
+Session = sessionmaker(class_=RoutingSession, bind=engine, replica=replica_engine)
 db_session = scoped_session(Session)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = get_secret_key()
 
+instrument(app, engine)
+install_routing(app, replica_engine)
+if replica_engine is not None:
+    instrument_engine(replica_engine)
+    add_collector(routing_metrics)
+add_collector(upload_metrics)
+if material_cache_enabled:
+    add_collector(cache_metrics)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'main.login'
 login_manager.login_message = "Пожалуйста, войдите, чтобы открыть эту страницу."
@@ -21,7 +35,7 @@ login_manager.login_message_category = "info"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db_session.query(User).get(int(user_id))
+    return get_principal(db_session, int(user_id))
 
 
 @app.teardown_appcontext
@@ -33,7 +47,16 @@ def register_blueprints():
     from my_university.routes import bp
     app.register_blueprint(bp)
 
+
+def init_storage():
+    """Проверка бакета один раз при старте, а не на каждой загрузке"""
+    try:
+        ensure_bucket_exists()
+    except Exception as e:
+        print(f"MinIO недоступен при старте, бакет будет проверен при первой загрузке: {e}")
+
 if __name__ == '__main__':
     register_blueprints()
+    init_storage()
     print("Запуск сервера...")
     app.run(debug=True, host="0.0.0.0", port=5001)
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""
+Локальный дисковый кэш файлов материалов перед MinIO.
+
+Включается MATERIAL_CACHE_DIR и используется при проксировании скачиваний
+(MATERIAL_DOWNLOAD_MODE=proxy). Объем ограничен MATERIAL_CACHE_MAX_BYTES,
+вытесняются давно не скачанные файлы (LRU). Попадание отдается через
+send_file с путем к файлу, т.е. через wsgi.file_wrapper/sendfile без
+копирования в процессе.
+
+Запись проверяется по ETag из stat объекта. Ключи по содержимому
+(sha256/...) неизменяемы, поэтому для них кэш отвечает без запроса к MinIO
+вовсе. Одновременные промахи по одному файлу ждут одну загрузку из MinIO
+(single-flight). Файлы пишутся во временный файл и переименовываются, так
+что каталог могут делить несколько процессов: чужую запись процесс
+подхватывает по файлу метаданных рядом с ней.
+
+Индекс LRU у каждого процесса свой, а предел объема - общий для каталога:
+файл кладется на место под файловой блокировкой (flock на .lock), и
+общий объем в файле .size увеличивается на его размер. Только если предел
+превышен, каталог обходится целиком и вытесняются файлы, к которым дольше
+всего не обращались (время доступа обновляется при каждом попадании).
+Поэтому N воркеров вместе занимают не больше MATERIAL_CACHE_MAX_BYTES.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from my_university.material_storage import CONTENT_PREFIX
+from my_university.s3_client import get_file_content
+
+CACHE_DIR = os.getenv('MATERIAL_CACHE_DIR', '')
+CACHE_MAX_BYTES = int(os.getenv('MATERIAL_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+# Файлы крупнее не кэшируются, чтобы один фильм не вытеснил весь кэш
+CACHE_MAX_ITEM_BYTES = int(os.getenv('MATERIAL_CACHE_MAX_ITEM_BYTES', str(CACHE_MAX_BYTES // 10)))
+# Сколько ждать чужой загрузки того же файла, прежде чем читать из MinIO самому
+FILL_WAIT_SECONDS = float(os.getenv('MATERIAL_CACHE_FILL_WAIT', '30'))
+# Недописанный .fill-* без изменений дольше этого - остаток убитого процесса
+STALE_FILL_SECONDS = float(os.getenv('MATERIAL_CACHE_STALE_FILL_SECONDS', '600'))
+ENABLED = bool(CACHE_DIR)
+
+FILL_CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # object_name -> CachedFile, от давно скачанных к недавним
+_inflight = {}  # object_name -> threading.Event загрузки в кэш
+_loaded = False
+_stats = {'hits': 0, 'misses': 0, 'fills': 0, 'evictions': 0, 'bytes_served': 0, 'bytes_filled': 0}
+_size = 0
+
+
+class CachedFile:
+    """Файл в кэше; атрибуты метаданных - как у stat объекта MinIO"""
+    __slots__ = ('object_name', 'path', 'size', 'etag', 'content_type', 'last_modified')
+
+    def __init__(self, object_name, path, size, etag, content_type, last_modified):
+        self.object_name = object_name
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.last_modified = last_modified
+
+
+def _path(object_name):
+    digest = hashlib.sha256(object_name.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], digest)
+
+
+def _write_meta(entry):
+    """Атомарно, как и сам файл: обход каталога не увидит данные одной версии с метаданными другой"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry.path), prefix='.fill-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({
+            'object_name': entry.object_name,
+            'size': entry.size,
+            'etag': entry.etag,
+            'content_type': entry.content_type,
+            'last_modified': entry.last_modified.isoformat() if entry.last_modified else None,
+        }, f)
+    os.replace(tmp_path, entry.path + '.json')
+
+
+def _read_meta(path):
+    try:
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        if os.path.getsize(path) != meta['size']:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    last_modified = datetime.fromisoformat(meta['last_modified']) if meta['last_modified'] else None
+    return CachedFile(meta['object_name'], path, meta['size'], meta['etag'], meta['content_type'], last_modified)
+
+
+def _scan():
+    """Записи всего каталога (всех процессов) от давно скачанных к недавним"""
+    found = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith('.json'):
+                entry = _read_meta(os.path.join(root, name[:-len('.json')]))
+                if entry is not None:
+                    try:
+                        found.append((os.path.getatime(entry.path), entry))
+                    except OSError:
+                        pass  # вытеснен другим процессом во время обхода
+    return [entry for _, entry in sorted(found, key=lambda item: item[0])]
+
+
+def _remove_stale_fills():
+    """
+    Удаляет временные файлы загрузок, брошенных убитыми процессами. Живая
+    загрузка пишет в файл постоянно, поэтому его mtime свежий.
+    """
+    deadline = time.time() - STALE_FILL_SECONDS
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.startswith('.fill-'):
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+
+def _load_index():
+    """Поднимает индекс из каталога при первом обращении (порядок LRU - по времени доступа)"""
+    global _loaded, _size
+    _remove_stale_fills()
+    entries = _scan()
+    for entry in entries:
+        _entries[entry.object_name] = entry
+    _size = _read_total()
+    if _size is None:
+        # Первый запуск на этом каталоге: счетчик объема - по только что обойденным файлам
+        _size = sum(entry.size for entry in entries)
+        with _dir_lock():
+            if _read_total() is None:
+                _write_total(_size)
+    _loaded = True
+
+
+@contextmanager
+def _dir_lock():
+    """Блокировка каталога кэша между процессами"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _unlink(entry):
+    for path in (entry.path, entry.path + '.json'):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _add(entry):
+    _entries.pop(entry.object_name, None)
+    _entries[entry.object_name] = entry
+
+
+def _total_path():
+    return os.path.join(CACHE_DIR, '.size')
+
+
+def _read_total():
+    """Общий объем кэша (под _dir_lock); None - счетчика нет или он испорчен"""
+    try:
+        with open(_total_path()) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_total(total):
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.fill-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(total))
+    os.replace(tmp_path, _total_path())
+
+
+def _publish(tmp_path, entry):
+    """
+    Кладет скачанный файл на место и учитывает его в общем объеме (вызывается
+    без _lock). Каталог обходится, только если предел превышен или счетчика
+    нет: тогда объем пересчитывается по файлам всех процессов и вытесняются
+    давние записи, самая свежая остается.
+    """
+    global _size
+    evicted = []
+    with _dir_lock():
+        total = _read_total()
+        old = _read_meta(entry.path)
+        os.replace(tmp_path, entry.path)
+        _write_meta(entry)
+        if total is not None:
+            total += entry.size - (old.size if old is not None else 0)
+
+        if total is None or total > CACHE_MAX_BYTES:
+            entries = _scan()
+            total = sum(item.size for item in entries)
+            while total > CACHE_MAX_BYTES and len(entries) > 1:
+                victim = entries.pop(0)
+                _unlink(victim)
+                total -= victim.size
+                evicted.append(victim)
+        _write_total(total)
+
+    with _lock:
+        for victim in evicted:
+            cached = _entries.get(victim.object_name)
+            if cached is not None and cached.path == victim.path:
+                del _entries[victim.object_name]
+        _stats['evictions'] += len(evicted)
+        _size = total
+
+
+def _lookup(object_name, etag=None):
+    """Запись кэша (под _lock), если она есть, совпадает по ETag и файл на месте"""
+    if not _loaded:
+        _load_index()
+    entry = _entries.get(object_name)
+    if entry is None:
+        return None
+    if etag is not None and entry.etag != etag:
+        # Файл устаревшей версии заменит загрузка новой (_publish учтет разницу в объеме)
+        del _entries[object_name]
+        return None
+    try:
+        # Время доступа - порядок вытеснения для всех процессов (см. _publish)
+        os.utime(entry.path)
+    except OSError:
+        del _entries[object_name]  # вытеснен другим процессом
+        return None
+    _entries.move_to_end(object_name)
+    return entry
+
+
+def cached_stat(object_name):
+    """Метаданные неизменяемого объекта из кэша или None - тогда нужен stat в MinIO"""
+    if not ENABLED or not object_name.startswith(CONTENT_PREFIX + '/'):
+        return None
+    with _lock:
+        return _lookup(object_name)
+
+
+def _fill(object_name, stat, etag):
+    """Скачивает объект в кэш; None - если не удалось"""
+    entry = _read_meta(_path(object_name))
+    if entry is not None and entry.etag == etag:
+        return entry  # уже скачан другим процессом
+
+    response = get_file_content(object_name)
+    if response is None:
+        return None
+
+    path = _path(object_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.fill-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.stream(FILL_CHUNK_SIZE):
+                f.write(chunk)
+        entry = CachedFile(object_name, path, stat.size, etag, stat.content_type, stat.last_modified)
+        _publish(tmp_path, entry)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    finally:
+        response.close()
+        response.release_conn()
+    return entry
+
+
+def _fill_flight(object_name, stat, etag, flight):
+    """Загрузка в кэш для всех, кто ждет flight; возвращает запись или None"""
+    entry = None
+    try:
+        entry = _fill(object_name, stat, etag)
+    except Exception as e:
+        print(f"Ошибка записи {object_name} в кэш материалов: {e}")
+    finally:
+        with _lock:
+            if entry is not None:
+                _add(entry)
+                _stats['fills'] += 1
+                _stats['bytes_filled'] += entry.size
+            del _inflight[object_name]
+        flight.set()
+    return entry
+
+
+def get_cached_file(object_name, stat, background=False):
+    """
+    Локальная копия объекта (CachedFile) с метаданными stat или None, если файл
+    нужно отдавать потоком из MinIO (кэш выключен, файл слишком велик,
+    загрузка не удалась).
+
+    background=True - для запросов части файла (Range): при промахе файл
+    докачивается в кэш в фоновом потоке, а сразу возвращается None, чтобы
+    диапазон отдавался из MinIO, не дожидаясь загрузки всего объекта.
+    """
+    if not ENABLED:
+        return None
+
+    etag = stat.etag.strip('"')
+    with _lock:
+        entry = _lookup(object_name, etag)
+        if entry is not None:
+            _stats['hits'] += 1
+            _stats['bytes_served'] += entry.size
+            return entry
+        _stats['misses'] += 1
+        if stat.size > CACHE_MAX_ITEM_BYTES:
+            return None
+        flight = _inflight.get(object_name)
+        leader = flight is None
+        if leader:
+            flight = _inflight[object_name] = threading.Event()
+
+    if background:
+        if leader:
+            threading.Thread(target=_fill_flight, args=(object_name, stat, etag, flight),
+                             name='material-cache-fill', daemon=True).start()
+        return None
+
+    if not leader:
+        # Тот же файл уже скачивается: ждем его, а не идем в MinIO второй раз
+        flight.wait(FILL_WAIT_SECONDS)
+        with _lock:
+            entry = _lookup(object_name, etag)
+            if entry is not None:
+                _stats['hits'] += 1
+                _stats['misses'] -= 1
+                _stats['bytes_served'] += entry.size
+            return entry
+
+    entry = _fill_flight(object_name, stat, etag, flight)
+    if entry is not None:
+        with _lock:
+            _stats['bytes_served'] += entry.size
+    return entry
+
+
+def cache_metrics():
+    with _lock:
+        stats = dict(_stats)
+        size, count = _size, len(_entries)
+    lookups = stats['hits'] + stats['misses']
+    return [
+        '# HELP myuni_material_cache_requests_total Обращения к дисковому кэшу материалов',
+        '# TYPE myuni_material_cache_requests_total counter',
+        f'myuni_material_cache_requests_total{{result="hit"}} {stats["hits"]}',
+        f'myuni_material_cache_requests_total{{result="miss"}} {stats["misses"]}',
+        '# HELP myuni_material_cache_hit_ratio Доля попаданий с запуска процесса',
+        '# TYPE myuni_material_cache_hit_ratio gauge',
+        f'myuni_material_cache_hit_ratio {stats["hits"] / lookups if lookups else 0}',
+        '# HELP myuni_material_cache_served_bytes_total Байты, отданные из кэша',
+        '# TYPE myuni_material_cache_served_bytes_total counter',
+        f'myuni_material_cache_served_bytes_total {stats["bytes_served"]}',
+        '# HELP myuni_material_cache_filled_bytes_total Байты, скачанные из MinIO в кэш',
+        '# TYPE myuni_material_cache_filled_bytes_total counter',
+        f'myuni_material_cache_filled_bytes_total {stats["bytes_filled"]}',
+        '# HELP myuni_material_cache_evictions_total Файлы, вытесненные из кэша',
+        '# TYPE myuni_material_cache_evictions_total counter',
+        f'myuni_material_cache_evictions_total {stats["evictions"]}',
+        '# HELP myuni_material_cache_bytes Объем кэша на диске',
+        '# TYPE myuni_material_cache_bytes gauge',
+        f'myuni_material_cache_bytes {size}',
+        '# HELP myuni_material_cache_files Файлы в кэше',
+        '# TYPE myuni_material_cache_files gauge',
+        f'myuni_material_cache_files {count}',
+    ]
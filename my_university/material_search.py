@@ -0,0 +1,144 @@
+"""
+Полнотекстовый поиск по учебным материалам.
+
+В PostgreSQL у education_material есть колонка search_vector (tsvector,
+конфигурация russian) с GIN-индексом - ее добавляет миграция 0001.
+Колонки нет в models.py: она заполняется приложением (при загрузке материала
+и при переименовании преподавателя) и не нужна ORM. В остальных СУБД и до
+применения миграции поиск откатывается к ILIKE.
+
+Веса документа: A - название материала, B - предмет, C - ФИО преподавателя.
+"""
+import os
+import re
+import time
+
+from sqlalchemy import Float, func, literal_column, or_, text
+
+from my_university.models import EducationMaterial, Subject, Teacher
+
+SEARCH_CONFIG = 'russian'
+
+search_vector = literal_column('education_material.search_vector')
+
+# Обновление вектора одной командой по JOIN с предметом и преподавателем.
+# Этот же SQL использует миграция для заполнения существующих строк.
+REFRESH_SQL = """
+    UPDATE education_material AS em
+    SET search_vector =
+        setweight(to_tsvector('{config}', coalesce(em.education_material_name, '')), 'A') ||
+        setweight(to_tsvector('{config}', coalesce(s.subject_name, '')), 'B') ||
+        setweight(to_tsvector('{config}', coalesce(t.full_name, '')), 'C')
+    FROM subject AS s, teacher AS t
+    WHERE s.subject_id = em.subject_id AND t.teacher_id = em.teacher_id
+""".format(config=SEARCH_CONFIG)
+
+_WORD = re.compile(r'\w+')
+
+# Как долго верить проверке схемы (колонка search_vector, а в people_search -
+# расширение pg_trgm): миграция, примененная (или откаченная)
+# на работающем приложении, подхватывается без перезапуска
+PROBE_TTL = float(os.getenv('MATERIAL_SEARCH_PROBE_TTL', '60'))
+
+_enabled = {}  # url движка -> (есть ли search_vector, когда проверено)
+
+
+def search_enabled(session):
+    """Доступен ли полнотекстовый поиск (PostgreSQL и применена миграция)"""
+    bind = session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+
+    key = str(bind.url)
+    cached = _enabled.get(key)
+    if cached is not None and time.monotonic() - cached[1] < PROBE_TTL:
+        return cached[0]
+
+    enabled = session.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'education_material' AND column_name = 'search_vector'"
+    )).first() is not None
+    _enabled[key] = (enabled, time.monotonic())
+    return enabled
+
+
+def refresh_search_vectors(session, material_ids=None, teacher_id=None, subject_id=None):
+    """Пересчитывает search_vector у материалов по id, преподавателю или предмету"""
+    if not search_enabled(session):
+        return
+
+    conditions = []
+    params = {}
+    if material_ids is not None:
+        conditions.append("em.education_material_id = ANY(:material_ids)")
+        params['material_ids'] = list(material_ids)
+    if teacher_id is not None:
+        conditions.append("em.teacher_id = :teacher_id")
+        params['teacher_id'] = teacher_id
+    if subject_id is not None:
+        conditions.append("em.subject_id = :subject_id")
+        params['subject_id'] = subject_id
+    if not conditions:
+        return
+
+    session.flush()
+    session.execute(text(REFRESH_SQL + " AND (" + " OR ".join(conditions) + ")"), params)
+
+
+def prefix_tsquery(search_text):
+    """
+    'линейн алгеб' -> tsquery 'линейн:* & алгеб:*' в конфигурации russian.
+    Из строки берутся только слова, поэтому спецсимволы tsquery не пройдут.
+    """
+    words = _WORD.findall(search_text.lower())
+    if not words:
+        return None
+    return func.to_tsquery(SEARCH_CONFIG, ' & '.join(f"{word}:*" for word in words))
+
+
+def apply_search(session, query, search_text):
+    """
+    Добавляет поиск к запросу материалов (уже соединенному с Subject и Teacher).
+    Возвращает (запрос, выражение ранга или None, если ранжирования нет).
+    """
+    if search_enabled(session):
+        tsquery = prefix_tsquery(search_text)
+        if tsquery is None:
+            return query, None
+        rank = func.ts_rank_cd(search_vector, tsquery, type_=Float)
+        return query.filter(search_vector.op('@@')(tsquery)), rank
+
+    pattern = f'%{search_text}%'
+    return query.filter(or_(
+        EducationMaterial.education_material_name.ilike(pattern),
+        Subject.subject_name.ilike(pattern),
+        Teacher.full_name.ilike(pattern),
+    )), None
+
+
+def search_materials(session, search_text, limit=10):
+    """Лучшие совпадения для подсказок при вводе"""
+    query = session.query(
+        EducationMaterial.education_material_id,
+        EducationMaterial.education_material_name,
+        Subject.subject_name,
+        Teacher.full_name,
+    ) \
+        .join(Subject, EducationMaterial.subject_id == Subject.subject_id) \
+        .join(Teacher, EducationMaterial.teacher_id == Teacher.teacher_id)
+
+    query, rank = apply_search(session, query, search_text)
+    if rank is not None:
+        query = query.order_by(rank.desc(), EducationMaterial.education_material_id)
+    else:
+        query = query.order_by(EducationMaterial.education_material_name, EducationMaterial.education_material_id)
+
+    return [
+        {
+            'id': row.education_material_id,
+            'name': row.education_material_name,
+            'subject': row.subject_name,
+            'teacher': row.full_name,
+        }
+        for row in query.limit(limit)
+    ]
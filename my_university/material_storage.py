@@ -0,0 +1,137 @@
+"""
+Контентно-адресуемое хранение файлов учебных материалов.
+
+Файл лежит в MinIO один раз под ключом sha256/<aa>/<хэш>, сколько бы
+материалов на него ни ссылалось; stored_object хранит число ссылок.
+Повторная загрузка того же содержимого сводится к подсчету хэша по
+локальному файлу и увеличению счетчика, а объект удаляется из MinIO только
+вместе с последней ссылкой.
+
+Гонки между загрузкой и удалением одного содержимого снимает блокировка
+строки stored_object: acquire/release берут ее до конца транзакции, поэтому
+объект загружается (или удаляется из MinIO) до commit той же транзакции.
+"""
+import hashlib
+import uuid
+
+from sqlalchemy import update, delete
+
+from my_university.models import StoredObject
+from my_university.queries import upsert
+from my_university.s3_client import upload_file_to_minio, get_file_content, copy_file_in_minio
+
+CONTENT_PREFIX = 'sha256'
+# Ключи прямых загрузок из браузера до переноса по содержимому
+INCOMING_PREFIX = 'incoming'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_key(digest):
+    return f"{CONTENT_PREFIX}/{digest[:2]}/{digest}"
+
+
+def incoming_key(filename):
+    """Временный уникальный ключ файла, чье содержимое еще не известно"""
+    return f"{INCOMING_PREFIX}/{uuid.uuid4().hex}/{filename}"
+
+
+def hash_file(stream):
+    """sha256 и размер локального файла; поток возвращается в начало"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def acquire(session, object_name, sha256=None, size=None):
+    """+1 ссылка на объект; возвращает число ссылок после увеличения (1 - объекта еще не было)"""
+    stmt = upsert(session, StoredObject).values(object_name=object_name, sha256=sha256, size=size, ref_count=1)
+    return session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[StoredObject.object_name],
+            set_={'ref_count': StoredObject.ref_count + 1}
+        ).returning(StoredObject.ref_count)
+    ).scalar_one()
+
+
+def release(session, object_name):
+    """
+    -1 ссылка на объект. True - ссылок не осталось, и объект нужно удалить
+    из MinIO до commit (строка stored_object уже удалена).
+    """
+    ref_count = session.execute(
+        update(StoredObject)
+        .where(StoredObject.object_name == object_name)
+        .values(ref_count=StoredObject.ref_count - 1)
+        .returning(StoredObject.ref_count)
+    ).scalar()
+
+    if ref_count is None:
+        # Ссылок не учитывали: ключ-заглушка материала, чей файл еще не загружен
+        return True
+    if ref_count > 0:
+        return False
+
+    session.execute(delete(StoredObject).where(StoredObject.object_name == object_name))
+    return True
+
+
+class _ProgressReader:
+    """Обертка потока, сообщающая о каждом прочитанном куске"""
+
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.progress(len(data))
+        return data
+
+
+def store_file(session, stream, content_type, progress=None):
+    """
+    Сохраняет локальный файл по его содержимому и берет на него ссылку.
+    progress(n) вызывается по мере передачи файла в MinIO.
+    Возвращает (ключ объекта, размер, загружался ли файл): дубликат не загружается.
+    """
+    digest, size = hash_file(stream)
+    object_name = content_key(digest)
+    if acquire(session, object_name, digest, size) > 1:
+        return object_name, size, False
+
+    upload_file_to_minio(_ProgressReader(stream, progress) if progress else stream, object_name, content_type)
+    return object_name, size, True
+
+
+def adopt_object(session, source_name):
+    """
+    Переносит объект, загруженный под произвольным ключом, на ключ по
+    содержимому. Хэш считается чтением объекта из MinIO; копия делается
+    на стороне MinIO и только если такого содержимого еще нет.
+    Возвращает (ключ объекта, размер, создавалась ли копия).
+    """
+    response = get_file_content(source_name)
+    if response is None:
+        raise FileNotFoundError(source_name)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in response.stream(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        response.close()
+        response.release_conn()
+
+    digest = digest.hexdigest()
+    object_name = content_key(digest)
+    if acquire(session, object_name, digest, size) > 1:
+        return object_name, size, False
+
+    copy_file_in_minio(source_name, object_name)
+    return object_name, size, True
@@ -0,0 +1,253 @@
+"""
+Загрузка файлов учебных материалов в MinIO в фоновом пуле потоков.
+
+material_upload создает строку материала со статусом pending и сразу
+отвечает; файл уходит в хранилище multipart-загрузкой в одном из
+MATERIAL_UPLOAD_WORKERS потоков, после чего статус становится ready
+(или failed). Файл хранится по хэшу содержимого (material_storage), так что
+дубликат уже хранимого файла не загружается вовсе. Ход загрузки отдает /api/materials/<id>/upload_status:
+из памяти процесса, выполняющего задачу, иначе - по колонке upload_status.
+При MATERIAL_UPLOAD_ASYNC=0 файл загружается прямо в запросе.
+
+При MATERIAL_DIRECT_UPLOAD=1 браузер загружает файл сам, по presigned POST
+(start_direct_upload), и присылает форму материала с подписанным токеном;
+finish_direct_upload проверяет токен и наличие объекта в MinIO. Файл тогда
+вообще не проходит через приложение; на ключ по содержимому его переносит
+фоновая задача submit_adopt.
+"""
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import select, update
+
+from my_university.models import EducationMaterial
+from my_university.material_storage import store_file, adopt_object, release
+from my_university.s3_client import (delete_file_from_minio, ensure_bucket_exists,
+                                     get_upload_form, stat_file, PRESIGNED_TTL)
+
+UPLOAD_ASYNC = os.getenv('MATERIAL_UPLOAD_ASYNC', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+UPLOAD_WORKERS = int(os.getenv('MATERIAL_UPLOAD_WORKERS', '4'))
+# Сколько секунд завершенная задача остается в памяти для запросов статуса
+JOB_TTL = float(os.getenv('MATERIAL_UPLOAD_JOB_TTL', '3600'))
+DIRECT_UPLOAD = os.getenv('MATERIAL_DIRECT_UPLOAD', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+MAX_UPLOAD_BYTES = int(os.getenv('MATERIAL_MAX_UPLOAD_BYTES', str(2 * 1024 ** 3)))
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+_lock = threading.Lock()
+_executor = None
+_jobs = {}  # material_id -> состояние задачи
+_totals = {'submitted': 0, 'ready': 0, 'failed': 0, 'bytes': 0, 'deduplicated': 0, 'bytes_saved': 0}
+
+
+def detach_stream(file_storage):
+    """
+    Забирает поток загруженного файла у запроса.
+
+    Werkzeug уже записал тело файла во временный файл (или в память для
+    небольших файлов) и закрывает его в конце запроса. Поток подменяется
+    пустым, чтобы фоновая задача читала его без лишнего копирования.
+    """
+    stream = file_storage.stream
+    file_storage.stream = io.BytesIO()
+    stream.seek(0)
+    return stream
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='material-upload')
+        return _executor
+
+
+def _forget_finished(now):
+    for material_id in [m for m, job in _jobs.items() if job['finished'] and now - job['finished'] > JOB_TTL]:
+        del _jobs[material_id]
+
+
+def submit_upload(session_factory, material_id, stream, content_type):
+    """Ставит загрузку в очередь; материал уже сохранен в БД со статусом pending"""
+    job = {'status': STATUS_PENDING, 'bytes': 0, 'error': None, 'started': time.time(), 'finished': None}
+    with _lock:
+        _forget_finished(time.time())
+        _jobs[material_id] = job
+        _totals['submitted'] += 1
+
+    _get_executor().submit(_run_upload, session_factory, material_id, job, stream, content_type)
+
+
+def _run_upload(session_factory, material_id, job, stream, content_type):
+    def progress(n):
+        job['bytes'] += n
+
+    session = session_factory()
+    status = STATUS_READY
+    size, uploaded = 0, False
+    try:
+        object_name, size, uploaded = store_file(session, stream, content_type, progress=progress)
+        if not _attach(session, material_id, object_name, upload_status=STATUS_READY):
+            # Материал удалили, пока файл загружался. Объект удаляется до
+            # rollback: пока строка stored_object заблокирована, его никто не займет
+            if uploaded:
+                delete_file_from_minio(object_name)
+            session.rollback()
+        else:
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка фоновой загрузки материала {material_id} в MinIO: {e}")
+        job['error'] = str(e)
+        status = STATUS_FAILED
+        try:
+            _attach(session, material_id, upload_status=STATUS_FAILED)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Не удалось обновить статус материала {material_id}: {e}")
+    finally:
+        session.close()
+        stream.close()
+
+    with _lock:
+        job['status'] = status
+        job['finished'] = time.time()
+        _totals[status] += 1
+        _totals['bytes'] += job['bytes']
+        if status == STATUS_READY and not uploaded:
+            _totals['deduplicated'] += 1
+            _totals['bytes_saved'] += size
+
+
+def _attach(session, material_id, object_name=None, **values):
+    """Обновляет материал (и его ключ в хранилище); False - материала уже нет"""
+    if object_name is not None:
+        values['education_material_link'] = object_name
+    result = session.execute(
+        update(EducationMaterial)
+        .where(EducationMaterial.education_material_id == material_id)
+        .values(**values)
+    )
+    return result.rowcount > 0
+
+
+def submit_adopt(session_factory, material_id, source_name):
+    """Переносит прямую загрузку материала на ключ по содержимому в фоне"""
+    _get_executor().submit(_run_adopt, session_factory, material_id, source_name)
+
+
+def _run_adopt(session_factory, material_id, source_name):
+    session = session_factory()
+    try:
+        object_name, size, copied = adopt_object(session, source_name)
+        moved = session.execute(
+            update(EducationMaterial)
+            .where(EducationMaterial.education_material_id == material_id,
+                   EducationMaterial.education_material_link == source_name)
+            .values(education_material_link=object_name)
+        ).rowcount > 0
+        if not moved:
+            # Материал удалили во время переноса
+            if copied:
+                delete_file_from_minio(object_name)
+            session.rollback()
+            return
+
+        if release(session, source_name):
+            delete_file_from_minio(source_name)
+        session.commit()
+
+        if not copied:
+            with _lock:
+                _totals['deduplicated'] += 1
+                _totals['bytes_saved'] += size
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка переноса {source_name} по содержимому: {e}")
+    finally:
+        session.close()
+
+
+def upload_status(session, material_id):
+    """Состояние загрузки материала или None, если материала нет"""
+    with _lock:
+        job = _jobs.get(material_id)
+        if job is not None:
+            return {'status': job['status'], 'bytes': job['bytes'], 'error': job['error']}
+
+    status = session.scalar(
+        select(EducationMaterial.upload_status).where(EducationMaterial.education_material_id == material_id)
+    )
+    if status is None:
+        return None
+    return {'status': status, 'bytes': None, 'error': None}
+
+
+def upload_metrics():
+    with _lock:
+        running = sum(1 for job in _jobs.values() if job['finished'] is None)
+        totals = dict(_totals)
+    return [
+        '# HELP myuni_material_uploads_total Фоновые загрузки материалов по итогу',
+        '# TYPE myuni_material_uploads_total counter',
+        f'myuni_material_uploads_total{{status="submitted"}} {totals["submitted"]}',
+        f'myuni_material_uploads_total{{status="ready"}} {totals["ready"]}',
+        f'myuni_material_uploads_total{{status="failed"}} {totals["failed"]}',
+        '# HELP myuni_material_upload_bytes_total Байты, переданные в MinIO фоновыми загрузками',
+        '# TYPE myuni_material_upload_bytes_total counter',
+        f'myuni_material_upload_bytes_total {totals["bytes"]}',
+        '# HELP myuni_material_uploads_in_progress Загрузки в очереди или в работе',
+        '# TYPE myuni_material_uploads_in_progress gauge',
+        f'myuni_material_uploads_in_progress {running}',
+        '# HELP myuni_material_dedup_total Загрузки, совпавшие с уже хранимым содержимым',
+        '# TYPE myuni_material_dedup_total counter',
+        f'myuni_material_dedup_total {totals["deduplicated"]}',
+        '# HELP myuni_material_dedup_bytes_total Байты, которые не пришлось хранить повторно',
+        '# TYPE myuni_material_dedup_bytes_total counter',
+        f'myuni_material_dedup_bytes_total {totals["bytes_saved"]}',
+    ]
+
+
+def _token_serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt='material-direct-upload')
+
+
+def start_direct_upload(secret_key, teacher_id, object_name, content_type):
+    """Presigned POST на один объект и токен, который браузер вернет вместе с формой"""
+    ensure_bucket_exists()
+    url, fields = get_upload_form(object_name, content_type, MAX_UPLOAD_BYTES)
+    token = _token_serializer(secret_key).dumps({'object': object_name, 'teacher': teacher_id})
+    return {'url': url, 'fields': fields, 'token': token}
+
+
+def finish_direct_upload(secret_key, token, teacher_id):
+    """
+    Проверяет завершение прямой загрузки, возвращает имя объекта.
+    Токен должен быть выдан этому преподавателю и не старше ссылки,
+    а объект - существовать и укладываться в MAX_UPLOAD_BYTES.
+    """
+    max_age = int(PRESIGNED_TTL.total_seconds()) + 600  # запас на саму загрузку
+    try:
+        data = _token_serializer(secret_key).loads(token, max_age=max_age)
+    except SignatureExpired:
+        raise ValueError('Срок действия ссылки на загрузку истек, загрузите файл заново')
+    except BadSignature:
+        raise ValueError('Некорректный токен загрузки')
+
+    if data.get('teacher') != teacher_id:
+        raise ValueError('Файл загружен другим пользователем')
+
+    stat = stat_file(data['object'])
+    if stat is None:
+        raise ValueError('Файл не найден в хранилище, загрузите его заново')
+    if stat.size > MAX_UPLOAD_BYTES:
+        delete_file_from_minio(data['object'])
+        raise ValueError('Файл превышает допустимый размер')
+    return data['object']
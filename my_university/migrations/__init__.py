@@ -0,0 +1,86 @@
+"""
+Версионные миграции схемы.
+
+create_all создает только недостающие таблицы и не меняет существующие,
+поэтому все, что добавляется к уже развернутой базе (колонки, индексы,
+расширения), оформляется отдельной миграцией:
+
+    my_university/migrations/mNNNN_<название>.py
+        VERSION = NNNN
+        DESCRIPTION = "..."
+        def upgrade(connection): ...
+
+Каждая миграция выполняется в своей транзакции и должна быть идемпотентной
+(IF NOT EXISTS), т.к. свежая база после create_all уже может содержать
+часть объектов из models.py. Если upgrade вернул False (например, на сервере
+нет нужного расширения), миграция не записывается и будет повторена при
+следующем запуске. Применение:
+
+    python -m my_university.migrations            # применить недостающие
+    python -m my_university.migrations --status   # показать состояние
+"""
+import importlib
+import pkgutil
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, func, select, text
+
+_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False, server_default=func.now()),
+)
+
+# Произвольный ключ pg_advisory_xact_lock: миграции из двух процессов не пойдут параллельно
+_LOCK_KEY = 7402031
+
+
+def load_migrations():
+    """Модули миграций пакета, отсортированные по VERSION"""
+    modules = [
+        importlib.import_module(f"{__name__}.{info.name}")
+        for info in pkgutil.iter_modules(__path__)
+        if info.name.startswith('m')
+    ]
+    modules.sort(key=lambda module: module.VERSION)
+
+    versions = [module.VERSION for module in modules]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций: {versions}")
+    return modules
+
+
+def applied_versions(connection):
+    schema_version.create(connection, checkfirst=True)
+    return set(connection.scalars(select(schema_version.c.version)))
+
+
+def upgrade(engine):
+    """Применяет недостающие миграции по порядку, возвращает список примененных версий"""
+    applied = []
+    for migration in load_migrations():
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': _LOCK_KEY})
+            if migration.VERSION in applied_versions(connection):
+                continue
+
+            print(f"  - Миграция {migration.VERSION:04d}: {migration.DESCRIPTION}")
+            if migration.upgrade(connection) is False:
+                print("    отложена до следующего запуска")
+                continue
+            connection.execute(schema_version.insert().values(
+                version=migration.VERSION, description=migration.DESCRIPTION
+            ))
+            applied.append(migration.VERSION)
+    return applied
+
+
+def status(engine):
+    """Список (версия, описание, применена ли)"""
+    with engine.connect() as connection:
+        done = applied_versions(connection)
+        connection.commit()
+    return [(m.VERSION, m.DESCRIPTION, m.VERSION in done) for m in load_migrations()]
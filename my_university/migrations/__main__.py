@@ -0,0 +1,26 @@
+import argparse
+
+from my_university.config import create_db_engine
+from my_university.migrations import upgrade, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--status', action='store_true', help='только показать примененные миграции')
+    parser.add_argument('--db-url', default=None, help='по умолчанию - из переменных окружения POSTGRES_*')
+    args = parser.parse_args()
+
+    # Построение индексов на больших таблицах не должно упираться в statement_timeout
+    engine = create_db_engine(args.db_url, statement_timeout_ms=0)
+
+    if args.status:
+        for version, description, done in status(engine):
+            print(f"{version:04d} [{'x' if done else ' '}] {description}")
+        return
+
+    applied = upgrade(engine)
+    print(f"Применено миграций: {len(applied)}" if applied else "Схема актуальна.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+from my_university.material_search import REFRESH_SQL
+
+VERSION = 1
+DESCRIPTION = "Полнотекстовый поиск по учебным материалам (tsvector + GIN)"
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(text("ALTER TABLE education_material ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+    connection.execute(text(REFRESH_SQL))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_education_material_search_vector "
+        "ON education_material USING GIN (search_vector)"
+    ))
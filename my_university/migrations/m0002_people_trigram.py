@@ -0,0 +1,24 @@
+from sqlalchemy import text
+
+VERSION = 2
+DESCRIPTION = "Триграммные индексы по ФИО студентов, преподавателей и админов"
+
+TABLES = ('student', 'teacher', 'admin')
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    available = connection.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).first()
+    if available is None:
+        print("    pg_trgm не установлен на сервере (пакет postgresql-contrib), поиск людей работает без индекса")
+        return False
+
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for table in TABLES:
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_full_name_trgm ON {table} USING GIN (full_name gin_trgm_ops)"
+        ))
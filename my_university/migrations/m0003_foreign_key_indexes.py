@@ -0,0 +1,28 @@
+from my_university.models import Base
+
+VERSION = 3
+DESCRIPTION = "Индексы внешних ключей и составные индексы под запросы расписания и списков"
+
+# Определения индексов - в models.py (там же их видит create_all для новой базы)
+INDEX_NAMES = (
+    'ix_schedule_teacher_day_slot',
+    'ix_schedule_classroom_day_slot',
+    'ix_schedule_subject_id',
+    'ix_student_group_id',
+    'ix_teacher_department_id',
+    'ix_study_group_curriculum_id',
+    'ix_teacher_subject_subject_id',
+    'ix_education_material_teacher_name',
+    'ix_education_material_name_id',
+    'ix_education_material_subject_id',
+)
+
+
+def model_indexes():
+    found = {index.name: index for table in Base.metadata.tables.values() for index in table.indexes}
+    return [found[name] for name in INDEX_NAMES]
+
+
+def upgrade(connection):
+    for index in model_indexes():
+        index.create(connection, checkfirst=True)
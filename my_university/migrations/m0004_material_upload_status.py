@@ -0,0 +1,14 @@
+from sqlalchemy import text
+
+VERSION = 4
+DESCRIPTION = "Статус фоновой загрузки файла учебного материала"
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(text(
+        "ALTER TABLE education_material "
+        "ADD COLUMN IF NOT EXISTS upload_status VARCHAR(20) NOT NULL DEFAULT 'ready'"
+    ))
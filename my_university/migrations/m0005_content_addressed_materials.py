@@ -0,0 +1,23 @@
+from sqlalchemy import text
+
+from my_university.models import StoredObject
+
+VERSION = 5
+DESCRIPTION = "Хранение файлов материалов по содержимому: имя файла и счетчик ссылок на объекты"
+
+
+def upgrade(connection):
+    StoredObject.__table__.create(connection, checkfirst=True)
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("ALTER TABLE education_material ADD COLUMN IF NOT EXISTS file_name VARCHAR(255)"))
+
+    # Уже загруженные файлы остаются под старыми ключами; ссылки на них считаются,
+    # чтобы удаление одного из материалов не стирало общий объект
+    connection.execute(text(
+        "INSERT INTO stored_object (object_name, ref_count) "
+        "SELECT education_material_link, COUNT(*) FROM education_material "
+        "WHERE education_material_link NOT LIKE 'http://%' AND education_material_link NOT LIKE 'https://%' "
+        "GROUP BY education_material_link "
+        "ON CONFLICT (object_name) DO NOTHING"
+    ))
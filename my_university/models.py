@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, INTEGER, String, ForeignKey, Integer, DATE, TIME, Table, UniqueConstraint
+    Column, INTEGER, BigInteger, String, ForeignKey, Integer, DATE, TIME, Table, Text, UniqueConstraint, Index
 )
 from sqlalchemy.orm import (
     relationship, DeclarativeBase
@@ -12,7 +12,8 @@ class Base(DeclarativeBase): pass
 
 teacher_subject_association = Table('teacher_subject', Base.metadata,
                                     Column('teacher_id', Integer, ForeignKey('teacher.teacher_id'), primary_key=True),
-                                    Column('subject_id', Integer, ForeignKey('subject.subject_id'), primary_key=True)
+                                    Column('subject_id', Integer, ForeignKey('subject.subject_id'), primary_key=True),
+                                    Index('ix_teacher_subject_subject_id', 'subject_id')
                                     )
 
 
@@ -55,7 +56,7 @@ class Student(Base):
     __tablename__ = "student"
 
     student_id = Column(INTEGER, primary_key=True)
-    group_id = Column(INTEGER, ForeignKey("study_group.group_id"), nullable=False)
+    group_id = Column(INTEGER, ForeignKey("study_group.group_id"), nullable=False, index=True)
     user_id = Column(INTEGER, ForeignKey("user.user_id"), nullable=False, unique=True)
     full_name = Column(String(255), nullable=False)
 
@@ -68,7 +69,7 @@ class Teacher(Base):
 
     teacher_id = Column(INTEGER, primary_key=True)
     user_id = Column(INTEGER, ForeignKey("user.user_id"), nullable=False, unique=True)
-    department_id = Column(INTEGER, ForeignKey("department.department_id"), nullable=False)
+    department_id = Column(INTEGER, ForeignKey("department.department_id"), nullable=False, index=True)
     full_name = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False, unique=True)
 
@@ -83,7 +84,7 @@ class StudyGroup(Base):
     __tablename__ = "study_group"
 
     group_id = Column(INTEGER, primary_key=True)
-    curriculum_id = Column(INTEGER, ForeignKey("curriculum.curriculum_id"), nullable=False)
+    curriculum_id = Column(INTEGER, ForeignKey("curriculum.curriculum_id"), nullable=False, index=True)
     group_name = Column(String(255), nullable=False, unique=True)
     group_course = Column(Integer, nullable=False)
 
@@ -201,6 +202,18 @@ class EducationMaterial(Base):
     teacher_id = Column(INTEGER, ForeignKey("teacher.teacher_id"), nullable=False)
     education_material_name = Column(String(255), nullable=False)
     education_material_link = Column(String(255), nullable=False)
+    # pending - файл еще загружается в MinIO фоновой задачей, failed - загрузка не удалась
+    upload_status = Column(String(20), nullable=False, server_default='ready')
+    # Исходное имя файла: ключ объекта в MinIO - хэш содержимого
+    file_name = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        # materials_list: фильтр по преподавателю + keyset-порядок (название, id)
+        Index('ix_education_material_teacher_name', 'teacher_id', 'education_material_name', 'education_material_id'),
+        # materials_list без фильтров: keyset-порядок (название, id)
+        Index('ix_education_material_name_id', 'education_material_name', 'education_material_id'),
+        Index('ix_education_material_subject_id', 'subject_id'),
+    )
 
     education_material_type = relationship("EducationMaterialType", back_populates="education_material")
     subject = relationship("Subject", back_populates="education_materials")
@@ -240,6 +253,12 @@ class Schedule(Base):
 
     __table_args__ = (
         UniqueConstraint('study_group_id', 'day_of_week', 'time_slot_id', name='_group_time_uc'),
+        # Проверка конфликтов и сетка преподавателя; INCLUDE - для index-only scan
+        Index('ix_schedule_teacher_day_slot', 'teacher_id', 'day_of_week', 'time_slot_id',
+              postgresql_include=['classroom_id', 'study_group_id']),
+        Index('ix_schedule_classroom_day_slot', 'classroom_id', 'day_of_week', 'time_slot_id',
+              postgresql_include=['teacher_id']),
+        Index('ix_schedule_subject_id', 'subject_id'),
     )
 
     study_group = relationship("StudyGroup", back_populates="schedule")
@@ -248,3 +267,30 @@ class Schedule(Base):
     time_slot = relationship("TimeSlot", back_populates="schedule")
     lesson_type = relationship("LessonType", back_populates="schedules")
     classroom = relationship("Classroom", back_populates="schedules")
+
+
+class ReferenceVersion(Base):
+    __tablename__ = "reference_version"
+
+    entity_name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class StoredObject(Base):
+    """Объект в MinIO и число материалов, ссылающихся на него"""
+    __tablename__ = "stored_object"
+
+    object_name = Column(String(255), primary_key=True)
+    # NULL - объект хранится не по содержимому (старые файлы, прямые загрузки до переноса)
+    sha256 = Column(String(64), nullable=True, unique=True)
+    size = Column(BigInteger, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+
+
+class TimetableSnapshot(Base):
+    __tablename__ = "timetable_snapshot"
+
+    owner_kind = Column(String(20), primary_key=True)
+    owner_id = Column(INTEGER, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    payload = Column(Text, nullable=True)
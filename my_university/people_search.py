@@ -0,0 +1,105 @@
+"""
+Поиск людей по ФИО сразу среди студентов, преподавателей и админов.
+
+Справочник людей - UNION ALL трех таблиц ролей, условие поиска ставится
+в каждую ветку, поэтому в PostgreSQL каждая ветка идет по своему
+триграммному GIN-индексу (миграция 0002). Поддерживаются:
+  - подстрока/префикс: full_name ILIKE '%текст%';
+  - нечеткое совпадение (опечатки): текст <% full_name - только при pg_trgm.
+Без pg_trgm (SQLite, сервер без contrib) остается только ILIKE.
+"""
+import time
+
+from sqlalchemy import select, literal, union_all, func, or_, case, text
+
+from my_university.material_search import PROBE_TTL
+from my_university.models import Student, Teacher, Admin
+
+ROLE_MODELS = (
+    ('student', Student),
+    ('teacher', Teacher),
+    ('admin', Admin),
+)
+
+_enabled = {}  # url движка -> (установлен ли pg_trgm, когда проверено)
+
+
+def trigram_enabled(session):
+    """
+    Установлен ли pg_trgm. Проверка повторяется раз в PROBE_TTL: миграция
+    0002 откладывается, пока расширения нет, и нечеткий поиск должен
+    включиться без перезапуска, когда его установят.
+    """
+    bind = session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+
+    key = str(bind.url)
+    cached = _enabled.get(key)
+    if cached is not None and time.monotonic() - cached[1] < PROBE_TTL:
+        return cached[0]
+
+    enabled = session.execute(text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    )).first() is not None
+    _enabled[key] = (enabled, time.monotonic())
+    return enabled
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def people_directory(session, search_text, role=None):
+    """
+    Подзапрос (user_id, role, full_name, prefix, score) по всем подходящим людям.
+    prefix - ФИО начинается с текста, score - word_similarity (0 без pg_trgm).
+    """
+    if role not in dict(ROLE_MODELS):
+        role = None
+
+    fuzzy = trigram_enabled(session)
+    contains = f'%{_escape_like(search_text)}%'
+    starts = f'{_escape_like(search_text)}%'
+
+    branches = []
+    for name, model in ROLE_MODELS:
+        if role and role != name:
+            continue
+
+        condition = model.full_name.ilike(contains, escape='\\')
+        score = literal(0.0)
+        if fuzzy:
+            condition = or_(condition, literal(search_text).op('<%')(model.full_name))
+            score = func.word_similarity(search_text, model.full_name)
+
+        branches.append(
+            select(
+                model.user_id,
+                literal(name).label('role'),
+                model.full_name,
+                case((model.full_name.ilike(starts, escape='\\'), 1), else_=0).label('prefix'),
+                score.label('score'),
+            ).where(condition)
+        )
+
+    return union_all(*branches).subquery('people')
+
+
+def matching_user_ids(session, search_text, role=None):
+    """SELECT user_id подходящих людей - для фильтра User.user_id.in_(...)"""
+    return select(people_directory(session, search_text, role).c.user_id)
+
+
+def search_people(session, search_text, role=None, limit=10):
+    """Лучшие совпадения для автодополнения: сначала префиксные, затем по похожести"""
+    people = people_directory(session, search_text, role)
+    rows = session.execute(
+        select(people)
+        .order_by(people.c.prefix.desc(), people.c.score.desc(), people.c.full_name, people.c.user_id)
+        .limit(limit)
+    )
+    return [
+        {'user_id': row.user_id, 'role': row.role, 'full_name': row.full_name}
+        for row in rows
+    ]
@@ -0,0 +1,87 @@
+"""
+Компактное представление вошедшего пользователя (current_user).
+
+Проверкам ролей и выбору расписания нужны только id, роль и id группы или
+преподавателя - их хватает, чтобы не загружать на каждый запрос User,
+UserType и Teacher/Student. Принципалы лежат в LRU-кэше процесса:
+промах - один запрос, попадание - ни одного. user_edit сбрасывает запись
+сразу; в других процессах она устаревает не дольше PRINCIPAL_CACHE_TTL секунд.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from my_university.models import User, UserType, Teacher, Student
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', '10000'))
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', '60'))
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # user_id -> (время загрузки, Principal)
+
+
+class Principal:
+    """Интерфейс пользователя Flask-Login без ORM-объекта"""
+    __slots__ = ('user_id', 'login', 'role', 'teacher_id', 'student_id', 'group_id')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, user_id, login, role, teacher_id=None, student_id=None, group_id=None):
+        self.user_id = user_id
+        self.login = login
+        self.role = role
+        self.teacher_id = teacher_id
+        self.student_id = student_id
+        self.group_id = group_id
+
+    def get_id(self):
+        return str(self.user_id)
+
+    def __repr__(self):
+        return f"<Principal {self.user_id} {self.role}>"
+
+
+def _load(session, user_id):
+    row = session.execute(
+        select(User.user_id, User.hash_login, UserType.type_name,
+               Teacher.teacher_id, Student.student_id, Student.group_id)
+        .join(UserType, UserType.user_type_id == User.user_type_id)
+        .outerjoin(Teacher, Teacher.user_id == User.user_id)
+        .outerjoin(Student, Student.user_id == User.user_id)
+        .where(User.user_id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return Principal(row.user_id, row.hash_login, row.type_name, row.teacher_id, row.student_id, row.group_id)
+
+
+def get_principal(session, user_id):
+    """Принципал пользователя из кэша или из БД; None, если пользователя нет"""
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is not None and now - entry[0] < PRINCIPAL_CACHE_TTL:
+            _cache.move_to_end(user_id)
+            return entry[1]
+
+    principal = _load(session, user_id)
+    if principal is None:
+        invalidate_principal(user_id)
+        return None
+
+    with _lock:
+        _cache[user_id] = (now, principal)
+        _cache.move_to_end(user_id)
+        while len(_cache) > PRINCIPAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return principal
+
+
+def invalidate_principal(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
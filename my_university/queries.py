@@ -0,0 +1,174 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import joinedload
+
+from my_university.models import (
+    Schedule, TimeSlot,
+    Subject, LessonType,
+    Classroom, StudyGroup,
+    Teacher, CurriculumDetail,
+    AssessmentType,
+)
+
+
+# Профили загрузки связей занятия.
+# "display" - всё, что выводится в ячейке сетки и в экспортах, одним JOIN-запросом.
+SCHEDULE_LOAD_PROFILES = {
+    'display': (
+        joinedload(Schedule.subject),
+        joinedload(Schedule.lesson_type),
+        joinedload(Schedule.classroom),
+        joinedload(Schedule.teacher),
+        joinedload(Schedule.study_group),
+        joinedload(Schedule.time_slot),
+    ),
+}
+
+
+def upsert(session, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущего подключения"""
+    if session.get_bind().dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
+
+
+def schedule_query(session, group_id=None, teacher_id=None, profile='display'):
+    """
+    Запрос занятий группы или преподавателя с заранее загруженными связями.
+    Если не задан ни group_id, ни teacher_id - возвращает пустую выборку.
+    """
+    query = session.query(Schedule).options(*SCHEDULE_LOAD_PROFILES[profile])
+
+    if group_id:
+        query = query.filter(Schedule.study_group_id == group_id)
+    elif teacher_id:
+        query = query.filter(Schedule.teacher_id == teacher_id)
+    else:
+        query = query.filter(False)
+
+    return query
+
+
+def schedule_export_rows(session, group_id=None, teacher_id=None, all_groups=False, batch_size=500):
+    """
+    Плоские строки для выгрузки: все подписи берутся JOIN-ами в SQL,
+    результат читается порциями по batch_size через серверный курсор.
+    """
+    query = session.query(
+        Schedule.day_of_week,
+        TimeSlot.time_start,
+        TimeSlot.time_end,
+        Subject.subject_name,
+        LessonType.lesson_type_name,
+        Classroom.class_name,
+        StudyGroup.group_name,
+        Teacher.full_name,
+    ) \
+        .join(TimeSlot, Schedule.time_slot_id == TimeSlot.time_slot_id) \
+        .join(Subject, Schedule.subject_id == Subject.subject_id) \
+        .join(LessonType, Schedule.lesson_type_id == LessonType.lesson_type_id) \
+        .join(Classroom, Schedule.classroom_id == Classroom.class_id) \
+        .join(StudyGroup, Schedule.study_group_id == StudyGroup.group_id) \
+        .join(Teacher, Schedule.teacher_id == Teacher.teacher_id)
+
+    if all_groups:
+        query = query.order_by(StudyGroup.group_name, Schedule.day_of_week, TimeSlot.time_start)
+    else:
+        if group_id:
+            query = query.filter(Schedule.study_group_id == group_id)
+        elif teacher_id:
+            query = query.filter(Schedule.teacher_id == teacher_id)
+        else:
+            query = query.filter(False)
+        query = query.order_by(Schedule.day_of_week, TimeSlot.time_start)
+
+    return query.yield_per(batch_size)
+
+
+def curriculum_export_rows(session, curriculum_id, batch_size=500):
+    """Строки учебного плана для выгрузки, подписи - JOIN-ами в SQL"""
+    return session.query(
+        CurriculumDetail.semester,
+        Subject.subject_name,
+        CurriculumDetail.hours_lecture,
+        AssessmentType.assessment_type_name,
+    ) \
+        .join(Subject, CurriculumDetail.subject_id == Subject.subject_id) \
+        .join(AssessmentType, CurriculumDetail.assessment_type_id == AssessmentType.assessment_type_id) \
+        .filter(CurriculumDetail.curriculum_id == curriculum_id) \
+        .order_by(CurriculumDetail.semester, CurriculumDetail.subject_id) \
+        .yield_per(batch_size)
+
+
+# Размер страницы списков пользователей и материалов
+PAGE_SIZE = 50
+
+
+def encode_cursor(values):
+    """Ключ последней строки страницы -> непрозрачная строка для URL"""
+    return base64.urlsafe_b64encode(json.dumps(list(values), ensure_ascii=False, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Обратное к encode_cursor; битый курсор -> None (первая страница)"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _cursor_fits(values, sort_columns):
+    """
+    Значения курсора подходят к колонкам сортировки по числу и типам:
+    подделанный курсор (строка вместо id и т.п.) не должен доходить до SQL.
+    Колонки без известного Python-типа не проверяются.
+    """
+    if len(values) != len(sort_columns):
+        return False
+    for value, column in zip(values, sort_columns):
+        try:
+            expected = column.type.python_type
+        except NotImplementedError:
+            continue
+        if expected is float:
+            expected = (int, float)
+        if value is None or isinstance(value, bool) or not isinstance(value, expected):
+            return False
+    return True
+
+
+def keyset_page(query, sort_columns, after=None, per_page=PAGE_SIZE, key=None):
+    """
+    Keyset-пагинация: вместо OFFSET - условие (колонки) > (ключ последней строки),
+    поэтому любая страница стоит как первая. Последняя колонка sort_columns
+    должна быть уникальной (обычно первичный ключ), иначе порядок не стабилен.
+
+    Ключ берется из атрибутов первой сущности строки по именам колонок,
+    либо функцией key(строка), если среди колонок есть вычисляемые выражения.
+    Курсор, не подходящий к колонкам по числу или типам значений,
+    отбрасывается: выдается первая страница.
+    Возвращает (строки страницы, курсор следующей страницы или None).
+    """
+    cursor = decode_cursor(after)
+    if cursor is not None and _cursor_fits(cursor, sort_columns):
+        query = query.filter(tuple_(*sort_columns) > tuple_(*cursor))
+
+    rows = query.order_by(*sort_columns).limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    if key is not None:
+        return rows, encode_cursor(key(rows[-1]))
+
+    last = rows[-1][0] if isinstance(rows[-1], Row) else rows[-1]
+    return rows, encode_cursor(getattr(last, column.key) for column in sort_columns)
@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from my_university.queries import upsert
+from my_university.models import (
+    StudyGroup, Teacher,
+    Subject, LessonType,
+    Classroom, ClassroomType,
+    TimeSlot, Department,
+    EducationMaterialType, AssessmentType,
+    Curriculum, EducationForm,
+    ReferenceVersion,
+)
+
+# Сколько секунд кэш доверяет себе, не сверяясь с таблицей версий.
+# Это верхняя граница устаревания данных в других процессах.
+CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL', '30'))
+
+
+def _load_groups(session):
+    return [(g.group_id, g.group_name) for g in
+            session.query(StudyGroup.group_id, StudyGroup.group_name).order_by(StudyGroup.group_name)]
+
+
+def _load_teachers(session):
+    return [(t.teacher_id, t.full_name) for t in
+            session.query(Teacher.teacher_id, Teacher.full_name).order_by(Teacher.full_name)]
+
+
+def _load_subjects(session):
+    return [(s.subject_id, s.subject_name) for s in
+            session.query(Subject.subject_id, Subject.subject_name).order_by(Subject.subject_name)]
+
+
+def _load_lesson_types(session):
+    return [(l.lesson_type_id, l.lesson_type_name) for l in
+            session.query(LessonType.lesson_type_id, LessonType.lesson_type_name).order_by(LessonType.lesson_type_id)]
+
+
+def _load_classrooms(session):
+    rows = session.query(Classroom.class_id, Classroom.class_name, ClassroomType.classroom_name) \
+        .join(ClassroomType, Classroom.class_type_id == ClassroomType.classroom_id) \
+        .order_by(Classroom.class_name)
+    return [(c.class_id, f"{c.class_name} ({c.classroom_name})") for c in rows]
+
+
+def _load_classroom_types(session):
+    return [(t.classroom_id, t.classroom_name) for t in
+            session.query(ClassroomType.classroom_id, ClassroomType.classroom_name).order_by(ClassroomType.classroom_id)]
+
+
+def _load_time_slots(session):
+    rows = session.query(TimeSlot.time_slot_id, TimeSlot.time_slot_name, TimeSlot.time_start) \
+        .order_by(TimeSlot.time_start)
+    return [(ts.time_slot_id, f"{ts.time_slot_name} ({ts.time_start.strftime('%H:%M')})") for ts in rows]
+
+
+def _load_departments(session):
+    return [(d.department_id, d.department_name) for d in
+            session.query(Department.department_id, Department.department_name).order_by(Department.department_name)]
+
+
+def _load_material_types(session):
+    return [(t.education_material_type_id, t.education_material_type_name) for t in
+            session.query(EducationMaterialType.education_material_type_id,
+                          EducationMaterialType.education_material_type_name)
+            .order_by(EducationMaterialType.education_material_type_id)]
+
+
+def _load_assessment_types(session):
+    return [(a.assessment_type_id, a.assessment_type_name) for a in
+            session.query(AssessmentType.assessment_type_id, AssessmentType.assessment_type_name)
+            .order_by(AssessmentType.assessment_type_id)]
+
+
+def _load_education_forms(session):
+    return [(ef.education_form_id, ef.education_form_name) for ef in
+            session.query(EducationForm.education_form_id, EducationForm.education_form_name)
+            .order_by(EducationForm.education_form_id)]
+
+
+def _load_curriculums(session):
+    rows = session.query(Curriculum.curriculum_id, Curriculum.education_level, EducationForm.education_form_name) \
+        .join(EducationForm, Curriculum.education_form_id == EducationForm.education_form_id) \
+        .order_by(Curriculum.curriculum_id)
+    return [(c.curriculum_id, f"{c.education_level} ({c.education_form_name})") for c in rows]
+
+
+LOADERS = {
+    'groups': _load_groups,
+    'teachers': _load_teachers,
+    'subjects': _load_subjects,
+    'lesson_types': _load_lesson_types,
+    'classrooms': _load_classrooms,
+    'classroom_types': _load_classroom_types,
+    'time_slots': _load_time_slots,
+    'departments': _load_departments,
+    'material_types': _load_material_types,
+    'assessment_types': _load_assessment_types,
+    'education_forms': _load_education_forms,
+    'curriculums': _load_curriculums,
+}
+
+_lock = threading.Lock()
+_entries = {}       # сущность -> (версия, список choices)
+_versions = {}      # последние версии, прочитанные из reference_version
+_checked_at = 0.0   # когда таблица версий читалась последний раз
+
+
+def _refresh_versions(session):
+    """Читает все версии одним запросом и выбрасывает устаревшие записи кэша"""
+    global _checked_at
+
+    rows = session.execute(select(ReferenceVersion.entity_name, ReferenceVersion.version)).all()
+    versions = {name: version for name, version in rows}
+
+    with _lock:
+        for entity, (version, _) in list(_entries.items()):
+            if versions.get(entity, 0) != version:
+                del _entries[entity]
+        _versions.clear()
+        _versions.update(versions)
+        _checked_at = time.monotonic()
+
+
+def get_choices(session, entity):
+    """
+    Возвращает список (id, подпись) для SelectField.
+    В установившемся режиме не делает ни одного запроса к БД.
+    """
+    with _lock:
+        entry = _entries.get(entity)
+        fresh = time.monotonic() - _checked_at < CACHE_TTL
+
+    if entry and fresh:
+        return list(entry[1])
+
+    if not fresh:
+        _refresh_versions(session)
+
+    with _lock:
+        entry = _entries.get(entity)
+        version = _versions.get(entity, 0)
+
+    if entry is None:
+        entry = (version, tuple(LOADERS[entity](session)))
+        with _lock:
+            _entries[entity] = entry
+
+    return list(entry[1])
+
+
+def invalidate_choices(session, *entities):
+    """
+    Увеличивает версию сущностей в той же транзакции, что и само изменение.
+    Локальный кэш сбрасывается после commit, остальные процессы увидят
+    новую версию не позже чем через CACHE_TTL секунд.
+    """
+    for entity in entities:
+        result = session.execute(
+            update(ReferenceVersion)
+            .where(ReferenceVersion.entity_name == entity)
+            .values(version=ReferenceVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            stmt = upsert(session, ReferenceVersion).values(entity_name=entity, version=1)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=[ReferenceVersion.entity_name],
+                set_={'version': ReferenceVersion.version + 1}
+            ))
+
+    session.info.setdefault('reference_invalidated', set()).update(entities)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_committed(session):
+    global _checked_at
+
+    entities = session.info.pop('reference_invalidated', None)
+    if entities:
+        with _lock:
+            for entity in entities:
+                _entries.pop(entity, None)
+            _checked_at = 0.0
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('reference_invalidated', None)
@@ -1,11 +1,15 @@
-import csv
-import json
-import io
-from flask import Blueprint, render_template, redirect, url_for, flash, abort, send_file, request, Response, make_response, jsonify
+from urllib.parse import quote
+
+from flask import Blueprint, render_template, redirect, url_for, flash, abort, send_file, request, Response, make_response, jsonify, \
+    stream_with_context, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager
 
 from my_university.models import (
     User, Student,
@@ -17,13 +21,27 @@ from my_university.models import (
     Curriculum, ClassroomType,
     EducationMaterial, EducationMaterialType,
     CurriculumDetail, AssessmentType,
-    EducationForm,
+    EducationForm, teacher_subject_association,
 )
 from my_university.forms import (LoginForm, RegistrationForm, ScheduleForm, DepartmentForm, StudyGroupForm,
                                  ClassroomForm, MaterialUploadForm, SubjectForm, CurriculumDetailForm, CurriculumForm,
-                                 UserEditForm)
+                                 UserEditForm, ScheduleImportForm)
 from my_university.main import db_session
-from my_university.s3_client import upload_file_to_minio, get_file_content, delete_file_from_minio
+from my_university.db_routing import read_only
+from my_university.principal import get_principal, invalidate_principal
+from my_university.queries import schedule_export_rows, curriculum_export_rows, keyset_page
+from my_university.conflicts import ScheduleConflictIndex
+from my_university.reference_cache import get_choices, invalidate_choices
+from my_university.timetable import (get_timetable, empty_timetable, refresh_timetables, refresh_timetables_for_teacher,
+                                     invalidate_timetables)
+from my_university.material_search import apply_search, refresh_search_vectors, search_materials
+from my_university.people_search import matching_user_ids, search_people
+from my_university.schedule_io import (parse_schedule_file, import_schedule, iter_schedule_csv, iter_schedule_json,
+                                       iter_curriculum_csv)
+from my_university import instrumentation, material_uploads, material_cache
+from my_university.s3_client import get_file_content, get_download_url, stat_file, delete_file_from_minio, DOWNLOAD_MODE
+from my_university.material_storage import (incoming_key, store_file, acquire as acquire_object,
+                                            release as release_object)
 
 bp = Blueprint('main', __name__)
 
@@ -31,7 +49,7 @@ bp = Blueprint('main', __name__)
 @bp.route('/')
 def index():
     if current_user.is_authenticated:
-        if current_user.user_type_ref.type_name in ['student', 'teacher']:
+        if current_user.role in ['student', 'teacher']:
             return redirect(url_for('main.schedule_view'))
 
         return render_template('index.html')
@@ -42,7 +60,7 @@ def index():
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        if current_user.user_type_ref.type_name in ['student', 'teacher']:
+        if current_user.role in ['student', 'teacher']:
             return redirect(url_for('main.schedule_view'))
         return redirect(url_for('main.index'))
 
@@ -51,7 +69,7 @@ def login():
         user = db_session.query(User).filter_by(hash_login=form.login.data).first()
 
         if user and check_password_hash(user.hash_password, form.password.data):
-            login_user(user)
+            login_user(get_principal(db_session, user.user_id))
             flash('Вы успешно вошли в систему!', 'success')
 
             next_page = request.args.get('next')
@@ -82,18 +100,15 @@ def logout():
 @bp.route('/create_user', methods=['GET', 'POST'])
 @login_required
 def create_user():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = RegistrationForm()
 
     form.submit.label.text = "Создать пользователя"
 
-    groups = db_session.query(StudyGroup).all()
-    form.group_id.choices = [(0, 'Не выбрано')] + [(g.group_id, g.group_name) for g in groups]
-
-    departments = db_session.query(Department).all()
-    form.department_id.choices = [(0, 'Не выбрано')] + [(d.department_id, d.department_name) for d in departments]
+    form.group_id.choices = [(0, 'Не выбрано')] + get_choices(db_session, 'groups')
+    form.department_id.choices = [(0, 'Не выбрано')] + get_choices(db_session, 'departments')
 
     if form.validate_on_submit():
         try:
@@ -124,6 +139,7 @@ def create_user():
                     email=f"{form.login.data}@unidesk.ru"
                 )
                 db_session.add(new_teacher)
+                invalidate_choices(db_session, 'teachers')
 
             elif form.role.data == 'admin':
                 new_admin = Admin(
@@ -147,7 +163,7 @@ def create_user():
 @bp.route('/departments')
 @login_required
 def departments_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     departments = db_session.query(Department).order_by(Department.department_name).all()
@@ -157,7 +173,7 @@ def departments_list():
 @bp.route('/departments/new', methods=['GET', 'POST'])
 @login_required
 def department_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = DepartmentForm()
@@ -165,6 +181,7 @@ def department_create():
         try:
             new_dep = Department(department_name=form.department_name.data)
             db_session.add(new_dep)
+            invalidate_choices(db_session, 'departments')
             db_session.commit()
             flash('Кафедра успешно создана!', 'success')
             return redirect(url_for('main.departments_list'))
@@ -178,7 +195,7 @@ def department_create():
 @bp.route('/departments/<int:dep_id>/edit', methods=['GET', 'POST'])
 @login_required
 def department_edit(dep_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     dep = db_session.query(Department).get(dep_id)
@@ -189,6 +206,7 @@ def department_edit(dep_id):
     if form.validate_on_submit():
         try:
             dep.department_name = form.department_name.data
+            invalidate_choices(db_session, 'departments')
             db_session.commit()
             flash('Кафедра обновлена!', 'success')
             return redirect(url_for('main.departments_list'))
@@ -202,13 +220,14 @@ def department_edit(dep_id):
 @bp.route('/departments/<int:dep_id>/delete', methods=['POST'])
 @login_required
 def department_delete(dep_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     dep = db_session.query(Department).get(dep_id)
     if dep:
         try:
             db_session.delete(dep)
+            invalidate_choices(db_session, 'departments')
             db_session.commit()
             flash('Кафедра удалена.', 'success')
         except Exception as e:
@@ -220,7 +239,7 @@ def department_delete(dep_id):
 @bp.route('/groups')
 @login_required
 def groups_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     groups = db_session.query(StudyGroup).order_by(StudyGroup.group_course, StudyGroup.group_name).all()
@@ -230,13 +249,11 @@ def groups_list():
 @bp.route('/groups/new', methods=['GET', 'POST'])
 @login_required
 def group_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = StudyGroupForm()
-    curriculums = db_session.query(Curriculum).all()
-    form.curriculum_id.choices = [(c.curriculum_id, f"{c.education_level} ({c.education_form.education_form_name})") for
-                                  c in curriculums]
+    form.curriculum_id.choices = get_choices(db_session, 'curriculums')
 
     if form.validate_on_submit():
         try:
@@ -246,6 +263,7 @@ def group_create():
                 curriculum_id=form.curriculum_id.data
             )
             db_session.add(new_group)
+            invalidate_choices(db_session, 'groups')
             db_session.commit()
             flash('Группа создана!', 'success')
             return redirect(url_for('main.groups_list'))
@@ -259,13 +277,15 @@ def group_create():
 @bp.route('/groups/<int:group_id>/delete', methods=['POST'])
 @login_required
 def group_delete(group_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     group = db_session.query(StudyGroup).get(group_id)
     if group:
         try:
             db_session.delete(group)
+            invalidate_choices(db_session, 'groups')
+            refresh_timetables(db_session, group_ids=[group_id])
             db_session.commit()
             flash('Группа удалена.', 'success')
         except Exception:
@@ -278,7 +298,7 @@ def group_delete(group_id):
 @bp.route('/classrooms')
 @login_required
 def classrooms_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     classrooms = db_session.query(Classroom).order_by(Classroom.class_name).all()
@@ -288,13 +308,12 @@ def classrooms_list():
 @bp.route('/classrooms/new', methods=['GET', 'POST'])
 @login_required
 def classroom_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = ClassroomForm()
 
-    types = db_session.query(ClassroomType).all()
-    form.class_type_id.choices = [(t.classroom_id, t.classroom_name) for t in types]
+    form.class_type_id.choices = get_choices(db_session, 'classroom_types')
 
     if form.validate_on_submit():
         try:
@@ -303,6 +322,7 @@ def classroom_create():
                 class_type_id=form.class_type_id.data
             )
             db_session.add(new_classroom)
+            invalidate_choices(db_session, 'classrooms')
             db_session.commit()
             flash(f'Аудитория {new_classroom.class_name} создана!', 'success')
             return redirect(url_for('main.classrooms_list'))
@@ -316,13 +336,14 @@ def classroom_create():
 @bp.route('/classrooms/<int:cls_id>/delete', methods=['POST'])
 @login_required
 def classroom_delete(cls_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     classroom = db_session.query(Classroom).get(cls_id)
     if classroom:
         try:
             db_session.delete(classroom)
+            invalidate_choices(db_session, 'classrooms')
             db_session.commit()
             flash('Аудитория удалена.', 'success')
         except Exception:
@@ -332,10 +353,29 @@ def classroom_delete(cls_id):
     return redirect(url_for('main.classrooms_list'))
 
 
+def _page_url(endpoint, cursor):
+    """Ссылка на страницу списка с теми же фильтрами; cursor=None - первая страница"""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    if cursor is not None:
+        args['after'] = cursor
+    return url_for(endpoint, **args)
+
+
 @bp.route('/materials')
+@read_only
 @login_required
 def materials_list():
-    query = db_session.query(EducationMaterial).join(Teacher).join(Department)
+    query = db_session.query(EducationMaterial) \
+        .join(EducationMaterial.teacher) \
+        .join(Teacher.department) \
+        .join(EducationMaterial.subject) \
+        .join(EducationMaterial.education_material_type) \
+        .options(
+            contains_eager(EducationMaterial.teacher).contains_eager(Teacher.department),
+            contains_eager(EducationMaterial.subject),
+            contains_eager(EducationMaterial.education_material_type),
+        )
 
     search_text = request.args.get('search', '').strip()
     dept_id = request.args.get('department_id', type=int)
@@ -343,8 +383,9 @@ def materials_list():
 
     show_mine = request.args.get('mine')
 
+    rank = None
     if search_text:
-        query = query.filter(EducationMaterial.education_material_name.ilike(f'%{search_text}%'))
+        query, rank = apply_search(db_session, query, search_text)
 
     if dept_id:
         query = query.filter(Teacher.department_id == dept_id)
@@ -352,20 +393,30 @@ def materials_list():
     if teacher_id:
         query = query.filter(EducationMaterial.teacher_id == teacher_id)
 
-    if current_user.user_type_ref.type_name == 'teacher':
+    if current_user.role == 'teacher':
         if show_mine:
-            query = query.filter(EducationMaterial.teacher_id == current_user.teacher.teacher_id)
-
-    materials = query.order_by(EducationMaterial.education_material_name).all()
-
-    all_departments = db_session.query(Department).order_by(Department.department_name).all()
-    all_teachers = db_session.query(Teacher).order_by(Teacher.full_name).all()
+            query = query.filter(EducationMaterial.teacher_id == current_user.teacher_id)
+
+    after = request.args.get('after')
+    if rank is not None:
+        # Сначала самые релевантные: ключ (-ранг, id)
+        rows, next_cursor = keyset_page(
+            query.add_columns(rank.label('rank')), [-rank, EducationMaterial.education_material_id], after,
+            key=lambda row: (-row.rank, row[0].education_material_id)
+        )
+        materials = [row[0] for row in rows]
+    else:
+        materials, next_cursor = keyset_page(
+            query, [EducationMaterial.education_material_name, EducationMaterial.education_material_id], after
+        )
 
     return render_template(
         'materials_list.html',
         materials=materials,
-        all_departments=all_departments,
-        all_teachers=all_teachers,
+        all_departments=get_choices(db_session, 'departments'),
+        all_teachers=get_choices(db_session, 'teachers'),
+        next_url=_page_url('main.materials_list', next_cursor) if next_cursor else None,
+        first_url=_page_url('main.materials_list', None) if after else None,
         selected_search=search_text,
         selected_dept=dept_id,
         selected_teacher=teacher_id,
@@ -373,50 +424,112 @@ def materials_list():
     )
 
 
+@bp.route('/api/materials/search')
+@read_only
+@login_required
+def api_materials_search():
+    search_text = request.args.get('q', '').strip()
+    if len(search_text) < 2:
+        return jsonify([])
+
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify(search_materials(db_session, search_text, limit=limit))
+
+
 @bp.route('/materials/upload', methods=['GET', 'POST'])
 @login_required
 def material_upload():
-    if current_user.user_type_ref.type_name != 'teacher':
+    if current_user.role != 'teacher':
         abort(403)
 
     form = MaterialUploadForm()
-    form.subject_id.choices = [(s.subject_id, s.subject_name) for s in db_session.query(Subject).all()]
-    form.type_id.choices = [(t.education_material_type_id, t.education_material_type_name) for t in
-                            db_session.query(EducationMaterialType).all()]
+    form.subject_id.choices = get_choices(db_session, 'subjects')
+    form.type_id.choices = get_choices(db_session, 'material_types')
 
     if form.validate_on_submit():
-        if form.file.data:
-            file = form.file.data
-            filename = secure_filename(file.filename)
-            teacher_id = current_user.teacher.teacher_id
-            object_name = f"teacher_{teacher_id}/{filename}"
-            upload_file_to_minio(file.stream, object_name, file.content_type)
-            final_link = object_name
+        file = form.file.data
+        file_name = None
+        direct_upload = False
+        upload_in_background = False
+        if form.upload_token.data:
+            try:
+                final_link = material_uploads.finish_direct_upload(
+                    current_app.config['SECRET_KEY'], form.upload_token.data, current_user.teacher_id
+                )
+            except ValueError as e:
+                flash(f'Ошибка: {e}', 'danger')
+                return render_template('material_upload.html', form=form,
+                                       direct_upload=material_uploads.DIRECT_UPLOAD)
+            file_name = final_link.split('/')[-1]
+            direct_upload = True
+
+        elif file:
+            file_name = secure_filename(file.filename)
+            # Ключ по содержимому станет известен после хэширования, до тех пор - заглушка
+            final_link = incoming_key(file_name)
+            upload_in_background = material_uploads.UPLOAD_ASYNC
 
         elif form.link_url.data:
             final_link = form.link_url.data
 
         else:
             flash('Необходимо либо загрузить файл, либо указать ссылку!', 'warning')
-            return render_template('material_upload.html', form=form)
+            return render_template('material_upload.html', form=form, direct_upload=material_uploads.DIRECT_UPLOAD)
 
         try:
+            if direct_upload:
+                acquire_object(db_session, final_link)
+            elif file and not upload_in_background:
+                final_link, _, _ = store_file(db_session, file.stream, file.content_type)
+
             new_material = EducationMaterial(
                 education_material_type_id=form.type_id.data,
                 subject_id=form.subject_id.data,
-                teacher_id=current_user.teacher.teacher_id,
+                teacher_id=current_user.teacher_id,
                 education_material_name=form.material_name.data,
-                education_material_link=final_link
+                education_material_link=final_link,
+                file_name=file_name,
+                upload_status=material_uploads.STATUS_PENDING if upload_in_background else material_uploads.STATUS_READY
             )
             db_session.add(new_material)
+            db_session.flush()
+            refresh_search_vectors(db_session, material_ids=[new_material.education_material_id])
             db_session.commit()
-            flash('Материал сохранен!', 'success')
+
+            if upload_in_background:
+                # Строка уже в БД: задача может сразу выставить ей ready/failed
+                material_uploads.submit_upload(db_session.session_factory, new_material.education_material_id,
+                                               material_uploads.detach_stream(file), file.content_type)
+                flash('Материал сохранен, файл загружается в хранилище.', 'success')
+            else:
+                if direct_upload:
+                    material_uploads.submit_adopt(db_session.session_factory, new_material.education_material_id,
+                                                  final_link)
+                flash('Материал сохранен!', 'success')
             return redirect(url_for('main.materials_list'))
         except Exception as e:
             db_session.rollback()
             flash(f'Ошибка: {e}', 'danger')
 
-    return render_template('material_upload.html', form=form)
+    return render_template('material_upload.html', form=form, direct_upload=material_uploads.DIRECT_UPLOAD)
+
+
+@bp.route('/api/materials/upload_url', methods=['POST'])
+@login_required
+def api_material_upload_url():
+    if current_user.role != 'teacher' or not material_uploads.DIRECT_UPLOAD:
+        abort(403)
+
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename:
+        return jsonify({'error': 'Не указано имя файла'}), 400
+
+    content_type = data.get('content_type') or 'application/octet-stream'
+    object_name = incoming_key(filename)
+    return jsonify(material_uploads.start_direct_upload(
+        current_app.config['SECRET_KEY'], current_user.teacher_id, object_name, content_type
+    ))
 
 
 @bp.route('/materials/download/<int:material_id>')
@@ -431,20 +544,112 @@ def material_download(material_id):
     if link.startswith('http://') or link.startswith('https://'):
         return redirect(link)
 
-    file_stream = get_file_content(link)
+    if material.upload_status != material_uploads.STATUS_READY:
+        if material.upload_status == material_uploads.STATUS_PENDING:
+            flash('Файл еще загружается в хранилище, попробуйте позже.', 'info')
+        else:
+            flash('Ошибка: файл не удалось загрузить в хранилище', 'danger')
+        return redirect(url_for('main.materials_list'))
+
+    original_filename = material.file_name or link.split('/')[-1]
+
+    if DOWNLOAD_MODE == 'redirect':
+        # Файл отдает сам MinIO: воркер приложения занят только подписью ссылки
+        return redirect(get_download_url(link, download_name=original_filename))
+
+    return _proxy_material(link, original_filename)
+
+
+# Размер куска при проксировании файла из MinIO
+PROXY_CHUNK_SIZE = 256 * 1024
+
+
+def _if_range_matches(etag, last_modified):
+    """If-Range: диапазон отдается, только если файл не менялся с тех пор"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return last_modified is not None and last_modified.replace(microsecond=0) <= if_range.date
+    return True
 
+
+def _proxy_material(object_name, download_name):
+    """
+    Отдает файл из MinIO через приложение с поддержкой Range и условных GET.
+    ETag и Last-Modified берутся из stat объекта; при совпадении с
+    If-None-Match/If-Modified-Since файл из MinIO не читается вовсе (304),
+    а при Range читается только нужный диапазон. Если включен дисковый
+    кэш (material_cache), файл отдается из него; при промахе по Range
+    кэш заполняется в фоне.
+    """
+    stat = material_cache.cached_stat(object_name) or stat_file(object_name)
+    if stat is None:
+        flash('Ошибка: Файл не найден в хранилище', 'danger')
+        return redirect(url_for('main.materials_list'))
+
+    etag = stat.etag.strip('"')
+    response = Response(mimetype=stat.content_type or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = stat.last_modified
+    response.accept_ranges = 'bytes'
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # хранить можно, но с проверкой по ETag
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=stat.last_modified):
+        response.status_code = 304
+        return response
+
+    # Промах по Range не ждет загрузки всего файла в кэш: диапазон идет из MinIO
+    cached = material_cache.get_cached_file(object_name, stat, background=request.range is not None)
+    if cached is not None:
+        try:
+            # Путь, а не поток: сервер отдаст файл через sendfile; Range и 304 - внутри send_file
+            response = send_file(cached.path, mimetype=response.mimetype, as_attachment=True,
+                                 download_name=download_name, conditional=True, etag=etag,
+                                 last_modified=stat.last_modified, max_age=None)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        except FileNotFoundError:
+            pass  # файл вытеснил другой процесс - читаем из MinIO
+
+    start, stop = 0, stat.size
+    if request.range is not None and _if_range_matches(etag, stat.last_modified):
+        bounds = request.range.range_for_length(stat.size)
+        if bounds is None:
+            response.status_code = 416
+            response.content_range = ContentRange(None, None, stat.size)
+            return response
+        start, stop = bounds
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop, stat.size)
+
+    if stop == start:
+        response.content_length = 0
+        return response
+
+    file_stream = get_file_content(object_name, offset=start, length=stop - start)
     if file_stream is None:
         flash('Ошибка: Файл не найден в хранилище', 'danger')
         return redirect(url_for('main.materials_list'))
 
-    original_filename = link.split('/')[-1]
+    response.response = file_stream.stream(PROXY_CHUNK_SIZE)
+    response.content_length = stop - start
+    # Соединение с MinIO возвращается в пул только после того, как ответ дочитан
+    response.call_on_close(file_stream.close)
+    response.call_on_close(file_stream.release_conn)
+    return response
 
-    return send_file(
-        file_stream,
-        as_attachment=True,
-        download_name=original_filename,
-        mimetype=file_stream.headers.get('content-type')
-    )
+
+@bp.route('/api/materials/<int:material_id>/upload_status')
+@login_required
+def api_material_upload_status(material_id):
+    status = material_uploads.upload_status(db_session, material_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
 
 
 @bp.route('/materials/<int:material_id>/delete', methods=['POST'])
@@ -454,11 +659,11 @@ def material_delete(material_id):
     if not material:
         abort(404)
 
-    is_admin = current_user.user_type_ref.type_name == 'admin'
+    is_admin = current_user.role == 'admin'
     is_owner = False
 
-    if current_user.user_type_ref.type_name == 'teacher':
-        if material.teacher_id == current_user.teacher.teacher_id:
+    if current_user.role == 'teacher':
+        if material.teacher_id == current_user.teacher_id:
             is_owner = True
 
     if not is_admin and not is_owner:
@@ -466,7 +671,8 @@ def material_delete(material_id):
 
     try:
         link = material.education_material_link
-        if not (link.startswith('http://') or link.startswith('https://')):
+        # Тот же файл может быть у других материалов: удаляется только последняя ссылка
+        if not (link.startswith('http://') or link.startswith('https://')) and release_object(db_session, link):
             delete_file_from_minio(link)
 
         db_session.delete(material)
@@ -484,7 +690,7 @@ def material_delete(material_id):
 @bp.route('/subjects')
 @login_required
 def subjects_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     subjects = db_session.query(Subject).order_by(Subject.subject_name).all()
@@ -494,7 +700,7 @@ def subjects_list():
 @bp.route('/subjects/new', methods=['GET', 'POST'])
 @login_required
 def subject_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = SubjectForm()
@@ -505,6 +711,7 @@ def subject_create():
                 subject_name=form.subject_name.data
             )
             db_session.add(new_subject)
+            invalidate_choices(db_session, 'subjects')
             db_session.commit()
             flash(f'Предмет "{new_subject.subject_name}" создан!', 'success')
             return redirect(url_for('main.subjects_list'))
@@ -518,13 +725,14 @@ def subject_create():
 @bp.route('/subjects/<int:sub_id>/delete', methods=['POST'])
 @login_required
 def subject_delete(sub_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     subject = db_session.query(Subject).get(sub_id)
     if subject:
         try:
             db_session.delete(subject)
+            invalidate_choices(db_session, 'subjects')
             db_session.commit()
             flash('Предмет удален.', 'success')
         except Exception:
@@ -537,7 +745,7 @@ def subject_delete(sub_id):
 @bp.route('/curriculums')
 @login_required
 def curriculums_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     curriculums = db_session.query(Curriculum).order_by(Curriculum.approval_year.desc()).all()
@@ -547,12 +755,11 @@ def curriculums_list():
 @bp.route('/curriculums/new', methods=['GET', 'POST'])
 @login_required
 def curriculum_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = CurriculumForm()
-    edu_forms = db_session.query(EducationForm).all()
-    form.education_form_id.choices = [(ef.education_form_id, ef.education_form_name) for ef in edu_forms]
+    form.education_form_id.choices = get_choices(db_session, 'education_forms')
 
     if form.validate_on_submit():
         try:
@@ -562,6 +769,7 @@ def curriculum_create():
                 approval_year=form.approval_year.data
             )
             db_session.add(new_curr)
+            invalidate_choices(db_session, 'curriculums')
             db_session.commit()
             flash('Учебный план создан! Теперь наполните его предметами.', 'success')
             return redirect(url_for('main.curriculum_view', curr_id=new_curr.curriculum_id))
@@ -573,10 +781,11 @@ def curriculum_create():
 
 
 @bp.route('/curriculums/<int:curr_id>', methods=['GET', 'POST'])
+@read_only
 @login_required
 def curriculum_view(curr_id):
     """Страница просмотра и наполнения конкретного плана"""
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     curriculum = db_session.query(Curriculum).get(curr_id)
@@ -585,10 +794,8 @@ def curriculum_view(curr_id):
 
     form = CurriculumDetailForm()
 
-    form.subject_id.choices = [(s.subject_id, s.subject_name) for s in
-                               db_session.query(Subject).order_by(Subject.subject_name).all()]
-    form.assessment_type_id.choices = [(a.assessment_type_id, a.assessment_type_name) for a in
-                                       db_session.query(AssessmentType).all()]
+    form.subject_id.choices = get_choices(db_session, 'subjects')
+    form.assessment_type_id.choices = get_choices(db_session, 'assessment_types')
 
     if form.validate_on_submit():
         try:
@@ -629,69 +836,84 @@ def curriculum_detail_delete(detail_id):
     return redirect(url_for('main.curriculums_list'))
 
 
-def transform_schedule_to_grid(schedule_items, time_slots):
+def flash_schedule_conflicts(form, exclude_id=None):
     """
-    Превращает список записей из БД в словарь:
-    grid[день_недели][id_таймслота] = Занятие
+    Проверяет занятость преподавателя, аудитории и группы одним запросом
+    к ячейке (день, пара) и выводит сообщение о каждом найденном конфликте.
+    Возвращает True, если конфликты есть.
     """
-    grid = {day: {} for day in range(1, 7)}
+    index = ScheduleConflictIndex.load(
+        db_session,
+        day_of_week=form.day_of_week.data,
+        time_slot_id=form.time_slot_id.data,
+        group_id=form.study_group_id.data,
+        teacher_id=form.teacher_id.data,
+        classroom_id=form.classroom_id.data
+    )
+    conflicts = index.find_conflicts(
+        group_id=form.study_group_id.data,
+        teacher_id=form.teacher_id.data,
+        classroom_id=form.classroom_id.data,
+        day_of_week=form.day_of_week.data,
+        time_slot_id=form.time_slot_id.data,
+        exclude_id=exclude_id
+    )
 
-    for item in schedule_items:
-        grid[item.day_of_week][item.time_slot_id] = item
+    for conflict in conflicts:
+        other = db_session.get(Schedule, conflict.schedule_id)
+        if conflict.kind == 'teacher':
+            flash(f'Ошибка: Преподаватель уже ведет пару в это время в другой аудитории ({other.classroom.class_name})!',
+                  'danger')
+        elif conflict.kind == 'classroom':
+            flash(f'Ошибка: Аудитория занята другим преподавателем ({other.teacher.full_name})!', 'danger')
+        else:
+            flash('Ошибка: У этой ГРУППЫ уже стоит занятие в это время!', 'danger')
 
-    return grid
+    return bool(conflicts)
 
 
 @bp.route('/schedule')
+@read_only
 @login_required
 def schedule_view():
     target_group_id = None
     target_teacher_id = None
 
-    role_name = current_user.user_type_ref.type_name
+    role_name = current_user.role
 
-    all_groups = db_session.query(StudyGroup).order_by(StudyGroup.group_name).all()
-    all_teachers = db_session.query(Teacher).order_by(Teacher.full_name).all()
+    all_groups = []
+    all_teachers = []
 
     if role_name == 'admin':
+        all_groups = get_choices(db_session, 'groups')
+        all_teachers = get_choices(db_session, 'teachers')
+
         if request.args.get('group_id'):
             target_group_id = int(request.args.get('group_id'))
         elif request.args.get('teacher_id'):
             target_teacher_id = int(request.args.get('teacher_id'))
 
     elif role_name == 'student':
-        if current_user.student:
-            target_group_id = current_user.student.group_id
+        target_group_id = current_user.group_id
 
     elif role_name == 'teacher':
-        if current_user.teacher:
-            target_teacher_id = current_user.teacher.teacher_id
-
-    query = db_session.query(Schedule)
-    title = "Расписание"
+        target_teacher_id = current_user.teacher_id
 
+    timetable = None
     if target_group_id:
-        query = query.filter_by(study_group_id=target_group_id)
-        grp = db_session.query(StudyGroup).get(target_group_id)
-        if grp: title = f"Расписание группы {grp.group_name}"
-
+        timetable = get_timetable(db_session, 'group', target_group_id)
     elif target_teacher_id:
-        query = query.filter_by(teacher_id=target_teacher_id)
-        tch = db_session.query(Teacher).get(target_teacher_id)
-        if tch: title = f"Расписание преподавателя {tch.full_name}"
-    else:
-        query = query.filter(False)
+        timetable = get_timetable(db_session, 'teacher', target_teacher_id)
 
-    schedule_items = query.all()
-    time_slots = db_session.query(TimeSlot).order_by(TimeSlot.time_start).all()
-    grid = transform_schedule_to_grid(schedule_items, time_slots)
+    if timetable is None:
+        timetable = empty_timetable(db_session)
 
     return render_template(
         'schedule_view.html',
-        grid=grid,
-        time_slots=time_slots,
+        grid=timetable['grid'],
+        time_slots=timetable['time_slots'],
         days={1: 'ПН', 2: 'ВТ', 3: 'СР', 4: 'ЧТ', 5: 'ПТ', 6: 'СБ'},
-        title=title,
+        title=timetable['title'],
         all_groups=all_groups,
         all_teachers=all_teachers,
         target_group_id=target_group_id,
@@ -702,13 +924,14 @@ def schedule_view():
 @bp.route('/schedule/<int:sched_id>/delete', methods=['POST'])
 @login_required
 def schedule_delete(sched_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     item = db_session.query(Schedule).get(sched_id)
     if item:
         grp_id = item.study_group_id
         db_session.delete(item)
+        refresh_timetables(db_session, group_ids=[grp_id], teacher_ids=[item.teacher_id])
         db_session.commit()
         flash('Занятие отменено.', 'success')
         return redirect(url_for('main.schedule_view', group_id=grp_id))
@@ -719,7 +942,7 @@ def schedule_delete(sched_id):
 @bp.route('/schedule/<int:sched_id>/edit', methods=['GET', 'POST'])
 @login_required
 def schedule_edit(sched_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     schedule_item = db_session.query(Schedule).get(sched_id)
@@ -728,45 +951,27 @@ def schedule_edit(sched_id):
 
     form = ScheduleForm(obj=schedule_item)
 
-    form.study_group_id.choices = [(g.group_id, g.group_name) for g in
-                                   db_session.query(StudyGroup).order_by(StudyGroup.group_name).all()]
-    form.teacher_id.choices = [(t.teacher_id, t.full_name) for t in
-                               db_session.query(Teacher).order_by(Teacher.full_name).all()]
-    form.subject_id.choices = [(s.subject_id, s.subject_name) for s in
-                               db_session.query(Subject).order_by(Subject.subject_name).all()]
-    form.lesson_type_id.choices = [(l.lesson_type_id, l.lesson_type_name) for l in db_session.query(LessonType).all()]
-    form.classroom_id.choices = [(c.class_id, f"{c.class_name} ({c.classroom_type.classroom_name})") for c in
-                                 db_session.query(Classroom).order_by(Classroom.class_name).all()]
-    form.time_slot_id.choices = [(ts.time_slot_id, f"{ts.time_slot_name} ({ts.time_start.strftime('%H:%M')})") for ts in
-                                 db_session.query(TimeSlot).order_by(TimeSlot.time_start).all()]
+    form.study_group_id.choices = get_choices(db_session, 'groups')
+    form.teacher_id.choices = get_choices(db_session, 'teachers')
+    form.subject_id.choices = get_choices(db_session, 'subjects')
+    form.lesson_type_id.choices = get_choices(db_session, 'lesson_types')
+    form.classroom_id.choices = get_choices(db_session, 'classrooms')
+    form.time_slot_id.choices = get_choices(db_session, 'time_slots')
 
     if form.validate_on_submit():
         try:
-            teacher_conflict = db_session.query(Schedule).filter(
-                Schedule.teacher_id == form.teacher_id.data,
-                Schedule.day_of_week == form.day_of_week.data,
-                Schedule.time_slot_id == form.time_slot_id.data,
-                Schedule.classroom_id != form.classroom_id.data,
-                Schedule.schedule_id != sched_id
-            ).first()
-
-            if teacher_conflict:
-                flash(f'Преподаватель занят в ауд. {teacher_conflict.classroom.class_name}', 'danger')
+            if flash_schedule_conflicts(form, exclude_id=sched_id):
                 return render_template('schedule_form.html', form=form, title="Редактирование")
 
-            room_conflict = db_session.query(Schedule).filter(
-                Schedule.classroom_id == form.classroom_id.data,
-                Schedule.day_of_week == form.day_of_week.data,
-                Schedule.time_slot_id == form.time_slot_id.data,
-                Schedule.teacher_id != form.teacher_id.data,
-                Schedule.schedule_id != sched_id  # <--- ВАЖНО
-            ).first()
-
-            if room_conflict:
-                flash(f'Аудитория занята преподавателем {room_conflict.teacher.full_name}', 'danger')
-                return render_template('schedule_form.html', form=form, title="Редактирование")
+            old_group_id = schedule_item.study_group_id
+            old_teacher_id = schedule_item.teacher_id
 
             form.populate_obj(schedule_item)
+            refresh_timetables(
+                db_session,
+                group_ids=[old_group_id, schedule_item.study_group_id],
+                teacher_ids=[old_teacher_id, schedule_item.teacher_id]
+            )
 
             db_session.commit()
             flash('Занятие успешно изменено!', 'success')
@@ -790,24 +995,17 @@ def schedule_edit(sched_id):
 @bp.route('/schedule/new', methods=['GET', 'POST'])
 @login_required
 def schedule_create():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     form = ScheduleForm()
 
-    form.study_group_id.choices = [(g.group_id, g.group_name) for g in
-                                   db_session.query(StudyGroup).order_by(StudyGroup.group_name).all()]
-    form.teacher_id.choices = [(t.teacher_id, t.full_name) for t in
-                               db_session.query(Teacher).order_by(Teacher.full_name).all()]
-    form.subject_id.choices = [(s.subject_id, s.subject_name) for s in
-                               db_session.query(Subject).order_by(Subject.subject_name).all()]
-    form.lesson_type_id.choices = [(l.lesson_type_id, l.lesson_type_name) for l in db_session.query(LessonType).all()]
-
-    form.classroom_id.choices = [(c.class_id, f"{c.class_name} ({c.classroom_type.classroom_name})") for c in
-                                 db_session.query(Classroom).order_by(Classroom.class_name).all()]
-
-    form.time_slot_id.choices = [(ts.time_slot_id, f"{ts.time_slot_name} ({ts.time_start.strftime('%H:%M')})") for ts in
-                                 db_session.query(TimeSlot).order_by(TimeSlot.time_start).all()]
+    form.study_group_id.choices = get_choices(db_session, 'groups')
+    form.teacher_id.choices = get_choices(db_session, 'teachers')
+    form.subject_id.choices = get_choices(db_session, 'subjects')
+    form.lesson_type_id.choices = get_choices(db_session, 'lesson_types')
+    form.classroom_id.choices = get_choices(db_session, 'classrooms')
+    form.time_slot_id.choices = get_choices(db_session, 'time_slots')
 
     if request.method == 'GET':
         req_group = request.args.get('group_id', type=int)
@@ -823,28 +1021,7 @@ def schedule_create():
 
     if form.validate_on_submit():
         try:
-            teacher_conflict = db_session.query(Schedule).filter(
-                Schedule.teacher_id == form.teacher_id.data,
-                Schedule.day_of_week == form.day_of_week.data,
-                Schedule.time_slot_id == form.time_slot_id.data,
-                Schedule.classroom_id != form.classroom_id.data,
-            ).first()
-
-            if teacher_conflict:
-                flash(
-                    f'Ошибка: Преподаватель уже ведет пару в это время в другой аудитории ({teacher_conflict.classroom.class_name})!',
-                    'danger')
-                return render_template('schedule_form.html', form=form, title="Добавить занятие")
-
-            room_conflict = db_session.query(Schedule).filter(
-                Schedule.classroom_id == form.classroom_id.data,
-                Schedule.day_of_week == form.day_of_week.data,
-                Schedule.time_slot_id == form.time_slot_id.data,
-                Schedule.teacher_id != form.teacher_id.data
-            ).first()
-
-            if room_conflict:
-                flash(f'Ошибка: Аудитория занята другим преподавателем ({room_conflict.teacher.full_name})!', 'danger')
+            if flash_schedule_conflicts(form):
                 return render_template('schedule_form.html', form=form, title="Добавить занятие")
 
             new_schedule = Schedule(
@@ -857,6 +1034,8 @@ def schedule_create():
                 time_slot_id=form.time_slot_id.data
             )
             db_session.add(new_schedule)
+            refresh_timetables(db_session, group_ids=[new_schedule.study_group_id],
+                               teacher_ids=[new_schedule.teacher_id])
             db_session.commit()
 
             flash('Занятие добавлено в расписание!', 'success')
@@ -874,143 +1053,137 @@ def schedule_create():
     return render_template('schedule_form.html', form=form, title="Добавить занятие")
 
 
-@bp.route('/schedule/export/csv')
+@bp.route('/schedule/import', methods=['GET', 'POST'])
 @login_required
-def schedule_export_csv():
+def schedule_import():
+    if current_user.role != 'admin':
+        abort(403)
+
+    form = ScheduleImportForm()
+    result = None
+
+    if form.validate_on_submit():
+        file = form.file.data
+        try:
+            rows = parse_schedule_file(file.filename, file.read())
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'Не удалось разобрать файл: {e}', 'danger')
+            return render_template('schedule_import.html', form=form, result=None)
+
+        try:
+            result = import_schedule(db_session, rows, skip_invalid=form.skip_invalid.data)
+            invalidate_timetables(db_session, group_ids=result.group_ids, teacher_ids=result.teacher_ids)
+            db_session.commit()
+        except IntegrityError:
+            db_session.rollback()
+            flash('Ошибка: расписание изменилось во время импорта, повторите загрузку.', 'danger')
+            return render_template('schedule_import.html', form=form, result=None)
+
+        if result.inserted:
+            flash(f'Импортировано занятий: {result.inserted} из {result.total}.', 'success')
+        if result.errors:
+            flash(f'Строк с ошибками: {len(result.errors)}.', 'warning' if result.inserted else 'danger')
+
+    return render_template('schedule_import.html', form=form, result=result)
+
+
+def _lazy_rows(build, *args, **kwargs):
+    """
+    Запрос выгрузки выполняется только при отдаче ответа. stream_with_context
+    держит контекст запроса, пока генератор не исчерпан, поэтому строки читаются
+    той же scoped-сессией запроса, а shutdown_session закрывает ее уже после выгрузки.
+    """
+    yield from build(db_session, *args, **kwargs)
+
+
+def _schedule_export_request():
+    """
+    Разбирает параметры выгрузки расписания.
+    Возвращает (имя файла, строки) или (None, None), если не выбрано, что выгружать.
+    """
     group_id = request.args.get('group_id', type=int)
     teacher_id = request.args.get('teacher_id', type=int)
 
-    if not group_id and not teacher_id:
-        flash('Выберите группу или преподавателя для экспорта!', 'warning')
-        return redirect(url_for('main.schedule_view'))
+    if request.args.get('all', type=int):
+        if current_user.role != 'admin':
+            abort(403)
+        return "schedule_all", _lazy_rows(schedule_export_rows, all_groups=True)
 
-    query = db_session.query(Schedule).join(TimeSlot).join(Subject).join(Classroom).join(LessonType)
+    if not group_id and not teacher_id:
+        return None, None
 
     filename = "schedule"
     if group_id:
-        query = query.filter(Schedule.study_group_id == group_id)
         filename = f"schedule_group_{group_id}"
     elif teacher_id:
-        query = query.filter(Schedule.teacher_id == teacher_id)
         filename = f"schedule_teacher_{teacher_id}"
 
-    items = query.order_by(Schedule.day_of_week, TimeSlot.time_start).all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    writer.writerow(['Day', 'Time', 'Subject', 'Type', 'Room', 'Group', 'Teacher'])
+    return filename, _lazy_rows(schedule_export_rows, group_id=group_id, teacher_id=teacher_id)
 
-    days_map = {1: 'ПН', 2: 'ВТ', 3: 'СР', 4: 'ЧТ', 5: 'ПТ', 6: 'СБ'}
 
-    for item in items:
-        writer.writerow([
-            days_map.get(item.day_of_week, str(item.day_of_week)),
-            f"{item.time_slot.time_start.strftime('%H:%M')} - {item.time_slot.time_end.strftime('%H:%M')}",
-            item.subject.subject_name,
-            item.lesson_type.lesson_type_name,
-            item.classroom.class_name,
-            item.study_group.group_name,
-            item.teacher.full_name
-        ])
+@bp.route('/schedule/export/csv')
+@read_only
+@login_required
+def schedule_export_csv():
+    filename, rows = _schedule_export_request()
+    if rows is None:
+        flash('Выберите группу или преподавателя для экспорта!', 'warning')
+        return redirect(url_for('main.schedule_view'))
 
-    output.seek(0)
     return Response(
-        output,
+        stream_with_context(iter_schedule_csv(rows)),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename={filename}.csv"}
     )
 
 
 @bp.route('/schedule/export/json')
+@read_only
 @login_required
 def schedule_export_json():
-    group_id = request.args.get('group_id', type=int)
-    teacher_id = request.args.get('teacher_id', type=int)
-
-    if not group_id and not teacher_id:
+    filename, rows = _schedule_export_request()
+    if rows is None:
         flash('Выберите группу или преподавателя!', 'warning')
         return redirect(url_for('main.schedule_view'))
 
-    query = db_session.query(Schedule).join(TimeSlot).join(Subject)
-
-    filename = "schedule"
-    if group_id:
-        query = query.filter(Schedule.study_group_id == group_id)
-        filename = f"schedule_group_{group_id}"
-    elif teacher_id:
-        query = query.filter(Schedule.teacher_id == teacher_id)
-        filename = f"schedule_teacher_{teacher_id}"
-
-    items = query.order_by(Schedule.day_of_week, TimeSlot.time_start).all()
-
-    data = []
-    days_map = {1: 'Понедельник', 2: 'Вторник', 3: 'Среда', 4: 'Четверг', 5: 'Пятница', 6: 'Суббота'}
-
-    for item in items:
-        data.append({
-            'day_of_week': days_map.get(item.day_of_week),
-            'time_start': item.time_slot.time_start.strftime('%H:%M'),
-            'time_end': item.time_slot.time_end.strftime('%H:%M'),
-            'subject': item.subject.subject_name,
-            'type': item.lesson_type.lesson_type_name,
-            'classroom': item.classroom.class_name,
-            'group': item.study_group.group_name,
-            'teacher': item.teacher.full_name
-        })
-
-    response = make_response(json.dumps(data, ensure_ascii=False, indent=4))
-    response.headers["Content-Disposition"] = f"attachment; filename={filename}.json"
-    response.headers["Content-Type"] = "application/json; charset=utf-8"
-    return response
+    return Response(
+        stream_with_context(iter_schedule_json(rows)),
+        content_type="application/json; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}.json"}
+    )
 
 
 @bp.route('/curriculums/<int:curr_id>/export/csv')
+@read_only
 @login_required
 def curriculum_export_csv(curr_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     curriculum = db_session.query(Curriculum).get(curr_id)
     if not curriculum:
         abort(404)
 
-    details = db_session.query(CurriculumDetail) \
-        .filter_by(curriculum_id=curr_id) \
-        .order_by(CurriculumDetail.semester, CurriculumDetail.subject_id).all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    writer.writerow(['Учебный план:', curriculum.education_level])
-    writer.writerow(['Форма обучения:', curriculum.education_form.education_form_name])
-    writer.writerow(['Год утверждения:', curriculum.approval_year])
-    writer.writerow([])  # Пустая строка
-
-    writer.writerow(['Семестр', 'Предмет', 'Часы', 'Тип аттестации'])
-
-    for det in details:
-        writer.writerow([
-            det.semester,
-            det.subject.subject_name,
-            det.hours_lecture,
-            det.assessment_type.assessment_type_name
-        ])
-
     filename = f"curriculum_{curr_id}"
+    content = iter_curriculum_csv(
+        curriculum.education_level,
+        curriculum.education_form.education_form_name,
+        curriculum.approval_year,
+        _lazy_rows(curriculum_export_rows, curr_id)
+    )
 
-    output.seek(0)
     return Response(
-        output,
+        stream_with_context(content),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename={filename}.csv"}
     )
 
 
 @bp.route('/users')
+@read_only
 @login_required
 def users_list():
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     search = request.args.get('search', '').strip()
@@ -1018,17 +1191,32 @@ def users_list():
     group_id = request.args.get('group_id', type=int)
     dept_id = request.args.get('department_id', type=int)
 
-    query = db_session.query(User).outerjoin(Student).outerjoin(Teacher).outerjoin(StudyGroup).outerjoin(Department)
+    # Число предметов преподавателя - одним сгруппированным подзапросом
+    subject_counts = db_session.query(
+        teacher_subject_association.c.teacher_id,
+        func.count().label('subject_count')
+    ).group_by(teacher_subject_association.c.teacher_id).subquery()
+
+    query = db_session.query(User, func.coalesce(subject_counts.c.subject_count, 0)) \
+        .join(User.user_type_ref) \
+        .outerjoin(User.student) \
+        .outerjoin(Student.study_group) \
+        .outerjoin(User.teacher) \
+        .outerjoin(Teacher.department) \
+        .outerjoin(User.admin) \
+        .outerjoin(subject_counts, subject_counts.c.teacher_id == Teacher.teacher_id) \
+        .options(
+            contains_eager(User.user_type_ref),
+            contains_eager(User.student).contains_eager(Student.study_group),
+            contains_eager(User.teacher).contains_eager(Teacher.department),
+            contains_eager(User.admin),
+        )
 
     if search:
-        query = query.filter(
-            (Student.full_name.ilike(f'%{search}%')) |
-            (Teacher.full_name.ilike(f'%{search}%')) |
-            (Admin.full_name.ilike(f'%{search}%'))
-        )
+        query = query.filter(User.user_id.in_(matching_user_ids(db_session, search, role)))
 
     if role:
-        query = query.join(UserType).filter(UserType.type_name == role)
+        query = query.filter(UserType.type_name == role)
 
     if group_id:
         query = query.filter(Student.group_id == group_id)
@@ -1036,24 +1224,40 @@ def users_list():
     if dept_id:
         query = query.filter(Teacher.department_id == dept_id)
 
-    users = query.all()
-
-    all_groups = db_session.query(StudyGroup).order_by(StudyGroup.group_name).all()
-    all_depts = db_session.query(Department).order_by(Department.department_name).all()
+    after = request.args.get('after')
+    users, next_cursor = keyset_page(query, [User.user_id], after)
 
     return render_template(
         'users_list.html',
         users=users,
-        all_groups=all_groups,
-        all_depts=all_depts,
+        all_groups=get_choices(db_session, 'groups'),
+        all_depts=get_choices(db_session, 'departments'),
+        next_url=_page_url('main.users_list', next_cursor) if next_cursor else None,
+        first_url=_page_url('main.users_list', None) if after else None,
         sel_search=search, sel_role=role, sel_group=group_id, sel_dept=dept_id
     )
 
 
+@bp.route('/api/people/search')
+@read_only
+@login_required
+def api_people_search():
+    if current_user.role != 'admin':
+        abort(403)
+
+    search_text = request.args.get('q', '').strip()
+    if len(search_text) < 2:
+        return jsonify([])
+
+    role = request.args.get('role') or None
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify(search_people(db_session, search_text, role=role, limit=limit))
+
+
 @bp.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
 @login_required
 def user_edit(user_id):
-    if current_user.user_type_ref.type_name != 'admin':
+    if current_user.role != 'admin':
         abort(403)
 
     user = db_session.query(User).get(user_id)
@@ -1063,11 +1267,9 @@ def user_edit(user_id):
 
     form = UserEditForm()
 
-    form.group_id.choices = [(0, '-- Без группы --')] + [(g.group_id, g.group_name) for g in
-                                                         db_session.query(StudyGroup).all()]
-    form.department_id.choices = [(0, '-- Без кафедры --')] + [(d.department_id, d.department_name) for d in
-                                                               db_session.query(Department).all()]
-    form.subject_ids.choices = [(s.subject_id, s.subject_name) for s in db_session.query(Subject).all()]
+    form.group_id.choices = [(0, '-- Без группы --')] + get_choices(db_session, 'groups')
+    form.department_id.choices = [(0, '-- Без кафедры --')] + get_choices(db_session, 'departments')
+    form.subject_ids.choices = get_choices(db_session, 'subjects')
 
     if request.method == 'GET':
         if role == 'student':
@@ -1089,15 +1291,20 @@ def user_edit(user_id):
             elif role == 'teacher':
                 user.teacher.full_name = form.full_name.data
                 user.teacher.department_id = form.department_id.data
+                invalidate_choices(db_session, 'teachers')
 
                 selected_ids = form.subject_ids.data
                 selected_subjects = db_session.query(Subject).filter(Subject.subject_id.in_(selected_ids)).all()
                 user.teacher.subjects = selected_subjects
 
+                refresh_timetables_for_teacher(db_session, user.teacher.teacher_id)
+                refresh_search_vectors(db_session, teacher_id=user.teacher.teacher_id)
+
             elif role == 'admin':
                 user.admin.full_name = form.full_name.data
 
             db_session.commit()
+            invalidate_principal(user.user_id)
             flash('Пользователь обновлен.', 'success')
             return redirect(url_for('main.users_list'))
 
@@ -1109,10 +1316,43 @@ def user_edit(user_id):
 
 
 @bp.route('/api/teacher/<int:teacher_id>/subjects')
+@read_only
 def get_teacher_subjects(teacher_id):
     teacher = db_session.query(Teacher).get(teacher_id)
     if not teacher:
         return jsonify([])
 
     subjects = [{'id': s.subject_id, 'name': s.subject_name} for s in teacher.subjects]
-    return jsonify(subjects)
\ No newline at end of file
+    return jsonify(subjects)
+
+@bp.route('/admin/perf')
+@login_required
+def admin_perf():
+    if current_user.role != 'admin':
+        abort(403)
+
+    return render_template('admin_perf.html', **instrumentation.snapshot(),
+                           slow_query_ms=instrumentation.SLOW_QUERY_MS,
+                           n_plus_one_threshold=instrumentation.N_PLUS_ONE_THRESHOLD)
+
+
+@bp.route('/admin/perf/reset', methods=['POST'])
+@login_required
+def admin_perf_reset():
+    if current_user.role != 'admin':
+        abort(403)
+
+    instrumentation.reset()
+    flash('Статистика сброшена.', 'info')
+    return redirect(url_for('main.admin_perf'))
+
+
+@bp.route('/metrics')
+def metrics():
+    # Сборщику метрик - по токену, иначе только администратору
+    token = instrumentation.METRICS_TOKEN
+    by_token = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not by_token and not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+
+    return Response(instrumentation.prometheus_text(), mimetype='text/plain; version=0.0.4')
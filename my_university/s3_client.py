@@ -1,12 +1,28 @@
 import os
+import threading
+from urllib.parse import quote
 from minio import Minio
-from datetime import timedelta
+from minio.commonconfig import ComposeSource
+from minio.datatypes import PostPolicy
+from datetime import datetime, timedelta, timezone
 
 
 MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT', 'minio:9000')
 ACCESS_KEY = os.getenv('MINIO_ROOT_USER', 'minioadmin')
 SECRET_KEY = os.getenv('MINIO_ROOT_PASSWORD', 'minioadmin')
 BUCKET_NAME = os.getenv('MINIO_BUCKET_NAME', 'university-materials')
+# Адрес MinIO, видимый из браузера: на него указывают presigned-ссылки
+MINIO_PUBLIC_ENDPOINT = os.getenv('MINIO_PUBLIC_ENDPOINT', MINIO_ENDPOINT.replace('minio:9000', 'localhost:9000'))
+MINIO_PUBLIC_SECURE = os.getenv('MINIO_PUBLIC_SECURE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+MINIO_REGION = os.getenv('MINIO_REGION', 'us-east-1')
+# redirect - отдавать presigned-ссылку на MinIO, proxy - пропускать файл через приложение
+DOWNLOAD_MODE = os.getenv('MATERIAL_DOWNLOAD_MODE', 'redirect')
+PRESIGNED_TTL = timedelta(seconds=int(os.getenv('MINIO_PRESIGNED_TTL', '3600')))
+# Размер части multipart-загрузки (MinIO требует не меньше 5 МБ)
+UPLOAD_PART_SIZE = max(int(os.getenv('MINIO_UPLOAD_PART_SIZE', str(16 * 1024 * 1024))), 5 * 1024 * 1024)
+
+_bucket_lock = threading.Lock()
+_bucket_ready = False
 
 client = Minio(
     MINIO_ENDPOINT,
@@ -15,60 +31,118 @@ client = Minio(
     secure=False
 )
 
+# Подписывает ссылки для браузера. Подпись V4 включает хост, поэтому менять
+# адрес в готовой ссылке нельзя - нужен клиент с публичным адресом. Регион
+# задан явно, чтобы подпись не требовала запроса к MinIO.
+public_client = Minio(
+    MINIO_PUBLIC_ENDPOINT,
+    access_key=ACCESS_KEY,
+    secret_key=SECRET_KEY,
+    secure=MINIO_PUBLIC_SECURE,
+    region=MINIO_REGION
+)
+
 
 def ensure_bucket_exists():
-    """Проверяет наличие бакета и создает его, если нет"""
-    if not client.bucket_exists(BUCKET_NAME):
-        client.make_bucket(BUCKET_NAME)
-        print(f"Бакет '{BUCKET_NAME}' создан.")
+    """
+    Проверяет наличие бакета и создает его, если нет.
+    Проверка делается один раз на процесс (при старте приложения);
+    если MinIO тогда был недоступен - при первой загрузке.
+    """
+    global _bucket_ready
+    if _bucket_ready:
+        return
+    with _bucket_lock:
+        if _bucket_ready:
+            return
+        if not client.bucket_exists(BUCKET_NAME):
+            client.make_bucket(BUCKET_NAME)
+            print(f"Бакет '{BUCKET_NAME}' создан.")
+        _bucket_ready = True
 
 
 def upload_file_to_minio(file_data, object_name, content_type):
-    """Загружает файл в хранилище"""
+    """
+    Загружает поток в хранилище multipart-загрузкой частями по UPLOAD_PART_SIZE.
+    Длина потока заранее не нужна: поток читается один раз, без seek.
+    """
     ensure_bucket_exists()
 
-    file_data.seek(0, 2)
-    size = file_data.tell()
-    file_data.seek(0)
-
     client.put_object(
         BUCKET_NAME,
         object_name,
         file_data,
-        size,
+        length=-1,
+        part_size=UPLOAD_PART_SIZE,
         content_type=content_type
     )
     return object_name
 
 
-def get_download_url(object_name):
-    """Генерирует временную ссылку на скачивание"""
-    url = client.get_presigned_url(
-        "GET",
+def get_download_url(object_name, download_name=None):
+    """Генерирует временную ссылку на скачивание напрямую из MinIO"""
+    response_headers = None
+    if download_name:
+        response_headers = {
+            'response-content-disposition': f"attachment; filename*=UTF-8''{quote(download_name)}"
+        }
+
+    return public_client.presigned_get_object(
         BUCKET_NAME,
         object_name,
-        expires=timedelta(hours=1)
+        expires=PRESIGNED_TTL,
+        response_headers=response_headers
     )
 
-    if 'minio:9000' in url:
-        url = url.replace('minio:9000', 'localhost:9000')
 
-    return url
+def get_upload_form(object_name, content_type, max_size):
+    """
+    Параметры presigned POST для загрузки файла браузером прямо в MinIO.
+    Политика разрешает только этот ключ, этот Content-Type и размер до max_size.
+    Возвращает (url, поля формы).
+    """
+    policy = PostPolicy(BUCKET_NAME, datetime.now(timezone.utc) + PRESIGNED_TTL)
+    policy.add_equals_condition('key', object_name)
+    policy.add_equals_condition('Content-Type', content_type)
+    policy.add_content_length_range_condition(1, max_size)
+    fields = public_client.presigned_post_policy(policy)
+    fields['key'] = object_name
+    fields['Content-Type'] = content_type
+
+    scheme = 'https' if MINIO_PUBLIC_SECURE else 'http'
+    return f"{scheme}://{MINIO_PUBLIC_ENDPOINT}/{BUCKET_NAME}", fields
+
+
+def stat_file(object_name):
+    """Метаданные объекта (size, content_type, etag, last_modified) или None, если объекта нет"""
+    try:
+        return client.stat_object(BUCKET_NAME, object_name)
+    except Exception as e:
+        print(f"Ошибка при получении метаданных файла из MinIO: {e}")
+        return None
 
 
-def get_file_content(object_name):
+def get_file_content(object_name, offset=0, length=0):
     """
     Получает сам файл (поток данных) из MinIO.
-    Возвращает объект ответа MinIO.
+    offset/length - диапазон байт (length=0 - до конца объекта).
+    Возвращает объект ответа MinIO; вызывающий обязан закрыть его
+    и вернуть соединение в пул (close() и release_conn()).
     """
     try:
-        response = client.get_object(BUCKET_NAME, object_name)
+        response = client.get_object(BUCKET_NAME, object_name, offset=offset, length=length)
         return response
     except Exception as e:
         print(f"Ошибка при получении файла из MinIO: {e}")
         return None
 
 
+def copy_file_in_minio(source_name, object_name):
+    """Копирует объект внутри бакета на стороне MinIO (большие - по частям)"""
+    client.compose_object(BUCKET_NAME, object_name, [ComposeSource(BUCKET_NAME, source_name)])
+    return object_name
+
+
 def delete_file_from_minio(object_name):
     """
     Удаляет объект из хранилища MinIO.
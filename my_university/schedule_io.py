@@ -0,0 +1,279 @@
+import csv
+import io
+import json
+import textwrap
+from collections import namedtuple
+
+from sqlalchemy import insert
+
+from my_university.models import (
+    Schedule, TimeSlot,
+    Subject, LessonType,
+    Classroom, StudyGroup,
+    Teacher,
+)
+from my_university.conflicts import ScheduleConflictIndex
+
+DAYS_SHORT = {1: 'ПН', 2: 'ВТ', 3: 'СР', 4: 'ЧТ', 5: 'ПТ', 6: 'СБ'}
+DAYS_FULL = {1: 'Понедельник', 2: 'Вторник', 3: 'Среда', 4: 'Четверг', 5: 'Пятница', 6: 'Суббота'}
+
+_DAY_LOOKUP = {name.lower(): day for names in (DAYS_SHORT, DAYS_FULL) for day, name in names.items()}
+
+# Сколько строк выгрузки собирать в один кусок ответа
+EXPORT_CHUNK_ROWS = 500
+
+ImportResult = namedtuple('ImportResult', ['total', 'inserted', 'errors', 'group_ids', 'teacher_ids'])
+
+
+class _LineBuffer:
+    """Псевдо-файл для csv.writer: writerow возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+def _chunks(lines):
+    """
+    Первая строка отдается отдельно, как только готова, - клиент сразу получает
+    начало ответа. Остальные склеиваются в куски по EXPORT_CHUNK_ROWS.
+    """
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def iter_schedule_csv(rows):
+    """Потоковая выгрузка расписания в CSV"""
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(['Day', 'Time', 'Subject', 'Type', 'Room', 'Group', 'Teacher'])
+
+    yield from _chunks(
+        writer.writerow([
+            DAYS_SHORT.get(row.day_of_week, str(row.day_of_week)),
+            f"{row.time_start.strftime('%H:%M')} - {row.time_end.strftime('%H:%M')}",
+            row.subject_name,
+            row.lesson_type_name,
+            row.class_name,
+            row.group_name,
+            row.full_name
+        ])
+        for row in rows
+    )
+
+
+def iter_schedule_json(rows):
+    """
+    Потоковая выгрузка расписания в JSON-массив.
+    Текст совпадает с json.dumps(список, ensure_ascii=False, indent=4).
+    """
+    def items():
+        for number, row in enumerate(rows):
+            item = json.dumps({
+                'day_of_week': DAYS_FULL.get(row.day_of_week),
+                'time_start': row.time_start.strftime('%H:%M'),
+                'time_end': row.time_end.strftime('%H:%M'),
+                'subject': row.subject_name,
+                'type': row.lesson_type_name,
+                'classroom': row.class_name,
+                'group': row.group_name,
+                'teacher': row.full_name
+            }, ensure_ascii=False, indent=4)
+            yield ('[\n' if number == 0 else ',\n') + textwrap.indent(item, '    ')
+
+    empty = True
+    for chunk in _chunks(items()):
+        empty = False
+        yield chunk
+    yield '[]' if empty else '\n]'
+
+
+def iter_curriculum_csv(education_level, education_form, approval_year, rows):
+    """Потоковая выгрузка учебного плана в CSV"""
+    writer = csv.writer(_LineBuffer())
+    yield ''.join([
+        writer.writerow(['Учебный план:', education_level]),
+        writer.writerow(['Форма обучения:', education_form]),
+        writer.writerow(['Год утверждения:', approval_year]),
+        writer.writerow([]),
+        writer.writerow(['Семестр', 'Предмет', 'Часы', 'Тип аттестации']),
+    ])
+
+    yield from _chunks(
+        writer.writerow([row.semester, row.subject_name, row.hours_lecture, row.assessment_type_name])
+        for row in rows
+    )
+
+
+def parse_csv(text):
+    """
+    Строки в формате schedule_export_csv:
+    Day, Time ("08:15 - 09:50"), Subject, Type, Room, Group, Teacher
+    """
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        rows.append({
+            'day': (record.get('Day') or '').strip(),
+            'time_start': (record.get('Time') or '').split('-')[0].strip(),
+            'subject': (record.get('Subject') or '').strip(),
+            'lesson_type': (record.get('Type') or '').strip(),
+            'classroom': (record.get('Room') or '').strip(),
+            'group': (record.get('Group') or '').strip(),
+            'teacher': (record.get('Teacher') or '').strip(),
+        })
+    return rows
+
+
+def parse_json(text):
+    """Список объектов в формате schedule_export_json"""
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise ValueError('Ожидается JSON-массив занятий')
+
+    rows = []
+    for record in data:
+        if not isinstance(record, dict):
+            record = {}
+        rows.append({
+            'day': str(record.get('day_of_week') or '').strip(),
+            'time_start': str(record.get('time_start') or '').strip(),
+            'subject': str(record.get('subject') or '').strip(),
+            'lesson_type': str(record.get('type') or '').strip(),
+            'classroom': str(record.get('classroom') or '').strip(),
+            'group': str(record.get('group') or '').strip(),
+            'teacher': str(record.get('teacher') or '').strip(),
+        })
+    return rows
+
+
+def parse_schedule_file(filename, content):
+    """Определяет формат по расширению (или по первому символу) и разбирает файл"""
+    text = content.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or text.lstrip().startswith('['):
+        return parse_json(text)
+    return parse_csv(text)
+
+
+def _parse_day(value):
+    if value.isdigit() and int(value) in DAYS_SHORT:
+        return int(value)
+    return _DAY_LOOKUP.get(value.lower())
+
+
+def _lookup(session, id_column, name_column, names):
+    """Одним запросом находит id по множеству имен; неоднозначные имена -> None"""
+    found = {}
+    if not names:
+        return found
+    for row_id, name in session.query(id_column, name_column).filter(name_column.in_(names)):
+        found[name] = None if name in found else row_id
+    return found
+
+
+def import_schedule(session, rows, skip_invalid=False):
+    """
+    Проверяет и вставляет занятия одной транзакцией.
+    Имена разрешаются в id запросами по множествам имен, конфликты
+    преподавателей/аудиторий/групп проверяются в памяти по ScheduleConflictIndex,
+    включая конфликты между строками самого файла.
+
+    Если skip_invalid=False и есть хоть одна ошибка, ничего не вставляется.
+    Номер строки в отчете - номер занятия в файле, начиная с 1.
+    """
+    time_slots = {ts.time_start.strftime('%H:%M'): ts.time_slot_id
+                  for ts in session.query(TimeSlot.time_slot_id, TimeSlot.time_start)}
+    lesson_types = {lt.lesson_type_name: lt.lesson_type_id
+                    for lt in session.query(LessonType.lesson_type_id, LessonType.lesson_type_name)}
+
+    subjects = _lookup(session, Subject.subject_id, Subject.subject_name, {r['subject'] for r in rows})
+    classrooms = _lookup(session, Classroom.class_id, Classroom.class_name, {r['classroom'] for r in rows})
+    groups = _lookup(session, StudyGroup.group_id, StudyGroup.group_name, {r['group'] for r in rows})
+    teachers = _lookup(session, Teacher.teacher_id, Teacher.full_name, {r['teacher'] for r in rows})
+
+    index = ScheduleConflictIndex.load(session)
+
+    errors = []
+    to_insert = []
+    file_rows = {}  # временный id занятия из файла -> номер строки
+
+    for number, row in enumerate(rows, start=1):
+        problems = []
+
+        day = _parse_day(row['day'])
+        if day is None:
+            problems.append(f"неизвестный день недели '{row['day']}'")
+
+        time_slot_id = time_slots.get(row['time_start'])
+        if time_slot_id is None:
+            problems.append(f"нет пары, начинающейся в '{row['time_start']}'")
+
+        resolved = {}
+        for key, mapping, label in (('subject', subjects, 'предмет'),
+                                    ('lesson_type', lesson_types, 'тип занятия'),
+                                    ('classroom', classrooms, 'аудитория'),
+                                    ('group', groups, 'группа'),
+                                    ('teacher', teachers, 'преподаватель')):
+            if row[key] not in mapping:
+                problems.append(f"{label} '{row[key]}' не найден(а)")
+            elif mapping[row[key]] is None:
+                problems.append(f"{label} '{row[key]}' неоднозначен(на)")
+            else:
+                resolved[key] = mapping[row[key]]
+
+        if not problems:
+            conflicts = index.find_conflicts(
+                group_id=resolved['group'],
+                teacher_id=resolved['teacher'],
+                classroom_id=resolved['classroom'],
+                day_of_week=day,
+                time_slot_id=time_slot_id
+            )
+            for conflict in conflicts:
+                where = f"строкой {file_rows[conflict.schedule_id]} файла" if conflict.schedule_id in file_rows \
+                    else f"занятием #{conflict.schedule_id}"
+                if conflict.kind == 'teacher':
+                    problems.append(f"преподаватель в это время ведет пару в другой аудитории (конфликт с {where})")
+                elif conflict.kind == 'classroom':
+                    problems.append(f"аудитория занята другим преподавателем (конфликт с {where})")
+                else:
+                    problems.append(f"у группы уже стоит занятие в это время (конфликт с {where})")
+
+        if problems:
+            errors.append((number, '; '.join(problems)))
+            continue
+
+        temp_id = -number
+        file_rows[temp_id] = number
+        index.add(temp_id, resolved['group'], resolved['teacher'], resolved['classroom'], day, time_slot_id)
+        to_insert.append({
+            'study_group_id': resolved['group'],
+            'teacher_id': resolved['teacher'],
+            'subject_id': resolved['subject'],
+            'lesson_type_id': resolved['lesson_type'],
+            'classroom_id': resolved['classroom'],
+            'time_slot_id': time_slot_id,
+            'day_of_week': day,
+        })
+
+    if errors and not skip_invalid:
+        to_insert = []
+
+    if to_insert:
+        session.execute(insert(Schedule), to_insert)
+
+    return ImportResult(
+        total=len(rows),
+        inserted=len(to_insert),
+        errors=errors,
+        group_ids={r['study_group_id'] for r in to_insert},
+        teacher_ids={r['teacher_id'] for r in to_insert},
+    )
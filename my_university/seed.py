@@ -1,9 +1,9 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from werkzeug.security import generate_password_hash
 
-from my_university.config import get_db_url
+from my_university.config import create_db_engine
+from my_university.migrations import upgrade
 from my_university.models import (
     Base,
     User, Admin,
@@ -15,8 +15,9 @@ from my_university.models import (
 
 
 def seed_database():
-    engine = create_engine(get_db_url())
+    engine = create_db_engine(statement_timeout_ms=0)
     Base.metadata.create_all(engine)
+    upgrade(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
 
@@ -119,11 +120,10 @@ def seed_database():
 
 
 def create_super_admin():
-    from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker
-    from my_university.config import get_db_url
+    from my_university.config import create_db_engine
 
-    engine = create_engine(get_db_url())
+    engine = create_db_engine(statement_timeout_ms=0)
     Session = sessionmaker(bind=engine)
     session = Session()
 
@@ -0,0 +1,198 @@
+import json
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+
+from my_university.models import StudyGroup, Teacher, TimeSlot, Schedule, TimetableSnapshot
+from my_university.queries import schedule_query, upsert
+
+DAYS = range(1, 7)
+
+
+def _time_slots(session):
+    return [
+        {
+            'time_slot_id': ts.time_slot_id,
+            'time_slot_name': ts.time_slot_name,
+            'time_start': ts.time_start.strftime('%H:%M'),
+            'time_end': ts.time_end.strftime('%H:%M'),
+        }
+        for ts in session.query(TimeSlot).order_by(TimeSlot.time_start)
+    ]
+
+
+def empty_timetable(session, title="Расписание"):
+    """Пустая сетка: только пары, без занятий"""
+    return {
+        'title': title,
+        'time_slots': _time_slots(session),
+        'grid': {day: {} for day in DAYS},
+    }
+
+
+def build_timetable(session, kind, owner_id):
+    """
+    Собирает сетку расписания группы ('group') или преподавателя ('teacher'):
+    grid[день_недели][id_таймслота] = словарь с подписями занятия.
+    Возвращает None, если такой группы/преподавателя нет.
+    """
+    if kind == 'group':
+        owner = session.get(StudyGroup, owner_id)
+        if owner is None:
+            return None
+        title = f"Расписание группы {owner.group_name}"
+        items = schedule_query(session, group_id=owner_id).all()
+    else:
+        owner = session.get(Teacher, owner_id)
+        if owner is None:
+            return None
+        title = f"Расписание преподавателя {owner.full_name}"
+        items = schedule_query(session, teacher_id=owner_id).all()
+
+    timetable = empty_timetable(session, title)
+
+    for item in items:
+        day = timetable['grid'].get(item.day_of_week)
+        if day is None:
+            continue
+        day[item.time_slot_id] = {
+            'schedule_id': item.schedule_id,
+            'subject': item.subject.subject_name,
+            'lesson_type': item.lesson_type.lesson_type_name,
+            'classroom': item.classroom.class_name,
+            'teacher': item.teacher.full_name,
+            'group': item.study_group.group_name,
+        }
+
+    return timetable
+
+
+def _decode(payload):
+    timetable = json.loads(payload)
+    timetable['grid'] = {
+        int(day): {int(slot): lesson for slot, lesson in slots.items()}
+        for day, slots in timetable['grid'].items()
+    }
+    return timetable
+
+
+def _claim(session, kind, owner_ids):
+    """
+    Помечает снимки устаревшими (payload = NULL, version + 1), создавая
+    недостающие строки. UPSERT блокирует строки до конца транзакции, поэтому
+    параллельные правки одной сетки выполняются по очереди, а читатель,
+    собравший сетку по старым данным, не сможет ее записать.
+    """
+    owner_ids = sorted(set(owner_ids))
+    if not owner_ids:
+        return
+
+    stmt = upsert(session, TimetableSnapshot).values([
+        {'owner_kind': kind, 'owner_id': owner_id, 'version': 1, 'payload': None}
+        for owner_id in owner_ids
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[TimetableSnapshot.owner_kind, TimetableSnapshot.owner_id],
+        set_={'version': TimetableSnapshot.version + 1, 'payload': None}
+    ))
+
+
+def _snapshot_filter(kind, owner_id):
+    return (TimetableSnapshot.owner_kind == kind) & (TimetableSnapshot.owner_id == owner_id)
+
+
+def rebuild_timetable(session, kind, owner_id):
+    """Пересобирает сохраненную сетку в текущей транзакции"""
+    _claim(session, kind, [owner_id])
+    timetable = build_timetable(session, kind, owner_id)
+
+    if timetable is None:
+        session.execute(delete(TimetableSnapshot).where(_snapshot_filter(kind, owner_id)))
+        return None
+
+    session.execute(
+        update(TimetableSnapshot)
+        .where(_snapshot_filter(kind, owner_id))
+        .values(payload=json.dumps(timetable, ensure_ascii=False))
+    )
+    return timetable
+
+
+def refresh_timetables(session, group_ids=(), teacher_ids=()):
+    """Пересобирает сетки только затронутых групп и преподавателей"""
+    for group_id in sorted(set(group_ids)):
+        rebuild_timetable(session, 'group', group_id)
+    for teacher_id in sorted(set(teacher_ids)):
+        rebuild_timetable(session, 'teacher', teacher_id)
+
+
+def invalidate_timetables(session, group_ids=(), teacher_ids=()):
+    """
+    Помечает сетки устаревшими одним запросом на вид владельца - для массовых
+    изменений, когда пересобирать сразу много сеток дороже, чем собрать их
+    при первом просмотре.
+    """
+    _claim(session, 'group', group_ids)
+    _claim(session, 'teacher', teacher_ids)
+
+
+def refresh_timetables_for_teacher(session, teacher_id):
+    """Пересобирает сетку преподавателя и всех групп, у которых он ведет занятия"""
+    group_ids = [row.study_group_id for row in
+                 session.query(Schedule.study_group_id).filter(Schedule.teacher_id == teacher_id).distinct()]
+    refresh_timetables(session, group_ids=group_ids, teacher_ids=[teacher_id])
+
+
+def _primary(session):
+    """Основной сервер сессии: туда идет запись, даже если чтение запроса - с реплики"""
+    return session.get_bind(clause=update(TimetableSnapshot))
+
+
+def _fill_snapshot(bind, kind, owner_id):
+    """
+    Собирает сетку и сохраняет снимок в отдельной короткой транзакции на
+    основном сервере: транзакция запроса остается только читающей.
+    Снимок записывается, только если за это время его никто не изменил.
+    """
+    with Session(bind=bind) as session:
+        row = session.execute(
+            select(TimetableSnapshot.version, TimetableSnapshot.payload).where(_snapshot_filter(kind, owner_id))
+        ).first()
+        if row is not None and row.payload is not None:
+            return _decode(row.payload)  # уже собрал параллельный запрос
+
+        timetable = build_timetable(session, kind, owner_id)
+        if timetable is None:
+            return None
+
+        payload = json.dumps(timetable, ensure_ascii=False)
+        if row is None:
+            session.execute(
+                upsert(session, TimetableSnapshot)
+                .values(owner_kind=kind, owner_id=owner_id, version=0, payload=payload)
+                .on_conflict_do_nothing()
+            )
+        else:
+            session.execute(
+                update(TimetableSnapshot)
+                .where(_snapshot_filter(kind, owner_id), TimetableSnapshot.version == row.version,
+                       TimetableSnapshot.payload.is_(None))
+                .values(payload=payload)
+            )
+        session.commit()
+    return timetable
+
+
+def get_timetable(session, kind, owner_id):
+    """
+    Чтение сетки: одна выборка по первичному ключу, сессия запроса ничего не пишет.
+    Если снимка нет или он устарел, сетка собирается и сохраняется на
+    основном сервере отдельной транзакцией (_fill_snapshot).
+    """
+    row = session.execute(
+        select(TimetableSnapshot.payload).where(_snapshot_filter(kind, owner_id))
+    ).first()
+    if row is not None and row.payload is not None:
+        return _decode(row.payload)
+
+    return _fill_snapshot(_primary(session), kind, owner_id)
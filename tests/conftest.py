@@ -0,0 +1,56 @@
+"""
+Общие фикстуры: приложение на SQLite в памяти.
+
+Импорт приложения требует переменных POSTGRES_* (движок создается при
+импорте, но не подключается), поэтому для тестов подставляются заглушки,
+а сессии приложения перепривязываются к тестовой базе.
+"""
+import os
+
+for name, value in (('POSTGRES_USER', 'test'), ('POSTGRES_PASSWORD', 'test'), ('POSTGRES_HOST', 'localhost'),
+                    ('POSTGRES_PORT', '5432'), ('POSTGRES_DB', 'test')):
+    os.environ.setdefault(name, value)
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from my_university import main as app_main
+from my_university import reference_cache
+from my_university.models import Base
+
+
+class QueryCounter:
+    """Число SQL-выражений, выполненных движком с последнего reset"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def app(engine, monkeypatch):
+    app_main.Session.configure(bind=engine)
+    if 'main' not in app_main.app.blueprints:
+        app_main.register_blueprints()
+    app_main.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    # Справочники в кэше не перечитываются посреди теста - число запросов стабильно
+    monkeypatch.setattr(reference_cache, 'CACHE_TTL', 3600)
+    monkeypatch.setattr(reference_cache, '_checked_at', 0.0)
+    reference_cache._entries.clear()
+    yield app_main.app
+    app_main.db_session.remove()
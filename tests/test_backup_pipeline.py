@@ -0,0 +1,114 @@
+"""
+Потоковый конвейер бэкапа против локального HTTP-приемника: поддельный
+pg_dump (cat готовых байтов) -> сжатие -> многочастная загрузка в HttpStorage.
+"""
+import os
+import random
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import pipeline
+from pipeline import DumpStream, decompress
+from storage import HttpStorage
+
+PART_SIZE = 64 * 1024
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """PUT/GET/DELETE объектов в памяти сервера"""
+
+    def do_PUT(self):
+        self.server.objects[self.path.lstrip('/')] = self.rfile.read(int(self.headers['Content-Length']))
+        self._reply(201)
+
+    def do_GET(self):
+        data = self.server.objects.get(self.path.lstrip('/'))
+        self._reply(404) if data is None else self._reply(200, data)
+
+    def do_DELETE(self):
+        self.server.objects.pop(self.path.lstrip('/'), None)
+        self._reply(204)
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.objects = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_dump(tmp_path, monkeypatch):
+    """Исходные байты и поддельный pg_dump, который их выдает, не глядя на аргументы"""
+    rng = random.Random(0)
+    # Половина - шум (не сжимается), половина - повторы: несколько частей и после сжатия
+    data = rng.randbytes(5 * PART_SIZE) + b'COPY public.schedule FROM stdin;\n' * 20000
+    source = tmp_path / 'dump.bin'
+    source.write_bytes(data)
+
+    script = tmp_path / 'pg_dump'
+    script.write_text(f'#!/bin/sh\nexec cat "{source}"\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(pipeline, 'PG_DUMP', str(script))
+    return data
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.setattr(pipeline, 'WORK_DIR', str(work))
+    monkeypatch.setenv('TMPDIR', str(work))
+    monkeypatch.setattr('tempfile.tempdir', str(work))
+    return work
+
+
+PARAMS = {'host': 'localhost', 'port': '5432', 'user': 'test', 'password': None, 'dbname': 'test'}
+
+
+@pytest.mark.parametrize('compression', ['zstd', 'gzip'])
+def test_dump_streams_into_http_storage(stand_in, fake_dump, temp_dir, compression):
+    storage = HttpStorage(f'http://127.0.0.1:{stand_in.server_port}', part_size=PART_SIZE, workers=4)
+    stream = DumpStream(PARAMS, mode='stream', compression=compression)
+    name = 'backup_test' + stream.extension
+
+    report = storage.put(name, iter(stream))
+
+    parts = sorted(key for key in stand_in.objects if key.startswith(name + '.part0'))
+    assert len(parts) > 1
+    assert name + '.parts' in stand_in.objects
+    assert report.size == stream.output_bytes == sum(len(stand_in.objects[key]) for key in parts)
+    assert stream.raw_bytes == len(fake_dump)
+
+    restored = b''.join(decompress(storage.get(name), name))
+    assert restored == fake_dump
+    assert os.listdir(temp_dir) == []
+
+
+def test_failed_dump_is_not_successful(stand_in, tmp_path, temp_dir, monkeypatch):
+    script = tmp_path / 'pg_dump_fails'
+    script.write_text('#!/bin/sh\necho partial\nexit 1\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(pipeline, 'PG_DUMP', str(script))
+
+    storage = HttpStorage(f'http://127.0.0.1:{stand_in.server_port}', part_size=PART_SIZE)
+    stream = DumpStream(PARAMS, mode='stream', compression='gzip')
+    with pytest.raises(Exception):
+        storage.put('backup_failed' + stream.extension, iter(stream))
+    assert os.listdir(temp_dir) == []
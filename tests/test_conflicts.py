@@ -0,0 +1,94 @@
+"""
+Правила ScheduleConflictIndex: потоковая лекция допустима, преподаватель
+в двух аудиториях, аудитория с двумя преподавателями и двойное занятие
+группы - конфликты; exclude_id и remove() для редактирования занятия.
+"""
+import pytest
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import populate_schedule
+from my_university.conflicts import ScheduleConflict, ScheduleConflictIndex
+from my_university.models import Schedule
+
+DAY, SLOT = 1, 1
+GROUP, OTHER_GROUP = 10, 11
+TEACHER, OTHER_TEACHER = 20, 21
+ROOM, OTHER_ROOM = 30, 31
+
+
+@pytest.fixture
+def index():
+    """Одно занятие: группа GROUP, преподаватель TEACHER, аудитория ROOM в ячейке (DAY, SLOT)"""
+    index = ScheduleConflictIndex()
+    index.add(1, GROUP, TEACHER, ROOM, DAY, SLOT)
+    return index
+
+
+def test_joint_lecture_is_allowed(index):
+    index.add(2, OTHER_GROUP, TEACHER, ROOM, DAY, SLOT)
+    assert index.find_conflicts(12, TEACHER, ROOM, DAY, SLOT) == []
+
+
+def test_teacher_in_two_rooms(index):
+    assert index.find_conflicts(OTHER_GROUP, TEACHER, OTHER_ROOM, DAY, SLOT) == [ScheduleConflict('teacher', 1)]
+
+
+def test_room_with_two_teachers(index):
+    assert index.find_conflicts(OTHER_GROUP, OTHER_TEACHER, ROOM, DAY, SLOT) == [ScheduleConflict('classroom', 1)]
+
+
+def test_group_double_booked(index):
+    assert index.find_conflicts(GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT) == [ScheduleConflict('group', 1)]
+
+
+def test_all_conflicts_are_reported(index):
+    index.add(2, OTHER_GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT)
+    conflicts = index.find_conflicts(GROUP, TEACHER, OTHER_ROOM, DAY, SLOT)
+    assert sorted(conflicts) == [
+        ScheduleConflict('classroom', 2), ScheduleConflict('group', 1), ScheduleConflict('teacher', 1),
+    ]
+
+
+def test_other_cell_is_free(index):
+    assert index.find_conflicts(GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT + 1) == []
+    assert index.find_conflicts(GROUP, OTHER_TEACHER, OTHER_ROOM, DAY + 1, SLOT) == []
+
+
+def test_exclude_id_on_edit(index):
+    # Перенос занятия 1 в другую аудиторию с другим преподавателем - не конфликт с самим собой
+    assert index.find_conflicts(GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT, exclude_id=1) == []
+
+    index.add(2, OTHER_GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT)
+    assert index.find_conflicts(GROUP, TEACHER, OTHER_ROOM, DAY, SLOT, exclude_id=1) == [
+        ScheduleConflict('classroom', 2),
+    ]
+
+
+def test_remove(index):
+    index.add(2, OTHER_GROUP, TEACHER, ROOM, DAY, SLOT)
+    index.remove(1)
+
+    assert len(index) == 1
+    assert index.find_conflicts(GROUP, OTHER_TEACHER, OTHER_ROOM, DAY, SLOT) == []
+    # Потоковое занятие 2 остается в индексе
+    assert index.find_conflicts(GROUP, TEACHER, OTHER_ROOM, DAY, SLOT) == [ScheduleConflict('teacher', 2)]
+
+    index.remove(2)
+    index.remove(2)  # повторное удаление ничего не делает
+    assert len(index) == 0
+    assert index._teachers == {} and index._rooms == {} and index._groups == {}
+
+
+def test_load_matches_table(engine):
+    with Session(engine) as session:
+        populate_schedule(session, lessons=40, lessons_per_group=10, subjects=5)
+        lessons = session.query(
+            Schedule.schedule_id, Schedule.study_group_id, Schedule.teacher_id,
+            Schedule.classroom_id, Schedule.day_of_week, Schedule.time_slot_id
+        ).all()
+        index = ScheduleConflictIndex.load(session)
+
+    assert len(index) == len(lessons) == 40
+    for schedule_id, *candidate in lessons:
+        assert ScheduleConflict('group', schedule_id) in index.find_conflicts(*candidate)
+        assert index.find_conflicts(*candidate, exclude_id=schedule_id) == []
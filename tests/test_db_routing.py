@@ -0,0 +1,142 @@
+"""
+Маршрутизация чтения на реплику (db_routing) на двух SQLite-файлах:
+в каждом таблица marker с именем сервера, так что по результату чтения
+видно, куда ушел запрос.
+"""
+import pytest
+from flask import Flask
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, insert, select, update
+from sqlalchemy.orm import registry, scoped_session, sessionmaker
+
+from my_university import db_routing
+from my_university.db_routing import RoutingSession, install_routing, read_only
+
+metadata = MetaData()
+marker = Table('marker', metadata, Column('id', Integer, primary_key=True), Column('name', String(20)))
+
+
+class Marker:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+registry().map_imperatively(Marker, marker)
+
+
+def make_engine(path, name):
+    engine = create_engine(f'sqlite:///{path}')
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(marker).values(id=1, name=name))
+    return engine
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    primary = make_engine(tmp_path / 'primary.db', 'primary')
+    replica = make_engine(tmp_path / 'replica.db', 'replica')
+    monkeypatch.setitem(db_routing._lag, 'checked_at', None)
+    yield primary, replica
+    primary.dispose()
+    replica.dispose()
+
+
+@pytest.fixture
+def db(engines):
+    primary, replica = engines
+    session = scoped_session(sessionmaker(class_=RoutingSession, bind=primary, replica=replica))
+    yield session
+    session.remove()
+
+
+@pytest.fixture
+def client(engines, db):
+    _, replica = engines
+    app = Flask(__name__)
+    app.config.update(TESTING=True, SECRET_KEY='test')
+
+    def server():
+        return db.execute(select(marker.c.name)).scalar()
+
+    @app.route('/read', methods=['GET', 'POST'])
+    @read_only
+    def read_view():
+        return server()
+
+    @app.route('/plain')
+    def plain_view():
+        return server()
+
+    @app.route('/write', methods=['POST'])
+    def write_view():
+        db.execute(update(marker).values(name='primary'))
+        db.commit()
+        return 'ok'
+
+    @app.teardown_appcontext
+    def shutdown_session(exception=None):
+        db.remove()
+
+    install_routing(app, replica)
+    return app.test_client()
+
+
+def test_read_only_get_goes_to_replica(client):
+    assert client.get('/read').text == 'replica'
+
+
+def test_view_without_read_only_goes_to_primary(client):
+    assert client.get('/plain').text == 'primary'
+
+
+def test_post_goes_to_primary(client):
+    assert client.post('/read').text == 'primary'
+
+
+def test_get_right_after_write_goes_to_primary(client, monkeypatch):
+    client.post('/write')
+    assert client.get('/read').text == 'primary'
+
+    monkeypatch.setattr(db_routing, 'REPLICA_RYW_SECONDS', 0)
+    assert client.get('/read').text == 'replica'
+
+
+@pytest.mark.parametrize('lag', [None, db_routing.REPLICA_MAX_LAG_SECONDS + 1])
+def test_lagging_or_unavailable_replica_falls_back_to_primary(client, monkeypatch, lag):
+    monkeypatch.setattr(db_routing, 'replica_lag', lambda replica: lag)
+    assert client.get('/read').text == 'primary'
+
+
+def test_writes_go_to_primary_even_when_reading_from_replica(engines):
+    primary, replica = engines
+    session = RoutingSession(bind=primary, replica=replica, info={'use_replica': True})
+    try:
+        assert session.get_bind() is replica
+        assert session.get_bind(clause=update(marker)) is primary
+
+        session.execute(update(marker).values(name='updated'))
+        session.execute(insert(marker).values(id=2, name='inserted'))
+        session.commit()
+    finally:
+        session.close()
+
+    with primary.connect() as connection:
+        assert connection.execute(select(marker.c.name).order_by(marker.c.id)).scalars().all() == ['updated', 'inserted']
+    with replica.connect() as connection:
+        assert connection.execute(select(marker.c.name)).scalars().all() == ['replica']
+
+
+def test_flush_goes_to_primary(engines):
+    primary, replica = engines
+    session = RoutingSession(bind=primary, replica=replica, info={'use_replica': True})
+    try:
+        session.add(Marker(id=3, name='flushed'))
+        session.flush()
+        session.commit()
+    finally:
+        session.close()
+
+    with primary.connect() as connection:
+        assert connection.execute(select(marker.c.name).where(marker.c.id == 3)).scalar() == 'flushed'
+    with replica.connect() as connection:
+        assert connection.execute(select(marker.c.name).where(marker.c.id == 3)).scalar() is None
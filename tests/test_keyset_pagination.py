@@ -0,0 +1,125 @@
+"""
+Keyset-пагинация списков пользователей и материалов: обход всех страниц
+по ссылке "Далее" дает каждую строку ровно один раз и стоит одного
+запроса на страницу, а подделанный курсор ведет на первую страницу.
+"""
+import base64
+import html
+import re
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import (
+    BENCH_PASSWORD, PASSWORD_HASH, ensure_lookups, populate_materials, populate_people, populate_schedule,
+)
+from my_university.models import Admin, EducationMaterial, Student, Teacher, User
+from my_university.queries import PAGE_SIZE, encode_cursor
+
+from conftest import QueryCounter
+
+USERS = 3 * PAGE_SIZE + 7
+MATERIALS = 3 * PAGE_SIZE + 11
+
+USER_ID = re.compile(r'href="/users/(\d+)/edit"')
+MATERIAL_ID = re.compile(r'action="/materials/(\d+)/delete"')
+NEXT_URL = re.compile(r'<a href="([^"]+)" class="btn btn-outline-primary btn-sm">Далее')
+
+
+@pytest.fixture
+def university(engine):
+    with Session(engine) as session:
+        schedule = populate_schedule(session, lessons=5, lessons_per_group=5, subjects=5)
+        populate_people(session, users=USERS, departments=2)
+        populate_materials(session, schedule['teachers'], schedule['subjects'], materials=MATERIALS)
+
+        lookups = ensure_lookups(session)
+        user = User(user_type_id=lookups['user_types']['admin'], hash_login='admin', hash_password=PASSWORD_HASH)
+        session.add(user)
+        session.flush()
+        session.add(Admin(user_id=user.user_id, full_name='Администратор'))
+        session.commit()
+
+        names = {}
+        for model in (Student, Teacher, Admin):
+            names.update(session.execute(select(model.user_id, model.full_name)).all())
+        materials = dict(session.execute(
+            select(EducationMaterial.education_material_id, EducationMaterial.education_material_name)
+        ).all())
+
+    return {'users': names, 'materials': materials}
+
+
+@pytest.fixture
+def client(app, university):
+    client = app.test_client()
+    response = client.post('/login', data={'login': 'admin', 'password': BENCH_PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+def get_page(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def walk(client, counter, url, id_pattern):
+    """Все страницы по ссылкам "Далее": (id по страницам, число запросов каждой страницы)"""
+    get_page(client, url)  # прогрев справочников и сессии
+    pages, queries = [], []
+    while url:
+        counter.reset()
+        body = get_page(client, url)
+        queries.append(counter.count)
+        pages.append([int(value) for value in id_pattern.findall(body)])
+        match = NEXT_URL.search(body)
+        url = html.unescape(match.group(1)) if match else None
+    return pages, queries
+
+
+@pytest.mark.parametrize('search', ['', 'Иванов'])
+def test_users_walk(client, engine, university, search):
+    expected = {user_id for user_id, name in university['users'].items() if search in name}
+    pages, queries = walk(client, QueryCounter(engine), f'/users?search={search}', USER_ID)
+    ids = [user_id for page in pages for user_id in page]
+
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
+    assert all(len(page) == PAGE_SIZE for page in pages[:-1])
+    assert queries == [1] * len(pages)
+    if not search:
+        assert len(pages) > 1
+
+
+@pytest.mark.parametrize('search', ['', 'Практикум'])
+def test_materials_walk(client, engine, university, search):
+    expected = {material_id for material_id, name in university['materials'].items() if search in name}
+
+    pages, queries = walk(client, QueryCounter(engine), f'/materials?search={search}', MATERIAL_ID)
+    ids = [material_id for page in pages for material_id in page]
+
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
+    assert all(len(page) == PAGE_SIZE for page in pages[:-1])
+    assert queries == [1] * len(pages)
+    if not search:
+        assert len(pages) > 1
+
+
+@pytest.mark.parametrize('url, cursor', [
+    ('/users', encode_cursor(['zz'])),
+    ('/users', encode_cursor([1, 2])),
+    ('/users', encode_cursor([True])),
+    ('/users', 'не-курсор'),
+    ('/materials', encode_cursor(['a', 'b'])),
+    ('/materials', encode_cursor([1, 2])),
+    ('/materials', encode_cursor(['a'])),
+    ('/materials', base64.urlsafe_b64encode(b'{"a":1}').decode()),
+])
+def test_tampered_cursor_is_first_page(client, university, url, cursor):
+    pattern = USER_ID if url == '/users' else MATERIAL_ID
+    first = pattern.findall(get_page(client, url))
+    tampered = pattern.findall(get_page(client, f'{url}?after={cursor}'))
+    assert first and tampered == first
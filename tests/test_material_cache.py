@@ -0,0 +1,85 @@
+"""
+Дисковый кэш материалов: общий для процессов счетчик объема и вытеснение.
+"""
+import os
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from my_university import material_cache
+
+
+class FakeObject:
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, size):
+        for start in range(0, len(self.data), size):
+            yield self.data[start:start + size]
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(material_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(material_cache, 'ENABLED', True)
+    monkeypatch.setattr(material_cache, 'CACHE_MAX_BYTES', 1000)
+    monkeypatch.setattr(material_cache, 'CACHE_MAX_ITEM_BYTES', 400)
+    monkeypatch.setattr(material_cache, '_entries', OrderedDict())
+    monkeypatch.setattr(material_cache, '_loaded', False)
+    monkeypatch.setattr(material_cache, '_size', 0)
+    monkeypatch.setattr(material_cache, '_stats', dict.fromkeys(material_cache._stats, 0))
+    monkeypatch.setattr(material_cache, 'get_file_content', lambda name, offset=0, length=0: FakeObject(b'x' * 100))
+
+    scans = []
+    scan = material_cache._scan
+    monkeypatch.setattr(material_cache, '_scan', lambda: scans.append(1) or scan())
+    return SimpleNamespace(dir=tmp_path, scans=scans)
+
+
+def stat(size=100, etag='"v1"'):
+    return SimpleNamespace(size=size, etag=etag, content_type='application/pdf', last_modified=None)
+
+
+def data_files(directory):
+    return [name for _, _, files in os.walk(directory) for name in files
+            if not name.startswith('.') and not name.endswith('.json')]
+
+
+def test_fills_under_limit_do_not_scan_directory(cache):
+    for number in range(10):
+        assert material_cache.get_cached_file(f'obj{number}', stat()) is not None
+
+    assert cache.scans == [1]  # только подъем индекса при первом обращении
+    assert (cache.dir / '.size').read_text() == '1000'
+    assert len(data_files(cache.dir)) == 10
+
+
+def test_over_limit_evicts_least_recently_used(cache):
+    for number in range(10):
+        material_cache.get_cached_file(f'obj{number}', stat())
+    os.utime(material_cache._path('obj0'), (0, 0))
+    os.utime(material_cache._path('obj1'), (1, 1))
+    material_cache.get_cached_file('obj1', stat())  # попадание освежает время доступа
+
+    material_cache.get_cached_file('obj10', stat())
+
+    assert (cache.dir / '.size').read_text() == '1000'
+    assert not os.path.exists(material_cache._path('obj0'))
+    assert os.path.exists(material_cache._path('obj1'))
+    assert material_cache._stats['evictions'] == 1
+
+
+def test_new_version_replaces_old_in_total(cache):
+    material_cache.get_cached_file('obj', stat())
+    material_cache.get_cached_file('obj', stat(etag='"v2"'))
+
+    assert (cache.dir / '.size').read_text() == '100'
+    assert material_cache.get_cached_file('obj', stat(etag='"v2"')).etag == 'v2'
+    assert len(data_files(cache.dir)) == 1
@@ -0,0 +1,113 @@
+"""
+Точное число SQL-запросов страницы расписания (первый и повторный
+просмотр) и выгрузок - одно и то же для одного и для MANY занятий:
+связи грузятся JOIN-ами, а не запросом на каждую строку.
+"""
+import datetime
+
+import pytest
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import BENCH_PASSWORD, PASSWORD_HASH, ensure_lookups, get_or_create, populate_schedule
+from my_university.models import Admin, AssessmentType, Curriculum, CurriculumDetail, Subject, User
+
+from conftest import QueryCounter
+
+MANY = 30
+
+
+@pytest.fixture
+def university(engine):
+    """Группа и преподаватель с одним занятием, группа и преподаватель с MANY занятиями, два плана"""
+    with Session(engine) as session:
+        one = populate_schedule(session, lessons=1, lessons_per_group=1, subjects=1)
+        many = populate_schedule(session, lessons=MANY, lessons_per_group=MANY, subjects=MANY)
+
+        lookups = ensure_lookups(session)
+        user = User(user_type_id=lookups['user_types']['admin'], hash_login='admin', hash_password=PASSWORD_HASH)
+        session.add(user)
+        session.flush()
+        session.add(Admin(user_id=user.user_id, full_name='Администратор'))
+
+        assessment = get_or_create(session, AssessmentType, assessment_type_name='Экзамен')
+        curriculums = {}
+        for key, subject_ids in (('one', one['subjects']), ('many', many['subjects'])):
+            curriculum = Curriculum(education_form_id=lookups['education_form'], education_level='Бакалавриат',
+                                    approval_year=datetime.date(2024, 9, 1))
+            session.add(curriculum)
+            session.flush()
+            session.add_all(
+                CurriculumDetail(curriculum_id=curriculum.curriculum_id, subject_id=subject_id,
+                                 assessment_type_id=assessment.assessment_type_id,
+                                 semester=1 + i % 8, hours_lecture=36)
+                for i, subject_id in enumerate(subject_ids)
+            )
+            curriculums[key] = curriculum.curriculum_id
+        session.commit()
+
+        assert session.query(Subject).count() == 1 + MANY
+
+    return {
+        'group': {'one': one['groups'][0], 'many': many['groups'][0]},
+        'teacher': {'one': one['teachers'][0], 'many': many['teachers'][0]},
+        'curriculum': curriculums,
+    }
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'login': 'admin', 'password': BENCH_PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+def count_queries(client, counter, url):
+    client.get('/schedule').close()  # прогрев справочников и сессии
+    counter.reset()
+    response = client.get(url)
+    body = response.get_data()
+    response.close()
+    assert response.status_code == 200
+    return counter.count, body
+
+
+# Первый просмотр: выборка снимка, затем на основном сервере - повторная
+# выборка снимка, владелец, занятия со связями (один JOIN), пары и запись снимка
+SCHEDULE_COLD_QUERIES = 6
+# Последующие просмотры: одна выборка снимка по первичному ключу
+SCHEDULE_WARM_QUERIES = 1
+
+
+@pytest.mark.parametrize('size', ['one', 'many'])
+@pytest.mark.parametrize('url', ['/schedule?group_id={group}', '/schedule?teacher_id={teacher}'])
+def test_schedule_view_queries(engine, university, client, url, size):
+    counter = QueryCounter(engine)
+    url = url.format(group=university['group'][size], teacher=university['teacher'][size])
+
+    cold, _ = count_queries(client, counter, url)
+    warm, _ = count_queries(client, counter, url)
+    assert (cold, warm) == (SCHEDULE_COLD_QUERIES, SCHEDULE_WARM_QUERIES)
+
+
+@pytest.mark.parametrize('size', ['one', 'many'])
+@pytest.mark.parametrize('url, expected', [
+    ('/schedule/export/csv?group_id={group}', 1),
+    ('/schedule/export/json?teacher_id={teacher}', 1),
+    ('/schedule/export/csv?all=1', 1),
+    # план, форма обучения, строки плана одним JOIN
+    ('/curriculums/{curriculum}/export/csv', 3),
+])
+def test_export_queries(engine, university, client, url, expected, size):
+    counter = QueryCounter(engine)
+    count, body = count_queries(client, counter, url.format(
+        group=university['group'][size], teacher=university['teacher'][size],
+        curriculum=university['curriculum'][size]))
+    assert count == expected
+    assert body
+
+
+def test_export_all_rows(engine, university, client):
+    counter = QueryCounter(engine)
+    _, body = count_queries(client, counter, '/schedule/export/csv?all=1')
+    assert body.decode('utf-8-sig').count('\n') >= 1 + MANY
@@ -0,0 +1,57 @@
+"""
+Потоковые выгрузки расписания: начало ответа уходит до чтения остальных
+строк, склеенный текст JSON совпадает с json.dumps.
+"""
+import datetime
+import json
+from types import SimpleNamespace
+
+from my_university.schedule_io import EXPORT_CHUNK_ROWS, iter_schedule_csv, iter_schedule_json
+
+ROWS = 2 * EXPORT_CHUNK_ROWS + 3
+
+
+def lesson(number):
+    return SimpleNamespace(
+        day_of_week=1 + number % 6,
+        time_start=datetime.time(8, 15),
+        time_end=datetime.time(9, 50),
+        subject_name=f'Дисциплина {number}',
+        lesson_type_name='Лекция',
+        class_name=f'А-{number}',
+        group_name='ГР-1',
+        full_name='Иванов Иван Иванович',
+    )
+
+
+def counted(rows, consumed):
+    for row in rows:
+        consumed.append(row)
+        yield row
+
+
+def test_json_starts_before_rows_are_read():
+    consumed = []
+    chunks = iter_schedule_json(counted((lesson(n) for n in range(ROWS)), consumed))
+
+    first = next(chunks)
+    assert first.startswith('[\n')
+    assert len(consumed) == 1
+
+    text = first + ''.join(chunks)
+    assert json.loads(text)[-1]['subject'] == f'Дисциплина {ROWS - 1}'
+    assert text == json.dumps(json.loads(text), ensure_ascii=False, indent=4)
+
+
+def test_json_empty():
+    assert ''.join(iter_schedule_json([])) == '[]'
+
+
+def test_csv_first_row_is_not_batched():
+    consumed = []
+    chunks = iter_schedule_csv(counted((lesson(n) for n in range(ROWS)), consumed))
+
+    assert next(chunks).startswith('Day,')
+    assert 'Дисциплина 0' in next(chunks)
+    assert len(consumed) == 1
+    assert ''.join(chunks).count('\n') == ROWS - 1